@@ -0,0 +1,15 @@
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002_history_indexes"
+down_revision = "0001_initial"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    op.create_index("ix_trades_user_id_created_at", "trades", ["user_id", sa.text("created_at DESC"), sa.text("id DESC")])
+    op.create_index("ix_sessions_user_id_started_at", "sessions", ["user_id", sa.text("started_at DESC"), sa.text("id DESC")])
+
+def downgrade():
+    op.drop_index("ix_sessions_user_id_started_at", table_name="sessions")
+    op.drop_index("ix_trades_user_id_created_at", table_name="trades")
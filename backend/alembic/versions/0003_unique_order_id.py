@@ -0,0 +1,20 @@
+from alembic import op
+
+revision = "0003_unique_order_id"
+down_revision = "0002_history_indexes"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # Tables made by create_all already have a plain index of this name
+    op.execute("DROP INDEX IF EXISTS ix_trades_order_id")
+    # Keep the first row of any order the journal wrote twice
+    op.execute(
+        "DELETE FROM trades WHERE order_id IS NOT NULL AND id NOT IN "
+        "(SELECT MIN(id) FROM trades WHERE order_id IS NOT NULL GROUP BY order_id)"
+    )
+    op.create_index("ix_trades_order_id", "trades", ["order_id"], unique=True)
+
+def downgrade():
+    op.drop_index("ix_trades_order_id", table_name="trades")
+    op.create_index("ix_trades_order_id", "trades", ["order_id"])
@@ -2,11 +2,17 @@ import sys
 import os
 import json
 import time
+import threading
+import socket
+import uuid
 import redis
+from concurrent.futures import ThreadPoolExecutor
 from iqoptionapi.stable_api import IQ_Option
 from iqoptionapi.api import IQOptionAPI
 from iqoptionapi.http.login import Login
 import iqoptionapi.global_value as global_value
+from .candles import store_candles, stream_key
+from . import wire
 
 # --- Monkey Patch to use auth.iqbroker.com and ws.iqoption.com ---
 def custom_login_post(self, data=None, headers=None):
@@ -35,14 +41,21 @@ def custom_connect(self):
 
     if check == True:
         self.re_subscribe_stream()
+        # balance_id arrives on the websocket thread; sleep between checks
+        # instead of spinning a core
+        deadline = time.time() + BALANCE_WAIT
         while global_value.balance_id == None:
-            pass
+            if time.time() > deadline:
+                return False, "timed out waiting for balance id"
+            time.sleep(0.05)
         self.position_change_all("subscribeMessage", global_value.balance_id)
         self.order_changed_all("subscribeMessage")
         self.api.setOptions(1, True)
         
     return check, reason
 
+BALANCE_WAIT = float(os.getenv("AGENT_BALANCE_WAIT", "20"))
+
 IQ_Option.connect = custom_connect
 # ----------------------------------------
 
@@ -61,6 +74,511 @@ def normalize_pair(pair):
         return f"{s}-OTC"
     return s
 
+def report_status(r, uid, mapping):
+    # Status hash for inspection plus a ready list that connecting clients
+    # BLPOP on, so nobody has to poll for the outcome
+    r.hset(f"agent:{uid}:status", mapping=mapping)
+    if mapping.get("status") in ("connected", "failed", "error"):
+        ready_key = f"agent:{uid}:ready"
+        pipe = r.pipeline()
+        pipe.lpush(ready_key, json.dumps({"status": mapping["status"], "error": mapping.get("error", "")}))
+        pipe.expire(ready_key, 60)
+        pipe.execute()
+
+
+# Candle streaming
+STREAM_POLL = float(os.getenv("CANDLE_STREAM_POLL", "0.1"))
+STREAM_MAXLEN = int(os.getenv("CANDLE_STREAM_MAXLEN", "1000"))
+STREAM_MAXDICT = 10
+
+
+class CandleStreamer(threading.Thread):
+    # Reads the websocket-fed realtime candle dict (no remote calls) and
+    # pushes every closed bar into candles:stream:{active}:{size}. Several
+    # agents may stream the same active; only the current owner publishes.
+    # Subscribing sends over the same websocket as get_candles, so it goes
+    # through run_on_lane (the agent's candles lane) rather than this thread.
+    def __init__(self, uid, r, get_api, active, duration, run_on_lane):
+        super().__init__(daemon=True)
+        self.uid = uid
+        self.r = r
+        self.get_api = get_api
+        self.run_on_lane = run_on_lane
+        self.active = active
+        self.duration = int(duration)
+        self.stream = stream_key(active, self.duration)
+        self.owner_key = f"{self.stream}:owner"
+        self.stop_event = threading.Event()
+
+    def _is_owner(self):
+        ttl = max(30, self.duration * 3)
+        if self.r.set(self.owner_key, self.uid, nx=True, ex=ttl):
+            return True
+        if self.r.get(self.owner_key) == self.uid:
+            self.r.expire(self.owner_key, ttl)
+            return True
+        return False
+
+    def _publish_closed(self, candle):
+        if not self._is_owner():
+            return
+        store_candles(self.active, self.duration, [candle], refreshed_at=time.time())
+        fields = {k: candle.get(k) for k in ("from", "to", "open", "close", "min", "max", "volume") if candle.get(k) is not None}
+        fields["active"] = self.active
+        fields["size"] = self.duration
+        self.r.xadd(self.stream, fields, maxlen=STREAM_MAXLEN, approximate=True)
+
+    def run(self):
+        api = None
+        last_from = None
+        last_candle = None
+        last_store = 0.0
+        print(f"[Agent {self.uid}] Streaming candles {self.active} {self.duration}s")
+        while not self.stop_event.is_set():
+            current = self.get_api()
+            if current is not api:
+                # New websocket after a reconnect: subscribe again
+                try:
+                    self.run_on_lane(current.start_candles_stream, self.active, self.duration, STREAM_MAXDICT)
+                    api = current
+                except Exception as e:
+                    print(f"[Agent {self.uid}] start_candles_stream failed for {self.active}: {e}")
+                    self.stop_event.wait(2)
+                    continue
+            try:
+                candles = dict(api.get_realtime_candles(self.active, self.duration) or {})
+                if candles:
+                    newest_from = max(candles)
+                    newest = dict(candles[newest_from])
+                    if last_from is not None and newest_from > last_from:
+                        self._publish_closed(dict(candles.get(last_from) or last_candle))
+                    last_from = newest_from
+                    last_candle = newest
+                    now = time.time()
+                    if now - last_store >= 1.0 and self._is_owner():
+                        store_candles(self.active, self.duration, [newest])
+                        last_store = now
+            except Exception as e:
+                print(f"[Agent {self.uid}] Candle stream error for {self.active}: {e}")
+            self.stop_event.wait(STREAM_POLL)
+        try:
+            if api is not None:
+                self.run_on_lane(api.stop_candles_stream, self.active, self.duration)
+        except Exception:
+            pass
+
+    def stop(self):
+        self.stop_event.set()
+
+
+# Trade settlement
+SETTLEMENT_STREAM = "trades:settlements"
+SETTLE_POLL = float(os.getenv("SETTLE_POLL", "0.5"))
+SETTLE_GRACE = int(os.getenv("SETTLE_GRACE", "120"))
+
+
+class SettlementWatcher(threading.Thread):
+    # Watches orders placed for a session and publishes one settlement event
+    # per order to trades:settlements. Outcomes come from the position-changed
+    # / option-closed messages iqoptionapi already files under order_async, so
+    # waiting costs no remote calls.
+    def __init__(self, uid, r, get_api):
+        super().__init__(daemon=True)
+        self.uid = uid
+        self.r = r
+        self.get_api = get_api
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def watch(self, order_id, data):
+        expiry = int(data.get("expiry_seconds") or 60 * int(data.get("duration") or 1))
+        with self.lock:
+            self.pending[order_id] = {
+                "session_id": data.get("session_id") or "",
+                "deadline": time.time() + expiry + SETTLE_GRACE,
+            }
+
+    @staticmethod
+    def _outcome(api, order_id):
+        order = api.get_async_order(order_id) or {}
+        closed = order.get("option-closed")
+        if closed:
+            msg = closed.get("msg") or {}
+            return msg.get("result"), float(msg.get("profit_amount") or 0) - float(msg.get("amount") or 0)
+        changed = order.get("position-changed")
+        if changed:
+            msg = changed.get("msg") or {}
+            if msg.get("status") == "closed":
+                pnl = msg.get("pnl")
+                if pnl is None:
+                    pnl = float(msg.get("close_profit") or 0) - float(msg.get("invest") or 0)
+                return msg.get("close_reason"), float(pnl)
+        return None
+
+    def _publish(self, order_id, meta, status, result, pnl):
+        print(f"[Agent {self.uid}] Settlement {order_id}: {status} {result} {pnl}")
+        self.r.xadd(SETTLEMENT_STREAM, {
+            "uid": self.uid,
+            "session_id": meta["session_id"],
+            "order_id": str(order_id),
+            "status": status,
+            "result": result or "",
+            "pnl": pnl,
+        }, maxlen=10000, approximate=True)
+
+    def run(self):
+        while not self.stop_event.wait(SETTLE_POLL):
+            with self.lock:
+                pending = list(self.pending.items())
+            for order_id, meta in pending:
+                try:
+                    outcome = self._outcome(self.get_api(), order_id)
+                    if outcome is not None:
+                        self._publish(order_id, meta, "closed", outcome[0], outcome[1])
+                    elif time.time() > meta["deadline"]:
+                        self._publish(order_id, meta, "timeout", "", 0.0)
+                    else:
+                        continue
+                    with self.lock:
+                        self.pending.pop(order_id, None)
+                except Exception as e:
+                    print(f"[Agent {self.uid}] Settlement check failed for {order_id}: {e}")
+
+    def stop(self):
+        self.stop_event.set()
+
+
+# Commands run on per-type lanes so a long check_win or a slow get_candles
+# never holds up ping / get_balance. iqoptionapi keeps one shared result
+# slot per request type (candles, buy, option info), so the IQ-facing lanes
+# stay single-threaded; concurrency comes from running the lanes side by side.
+LANES = {
+    "fast": 2,
+    "candles": 1,
+    "trade": 1,
+    "settle": 1,
+}
+AGENT_HEARTBEAT = 5
+# agent:{uid}:owner names the one agent allowed to serve the account. A new
+# agent takes it over before subscribing; an older one (hung in a reconnect,
+# or on another host) sees it has lost the key and exits without executing
+# further commands, so two agents never both act on agent:{uid}:cmd.
+OWNER_TTL = AGENT_HEARTBEAT * 12
+_RENEW_OWNER = """
+local current = redis.call('GET', KEYS[1])
+if current and current ~= ARGV[1] then
+  return 0
+end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+COMMAND_LANES = {
+    "get_candles": "candles",
+    "get_candles_multi": "candles",
+    "buy": "trade",
+    "check_win": "settle",
+}
+
+
+class Agent:
+    def __init__(self, uid, email, password, account_type, r, api):
+        self.uid = uid
+        self.email = email
+        self.password = password
+        self.account_type = account_type
+        self.r = r
+        self.api = api
+        self.streamers = {}
+        # subscribe/unsubscribe run on the multi-worker fast lane
+        self.streamers_lock = threading.Lock()
+        self.settlements = SettlementWatcher(uid, r, lambda: self.api)
+        self.settlements.start()
+        self.reconnect_lock = threading.Lock()
+        self.lanes = {name: ThreadPoolExecutor(max_workers=n, thread_name_prefix=f"agent-{name}") for name, n in LANES.items()}
+        self.owner_key = f"agent:{uid}:owner"
+        self.owner_token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.renew_owner = r.register_script(_RENEW_OWNER)
+        self.superseded = False
+
+    def _still_owner(self) -> bool:
+        if self.renew_owner(keys=[self.owner_key], args=[self.owner_token, OWNER_TTL]):
+            return True
+        print(f"[Agent {self.uid}] Replaced by {self.r.get(self.owner_key)}. Exiting.")
+        self.superseded = True
+        return False
+
+    # --- connection -----------------------------------------------------
+
+    def ensure_connected(self, context=""):
+        # Serialised so concurrent lanes don't reconnect on top of each other
+        with self.reconnect_lock:
+            if self.api.check_connect():
+                return True
+            print(f"[Agent {self.uid}] Connection lost{context}. Reconnecting...")
+            check_recon, reason_recon = self.api.connect()
+            if check_recon:
+                self.api.change_balance(self.account_type)
+                return True
+            print(f"[Agent {self.uid}] Reconnect{context} failed: {reason_recon}")
+            return False
+
+    def force_reconnect(self):
+        with self.reconnect_lock:
+            check_recon, reason_recon = self.api.connect()
+            if check_recon:
+                self.api.change_balance(self.account_type)
+            return check_recon, reason_recon
+
+    def reinitialize(self):
+        # Aggressive reconnect: throw away the client and build a new one
+        with self.reconnect_lock:
+            api = IQ_Option(self.email, self.password)
+            check_recon, reason_recon = api.connect()
+            if not check_recon:
+                raise RuntimeError(f"reconnect failed: {reason_recon}")
+            api.change_balance(self.account_type)
+            self.api = api
+
+    # --- commands -------------------------------------------------------
+
+    def cmd_get_balance(self, data):
+        return self.api.get_balance()
+
+    def cmd_buy(self, data):
+        amount = data.get("amount")
+        raw_active = data.get("active")
+        active = normalize_pair(raw_active)
+        action = data.get("action") # "call" or "put"
+        duration = data.get("duration")
+
+        # Check connection
+        if not self.api.check_connect():
+            print(f"[Agent {self.uid}] Connection lost before buy. Reconnecting...")
+            if not self.ensure_connected(" before buy"):
+                print(f"[Agent {self.uid}] Reconnect before buy failed.")
+
+        print(f"[Agent {self.uid}] Placing trade: {active} {action} ${amount} (duration: {duration})")
+        check_buy, id_buy = self.api.buy(amount, active, action, duration)
+
+        if check_buy:
+            print(f"[Agent {self.uid}] Trade placed successfully. ID: {id_buy}")
+            self._watch_order(id_buy, data)
+            return id_buy
+
+        print(f"[Agent {self.uid}] Trade placement failed. Result: {check_buy}, {id_buy}")
+        wire.publish(self.r, f"logs:{self.uid}", {
+            "type": "error",
+            "message": f"Trade placement failed for {active}: {id_buy}",
+            "timestamp": time.time()
+        })
+        # Try one reconnect and retry
+        print(f"[Agent {self.uid}] Retrying trade after reconnect...")
+        if not self.force_reconnect()[0]:
+            raise RuntimeError("Buy failed and reconnect failed")
+        check_buy, id_buy = self.api.buy(amount, active, action, duration)
+        if check_buy:
+            print(f"[Agent {self.uid}] Retry trade success. ID: {id_buy}")
+            self._watch_order(id_buy, data)
+            return id_buy
+        print(f"[Agent {self.uid}] Retry trade failed.")
+        raise RuntimeError(f"Buy failed: {id_buy}")
+
+    def _watch_order(self, order_id, data):
+        # Orders placed for a session settle through trades:settlements
+        if data.get("session_id"):
+            self.settlements.watch(order_id, data)
+
+    def cmd_check_win(self, data):
+        id_number = data.get("order_id")
+        return self.api.check_win_v3(id_number)
+
+    def _fetch_candles(self, raw_active, duration, count, timestamp):
+        active = normalize_pair(raw_active)
+        try:
+            self.ensure_connected(" inside get_candles")
+
+            # Debug log
+            print(f"[Agent {self.uid}] Requesting candles: {active} (raw: {raw_active}), {duration}, {count}, {timestamp}")
+            candles = self.api.get_candles(active, duration, count, timestamp)
+            print(f"[Agent {self.uid}] get_candles returned type: {type(candles)}, value: {candles[:1] if isinstance(candles, list) and candles else candles}")
+
+            # iqoptionapi might return empty list or None on failure without raising
+            if not candles:
+                print(f"[Agent {self.uid}] get_candles returned empty. Attempting reconnect...")
+                check_recon, reason_recon = self.force_reconnect()
+                if check_recon:
+                    candles = self.api.get_candles(active, duration, count, timestamp)
+                else:
+                    print(f"[Agent {self.uid}] Reconnect failed inside get_candles: {reason_recon}")
+            return candles
+        except Exception as e:
+            print(f"[Agent {self.uid}] get_candles error: {e}")
+            print(f"[Agent {self.uid}] Attempting reconnect due to error...")
+
+            try:
+                self.reinitialize()
+                print(f"[Agent {self.uid}] Reinitialized API client.")
+            except Exception as recon_e:
+                print(f"[Agent {self.uid}] Reinit failed: {recon_e}")
+
+            time.sleep(2) # Prevent tight loop
+
+            try:
+                return self.api.get_candles(active, duration, count, timestamp)
+            except Exception as retry_e:
+                print(f"[Agent {self.uid}] Retry failed: {retry_e}")
+                return []
+
+    def _run_on_candles_lane(self, fn, *args):
+        # Candle subscriptions share the lane with get_candles so the two
+        # never write to the websocket at the same time
+        return self.lanes["candles"].submit(fn, *args).result()
+
+    def cmd_get_candles(self, data):
+        # duration: seconds usually, or 60, 300 etc; timestamp: end time
+        return self._fetch_candles(data.get("active"), data.get("duration"), data.get("count"), data.get("timestamp"))
+
+    def cmd_get_candles_multi(self, data):
+        # One message for several actives: {"actives": [...], "duration", "count", "timestamp"}
+        # Returns {active: candles} keyed by the actives as sent
+        result = {}
+        for raw_active in data.get("actives") or []:
+            result[raw_active] = self._fetch_candles(raw_active, data.get("duration"), data.get("count"), data.get("timestamp")) or []
+        return result
+
+    def cmd_subscribe_candles(self, data):
+        active = normalize_pair(data.get("active"))
+        duration = int(data.get("duration") or 60)
+        with self.streamers_lock:
+            streamer = self.streamers.get((active, duration))
+            if streamer is None or not streamer.is_alive():
+                streamer = CandleStreamer(self.uid, self.r, lambda: self.api, active, duration, self._run_on_candles_lane)
+                streamer.start()
+                self.streamers[(active, duration)] = streamer
+        return streamer.stream
+
+    def cmd_unsubscribe_candles(self, data):
+        active = normalize_pair(data.get("active"))
+        duration = int(data.get("duration") or 60)
+        with self.streamers_lock:
+            streamer = self.streamers.pop((active, duration), None)
+        if streamer:
+            streamer.stop()
+        self.r.srem(f"agent:{self.uid}:streams", f"{active}:{duration}")
+        return "ok"
+
+    def cmd_change_balance(self, data):
+        self.api.change_balance(data.get("account_type"))
+        return "ok"
+
+    def cmd_ping(self, data):
+        return "pong"
+
+    def execute(self, data):
+        cmd = data.get("cmd")
+        cmd_id = data.get("id")
+        # Clients with a persistent RPC channel name their reply channel
+        reply_to = data.get("reply_to") or f"agent:{self.uid}:resp:{cmd_id}"
+        response = {"id": cmd_id, "status": "ok"}
+        handler = getattr(self, f"cmd_{cmd}", None)
+        try:
+            if handler is None:
+                raise ValueError(f"unknown command: {cmd}")
+            result = handler(data)
+            if data.get("layout") == wire.COLUMNS:
+                if cmd == "get_candles":
+                    result = wire.to_columns(result)
+                elif cmd == "get_candles_multi":
+                    result = {active: wire.to_columns(candles) for active, candles in result.items()}
+            response["result"] = result
+        except Exception as e:
+            print(f"[Agent {self.uid}] {cmd} command exception: {e}")
+            response["status"] = "error"
+            response["error"] = str(e)
+        # Publish response if cmd_id provided
+        if cmd_id:
+            self.r.publish(reply_to, wire.dumps(response, wire.negotiate(data.get("fmt"))))
+
+    # --- main loop ------------------------------------------------------
+
+    def serve(self):
+        # Take the account over from any older agent before listening
+        self.r.set(self.owner_key, self.owner_token, ex=OWNER_TTL)
+        # Fresh process: no candle streams are running yet
+        self.r.delete(f"agent:{self.uid}:streams")
+
+        # Subscribe to command channel
+        pubsub = self.r.pubsub()
+        cmd_channel = f"agent:{self.uid}:cmd"
+        pubsub.subscribe(cmd_channel)
+
+        print(f"[Agent {self.uid}] Listening on {cmd_channel}...")
+
+        last_beat = 0.0
+        while True:
+            try:
+                # Liveness for clients whose ping is slow while the agent is busy
+                if time.time() - last_beat >= AGENT_HEARTBEAT:
+                    if not self._still_owner():
+                        break
+                    last_beat = time.time()
+                    self.r.hset(f"agent:{self.uid}:status", "heartbeat", last_beat)
+
+                message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message:
+                    # Checked per command: a newer agent may have taken over
+                    # while this one was stuck
+                    if not self._still_owner():
+                        break
+                    data = json.loads(message["data"])
+                    cmd = data.get("cmd")
+                    print(f"[Agent {self.uid}] Received command: {cmd} (id: {data.get('id')})")
+                    if cmd == "stop":
+                        print(f"[Agent {self.uid}] Stopping...")
+                        break
+                    self.lanes[COMMAND_LANES.get(cmd, "fast")].submit(self.execute, data)
+
+                # Check connection periodically
+                # (skipped while a lane is already reconnecting, so dispatch never stalls)
+                if not self.api.check_connect() and self.reconnect_lock.acquire(blocking=False):
+                    try:
+                        print(f"[Agent {self.uid}] Connection lost. Reconnecting...")
+                        check_recon, reason_recon = self.api.connect()
+                        if not check_recon:
+                            print(f"[Agent {self.uid}] Reconnection failed: {reason_recon}. Exiting.")
+                            report_status(self.r, self.uid, {"status": "failed", "error": str(reason_recon)})
+                            break
+                        print(f"[Agent {self.uid}] Reconnected.")
+                        self.api.change_balance(self.account_type)
+                    finally:
+                        self.reconnect_lock.release()
+
+            except Exception as e:
+                print(f"[Agent {self.uid}] Error in loop: {e}")
+
+        try:
+            pubsub.close()
+        except Exception:
+            pass
+
+    def shutdown(self):
+        self.settlements.stop()
+        with self.streamers_lock:
+            streamers = list(self.streamers.values())
+        for streamer in streamers:
+            streamer.stop()
+        for lane in self.lanes.values():
+            lane.shutdown(wait=False, cancel_futures=True)
+        if self.superseded:
+            # The account's keys belong to the agent that replaced this one
+            return
+        self.r.delete(f"agent:{self.uid}:streams")
+        if self.r.get(self.owner_key) == self.owner_token:
+            self.r.delete(self.owner_key)
+
+
 def main():
     if len(sys.argv) < 4:
         print("Usage: agent.py <uid> <email> <password> [account_type]")
@@ -70,7 +588,11 @@ def main():
     email = sys.argv[2]
     password = sys.argv[3]
     account_type = sys.argv[4] if len(sys.argv) > 4 else "PRACTICE"
+    run(uid, email, password, account_type)
 
+
+def run(uid, email, password, account_type="PRACTICE"):
+    # Entry point shared by the CLI and agent_host's forked children
     print(f"[Agent {uid}] Starting for {email}...")
 
     try:
@@ -84,7 +606,7 @@ def main():
     api = IQ_Option(email, password)
     
     # Register PID immediately
-    r.hmset(f"agent:{uid}:status", {
+    report_status(r, uid, {
         "status": "starting",
         "pid": os.getpid(),
         "error": "",
@@ -97,7 +619,7 @@ def main():
     for i in range(5):
         try:
             print(f"[Agent {uid}] Connection attempt {i+1}/5...")
-            r.hmset(f"agent:{uid}:status", {
+            report_status(r, uid, {
                 "status": "connecting",
                 "pid": os.getpid(),
                 "error": "",
@@ -119,7 +641,7 @@ def main():
                 print(f"[Agent {uid}] Rate limit exceeded. Waiting {ttl}s...")
                 
                 # Report error to Redis so frontend knows immediately
-                r.hmset(f"agent:{uid}:status", {
+                report_status(r, uid, {
                     "status": "error",
                     "error": str(reason),
                     "updated_at": int(time.time())
@@ -128,7 +650,7 @@ def main():
                 time.sleep(ttl)
                 continue
 
-            r.hmset(f"agent:{uid}:status", {
+            report_status(r, uid, {
                 "status": "error",
                 "error": str(reason),
                 "updated_at": int(time.time())
@@ -136,7 +658,7 @@ def main():
             print(f"[Agent {uid}] Connection failed: {reason}. Retrying in 2s...")
         except Exception as e:
             reason = str(e)
-            r.hmset(f"agent:{uid}:status", {
+            report_status(r, uid, {
                 "status": "error",
                 "error": reason,
                 "updated_at": int(time.time())
@@ -149,8 +671,8 @@ def main():
         api.change_balance(account_type)
         
         # Set status in Redis
-        r.hmset(f"agent:{uid}:status", {
-            "status": "connected", 
+        report_status(r, uid, {
+            "status": "connected",
             "pid": os.getpid(),
             "start_time": time.time()
         })
@@ -166,189 +688,28 @@ def main():
                 
             log_msg = f"IQ Option connected: {email} (Balance: {balance} {currency})"
             print(f"[Agent {uid}] Publishing log: {log_msg}")
-            r.publish(f"logs:{uid}", json.dumps({
+            wire.publish(r, f"logs:{uid}", {
                 "type": "log",
                 "message": log_msg,
                 "timestamp": time.time()
-            }))
+            })
         except Exception as log_err:
             print(f"[Agent {uid}] Failed to publish connect log: {log_err}")
         
         sys.stdout.flush()
         
-        # Subscribe to command channel
-        pubsub = r.pubsub()
-        cmd_channel = f"agent:{uid}:cmd"
-        pubsub.subscribe(cmd_channel)
-        
-        print(f"[Agent {uid}] Listening on {cmd_channel}...")
-        
-        while True:
-            try:
-                message = pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
-                if message:
-                    data = json.loads(message["data"])
-                    cmd = data.get("cmd")
-                    cmd_id = data.get("id")
-                    
-                    print(f"[Agent {uid}] Received command: {cmd} (id: {cmd_id})")
-                    
-                    response = {"id": cmd_id, "status": "ok"}
-                    
-                    if cmd == "get_balance":
-                        bal = api.get_balance()
-                        response["result"] = bal
-                        
-                    elif cmd == "buy":
-                        amount = data.get("amount")
-                        raw_active = data.get("active")
-                        active = normalize_pair(raw_active)
-                        action = data.get("action") # "call" or "put"
-                        duration = data.get("duration")
-                        
-                        try:
-                            # Check connection
-                            if not api.check_connect():
-                                print(f"[Agent {uid}] Connection lost before buy. Reconnecting...")
-                                if api.connect()[0]:
-                                    api.change_balance(account_type)
-                                else:
-                                    print(f"[Agent {uid}] Reconnect before buy failed.")
-
-                            print(f"[Agent {uid}] Placing trade: {active} {action} ${amount} (duration: {duration})")
-                            check_buy, id_buy = api.buy(amount, active, action, duration)
-                            
-                            if check_buy:
-                                print(f"[Agent {uid}] Trade placed successfully. ID: {id_buy}")
-                                response["result"] = id_buy
-                            else:
-                                print(f"[Agent {uid}] Trade placement failed. Result: {check_buy}, {id_buy}")
-                                r.publish(f"logs:{uid}", json.dumps({
-                                    "type": "error",
-                                    "message": f"Trade placement failed for {active}: {id_buy}",
-                                    "timestamp": time.time()
-                                }))
-                                # Try one reconnect and retry
-                                print(f"[Agent {uid}] Retrying trade after reconnect...")
-                                if api.connect()[0]:
-                                    api.change_balance(account_type)
-                                    check_buy, id_buy = api.buy(amount, active, action, duration)
-                                    if check_buy:
-                                        print(f"[Agent {uid}] Retry trade success. ID: {id_buy}")
-                                        response["result"] = id_buy
-                                    else:
-                                        print(f"[Agent {uid}] Retry trade failed.")
-                                        response["status"] = "error"
-                                        response["error"] = f"Buy failed: {id_buy}"
-                                else:
-                                    response["status"] = "error"
-                                    response["error"] = "Buy failed and reconnect failed"
-                        except Exception as e:
-                            print(f"[Agent {uid}] Buy command exception: {e}")
-                            response["status"] = "error"
-                            response["error"] = str(e)
-                            
-                    elif cmd == "check_win":
-                        id_number = data.get("order_id")
-                        res = api.check_win_v3(id_number)
-                        response["result"] = res
-
-                    elif cmd == "get_candles":
-                        raw_active = data.get("active")
-                        active = normalize_pair(raw_active)
-                        duration = data.get("duration") # seconds usually, or 60, 300 etc
-                        count = data.get("count")
-                        timestamp = data.get("timestamp") # end time
-                        
-                        try:
-                            if not api.check_connect():
-                                print(f"[Agent {uid}] Connection lost. Reconnecting...")
-                                check_recon, reason_recon = api.connect()
-                                if check_recon:
-                                    api.change_balance(account_type)
-                                else:
-                                    print(f"[Agent {uid}] Reconnect inside get_candles failed: {reason_recon}")
-
-                            # Debug log
-                            print(f"[Agent {uid}] Requesting candles: {active} (raw: {raw_active}), {duration}, {count}, {timestamp}")
-                            candles = api.get_candles(active, duration, count, timestamp)
-                            print(f"[Agent {uid}] get_candles returned type: {type(candles)}, value: {candles[:1] if isinstance(candles, list) and candles else candles}")
-                            
-                            # iqoptionapi might return empty list or None on failure without raising
-                            if not candles:
-                                print(f"[Agent {uid}] get_candles returned empty. Attempting reconnect...")
-                                check_recon, reason_recon = api.connect()
-                                if check_recon:
-                                    api.change_balance(account_type)
-                                    candles = api.get_candles(active, duration, count, timestamp)
-                                else:
-                                    print(f"[Agent {uid}] Reconnect failed inside get_candles: {reason_recon}")
-                                
-                            response["result"] = candles
-                        except Exception as e:
-                            print(f"[Agent {uid}] get_candles error: {e}")
-                            print(f"[Agent {uid}] Attempting reconnect due to error...")
-                            
-                            # Aggressive reconnect
-                            try:
-                                api = IQ_Option(email, password)
-                                check_recon, reason_recon = api.connect()
-                                if not check_recon:
-                                    raise RuntimeError(f"reconnect failed: {reason_recon}")
-                                api.change_balance(account_type)
-                                print(f"[Agent {uid}] Reinitialized API client.")
-                            except Exception as recon_e:
-                                print(f"[Agent {uid}] Reinit failed: {recon_e}")
-                            
-                            time.sleep(2) # Prevent tight loop
-                            
-                            try:
-                                candles = api.get_candles(active, duration, count, timestamp)
-                                response["result"] = candles
-                            except Exception as retry_e:
-                                print(f"[Agent {uid}] Retry failed: {retry_e}")
-                                response["result"] = []
-
-                    elif cmd == "change_balance":
-                        act = data.get("account_type")
-                        api.change_balance(act)
-                        response["result"] = "ok"
-
-                    elif cmd == "ping":
-                        response["result"] = "pong"
-                    
-                    elif cmd == "stop":
-                        print(f"[Agent {uid}] Stopping...")
-                        break
-                    
-                    # Publish response if cmd_id provided
-                    if cmd_id:
-                        r.publish(f"agent:{uid}:resp:{cmd_id}", json.dumps(response))
-                
-                # Check connection periodically
-                if not api.check_connect():
-                    print(f"[Agent {uid}] Connection lost. Reconnecting...")
-                    check_recon, reason_recon = api.connect()
-                    if not check_recon:
-                        print(f"[Agent {uid}] Reconnection failed: {reason_recon}. Exiting.")
-                        r.hset(f"agent:{uid}:status", "status", "failed")
-                        break
-                    print(f"[Agent {uid}] Reconnected.")
-                    api.change_balance(account_type)
-
-            except Exception as e:
-                print(f"[Agent {uid}] Error in loop: {e}")
-                if 'cmd_id' in locals() and cmd_id:
-                    r.publish(f"agent:{uid}:resp:{cmd_id}", json.dumps({"id": cmd_id, "status": "error", "error": str(e)}))
+        agent = Agent(uid, email, password, account_type, r, api)
+        agent.serve()
 
     else:
         print(f"[Agent {uid}] Login failed: {reason}")
-        r.hset(f"agent:{uid}:status", "status", "failed")
-        r.hset(f"agent:{uid}:status", "error", str(reason))
+        report_status(r, uid, {"status": "failed", "error": str(reason)})
         sys.exit(1)
 
     # Cleanup
-    r.delete(f"agent:{uid}:status")
+    agent.shutdown()
+    if not agent.superseded:
+        r.delete(f"agent:{uid}:status")
     print(f"[Agent {uid}] Exited.")
 
 if __name__ == "__main__":
@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import redis
+
+# Import the agent (and with it iqoptionapi) once in the host; forked
+# children inherit the loaded modules instead of paying interpreter start
+# and import cost per account.
+from . import agent as agent_module
+from .credentials import decrypt
+
+redis_host = os.getenv("REDIS_HOST", "127.0.0.1")
+redis_port = int(os.getenv("REDIS_PORT", "6379"))
+r = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
+
+SPAWN_QUEUE = "agent:host:spawn"
+MAX_AGENTS = int(os.getenv("AGENT_HOST_MAX_AGENTS", "200"))
+HOST_ID = os.getenv("AGENT_HOST_ID") or f"{socket.gethostname()}:{os.getpid()}"
+
+# iqoptionapi keeps login and balance state in module globals
+# (global_value), so accounts cannot share an interpreter safely. Each
+# account gets a forked child: its own websocket and globals, but
+# copy-on-write pages for everything imported here.
+children = {}  # uid -> pid
+
+
+def _reap() -> None:
+    while children:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            children.clear()
+            return
+        if pid == 0:
+            return
+        for uid, child in list(children.items()):
+            if child == pid:
+                del children[uid]
+                print(f"[AgentHost] Agent {uid} (pid {pid}) exited")
+
+
+def _stop(uid: str) -> None:
+    pid = children.pop(uid, None)
+    if not pid:
+        return
+    try:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        pass
+
+
+def _child(uid: str, email: str, password: str, account_type: str) -> None:
+    code = 0
+    try:
+        log_file = open(f"agent_{uid}.log", "w")
+        os.dup2(log_file.fileno(), sys.stdout.fileno())
+        os.dup2(log_file.fileno(), sys.stderr.fileno())
+        agent_module.run(uid, email, password, account_type)
+    except SystemExit as e:
+        code = e.code if isinstance(e.code, int) else 1
+    except Exception as e:
+        print(f"[Agent] Critical error: {e}")
+        import traceback
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)
+
+
+def _spawn(request: dict) -> None:
+    uid = request["uid"]
+    try:
+        password = decrypt(request["password_enc"])
+    except Exception as e:
+        # Through report_status so the waiting client hears LOGIN_FAILED now
+        agent_module.report_status(r, uid, {"status": "failed", "error": f"credential error: {e}", "updated_at": int(time.time())})
+        return
+    # A new login for the same account replaces the old connection
+    _stop(uid)
+    pid = os.fork()
+    if pid == 0:
+        _child(uid, request["username"], password, request.get("account_type") or "PRACTICE")
+    children[uid] = pid
+    print(f"[AgentHost] Spawned agent {uid} (pid {pid}), {len(children)}/{MAX_AGENTS} running")
+
+
+def run():
+    print(f"[AgentHost {HOST_ID}] Serving up to {MAX_AGENTS} agents from {SPAWN_QUEUE}")
+    while True:
+        try:
+            _reap()
+            r.hset(f"agent:host:{HOST_ID}", mapping={"agents": len(children), "capacity": MAX_AGENTS, "updated_at": int(time.time())})
+            r.expire(f"agent:host:{HOST_ID}", 30)
+            if len(children) >= MAX_AGENTS:
+                # Backpressure: leave requests queued for a host with room
+                time.sleep(1)
+                continue
+            item = r.blpop(SPAWN_QUEUE, timeout=1)
+            if not item:
+                continue
+            request = json.loads(item[1])
+            if request.get("expires_at") and request["expires_at"] < time.time():
+                # The caller has already given up waiting
+                continue
+            _spawn(request)
+        except Exception as e:
+            print(f"[AgentHost] Error: {e}")
+            time.sleep(1)
+
+
+if __name__ == "__main__":
+    run()
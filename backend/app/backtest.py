@@ -0,0 +1,197 @@
+"""Offline backtests of the registered strategies over stored candles.
+
+    python -m app.backtest data/EURUSD-OTC.csv data/GBPUSD.json \\
+        --timeframe 60 --timeframe 300 --expiry 1 --payout 0.85
+
+Files are CSV (a header with from/time, open, close, max/high, min/low,
+volume) or JSON (a list of IQ Option candle dicts, or one dict per line).
+The pair is taken from the file name. Candles are resampled to each
+requested timeframe.
+
+A signal is evaluated on each closed bar exactly as check_rules sees it
+live (last = that bar, prev = the one before). The trade is entered at
+that bar's close and settled ``expiry`` bars later. A win pays
+``amount * payout``, a loss costs ``amount``, and an unchanged price is
+refunded. Like a live session, a pair holds one trade at a time and rests for
+``cooldown`` seconds from each entry.
+"""
+import os
+import sys
+import json
+import argparse
+from multiprocessing import Pool
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+from .indicators import TENSOR_FIELDS, CLOSE
+from .strategies import STRATEGIES
+
+# Array columns: open time plus the candle tensor fields
+COLUMNS = ("from",) + TENSOR_FIELDS
+_ALIASES = {"from": ("from", "time", "timestamp", "at"), "max": ("max", "high"), "min": ("min", "low")}
+
+
+def load_candles(path: str) -> np.ndarray:
+    """Candles from a CSV or JSON file as a (bars, COLUMNS) float array, oldest first."""
+    if path.endswith(".csv"):
+        df = pd.read_csv(path)
+    else:
+        with open(path) as f:
+            text = f.read().strip()
+        df = pd.DataFrame(json.loads(text) if text.startswith("[") else [json.loads(line) for line in text.splitlines() if line.strip()])
+    data = np.zeros((len(df), len(COLUMNS)))
+    for i, name in enumerate(COLUMNS):
+        for key in _ALIASES.get(name, (name,)):
+            if key in df.columns:
+                data[:, i] = df[key].astype(float).to_numpy()
+                break
+    return data[np.argsort(data[:, 0], kind="stable")]
+
+
+def resample(data: np.ndarray, timeframe: int) -> np.ndarray:
+    # Aggregates finer bars into ``timeframe``; coarser data is returned as is
+    if len(data) < 2 or data[1, 0] - data[0, 0] >= timeframe:
+        return data
+    start = data[:, 0] // timeframe * timeframe
+    first = np.flatnonzero(np.r_[True, start[1:] != start[:-1]])
+    last = np.r_[first[1:] - 1, len(data) - 1]
+    out = np.empty((len(first), len(COLUMNS)))
+    col = COLUMNS.index
+    out[:, col("from")] = start[first]
+    out[:, col("open")] = data[first, col("open")]
+    out[:, col("close")] = data[last, col("close")]
+    out[:, col("max")] = np.maximum.reduceat(data[:, col("max")], first)
+    out[:, col("min")] = np.minimum.reduceat(data[:, col("min")], first)
+    out[:, col("volume")] = np.add.reduceat(data[:, col("volume")], first)
+    return out
+
+
+class _Row:
+    # One bar of the indicator columns, read like the dict check_rules gets
+    __slots__ = ("columns", "t")
+
+    def __init__(self, columns: Dict[str, list], t: int):
+        self.columns = columns
+        self.t = t
+
+    def __getitem__(self, name: str) -> float:
+        return self.columns[name][self.t]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+
+def _signals(strategy, tensor: np.ndarray) -> List[Tuple[int, str]]:
+    # (bar index, direction) for every bar with a signal. Indicator columns
+    # come from the vectorised batch path over the whole history in one
+    # pass; only the rules run per bar.
+    columns = {field: tensor[:, :, i] for i, field in enumerate(TENSOR_FIELDS)}
+    for ind in strategy.indicators():
+        columns.update(ind.batch(tensor))
+    columns = {name: values[0].tolist() for name, values in columns.items()}
+    found = []
+    prev = _Row(columns, 0)
+    for t in range(1, tensor.shape[1]):
+        last = _Row(columns, t)
+        signal = strategy.check_rules(None, last, prev)
+        if signal and signal.get("direction") in ("CALL", "PUT"):
+            found.append((t, signal["direction"]))
+        prev = last
+    return found
+
+
+def simulate(close: np.ndarray, signals: List[Tuple[int, str]], expiry: int, cooldown: int,
+             payout: float, amount: float, warmup: int = 50) -> Dict[str, Any]:
+    pnl: List[float] = []
+    wins = losses = ties = 0
+    free_at = warmup
+    for t, direction in signals:
+        if t < free_at or t + expiry >= len(close):
+            continue
+        move = close[t + expiry] - close[t]
+        if move == 0:
+            ties += 1
+            pnl.append(0.0)
+        elif (move > 0) == (direction == "CALL"):
+            wins += 1
+            pnl.append(amount * payout)
+        else:
+            losses += 1
+            pnl.append(-amount)
+        # Cooldown runs from placement; the open trade also blocks the pair
+        free_at = t + max(expiry, cooldown)
+    equity = np.cumsum(pnl) if pnl else np.zeros(1)
+    peak = np.maximum.accumulate(np.concatenate(([0.0], equity)))[1:]
+    drawdown = float(np.max(peak - equity))
+    trades = wins + losses + ties
+    return {
+        "trades": trades,
+        "wins": wins,
+        "losses": losses,
+        "ties": ties,
+        "win_rate": round(wins / (wins + losses), 4) if wins + losses else 0.0,
+        "pnl": round(float(equity[-1]), 2),
+        "max_drawdown": round(drawdown, 2),
+    }
+
+
+_loaded: Dict[str, np.ndarray] = {}
+
+
+def run_job(job: Tuple[str, str, int, Dict[str, Any]]) -> Dict[str, Any]:
+    path, strategy_name, timeframe, opts = job
+    if path not in _loaded:
+        _loaded[path] = load_candles(path)
+    candles = resample(_loaded[path], timeframe)
+    pair = os.path.splitext(os.path.basename(path))[0]
+    result = {"strategy": strategy_name, "pair": pair, "timeframe": timeframe, "bars": len(candles)}
+    strategy = STRATEGIES[strategy_name]
+    if len(candles) < 60:
+        return dict(result, trades=0, wins=0, losses=0, ties=0, win_rate=0.0, pnl=0.0, max_drawdown=0.0)
+    tensor = candles[None, :, 1:]
+    expiry = max(1, int(opts["expiry"]))
+    cooldown = int(opts["cooldown"] // timeframe)
+    stats = simulate(tensor[0, :, CLOSE], _signals(strategy, tensor), expiry, cooldown, opts["payout"], opts["amount"])
+    result.update(stats)
+    return result
+
+
+def sweep(paths: List[str], strategies: List[str], timeframes: List[int], opts: Dict[str, Any], workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    jobs = [(path, name, tf, opts) for path in paths for name in strategies for tf in timeframes]
+    if workers == 1:
+        return [run_job(job) for job in jobs]
+    with Pool(processes=workers) as pool:
+        return pool.map(run_job, jobs, chunksize=max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backtest strategies over stored candle files")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--strategy", action="append", help="strategy name (default: all with indicators)")
+    parser.add_argument("--timeframe", action="append", type=int, help="seconds per bar (default: 60)")
+    parser.add_argument("--expiry", type=int, default=1, help="bars until the option expires")
+    parser.add_argument("--payout", type=float, default=0.85)
+    parser.add_argument("--amount", type=float, default=1.0)
+    parser.add_argument("--cooldown", type=int, default=300, help="seconds a pair rests after each entry")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args(argv)
+
+    strategies = args.strategy or [name for name, s in STRATEGIES.items() if s.indicators()]
+    unknown = [name for name in strategies if name not in STRATEGIES]
+    if unknown:
+        parser.error(f"unknown strategy: {', '.join(unknown)}")
+    opts = {"expiry": args.expiry, "payout": args.payout, "amount": args.amount, "cooldown": args.cooldown}
+    results = sweep(args.files, strategies, args.timeframe or [60], opts, args.workers)
+    results.sort(key=lambda row: (row["strategy"], row["pair"], row["timeframe"]))
+
+    print(f"{'strategy':<20} {'pair':<14} {'tf':>6} {'bars':>8} {'trades':>7} {'win%':>7} {'pnl':>10} {'max dd':>9}")
+    for row in results:
+        print(f"{row['strategy']:<20} {row['pair']:<14} {row['timeframe']:>6} {row['bars']:>8} {row['trades']:>7} {row['win_rate'] * 100:>6.1f}% {row['pnl']:>10.2f} {row['max_drawdown']:>9.2f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,8 +1,7 @@
 import os
 import time
 import redis
-from .celery_app import user_queue
-from .tasks import heartbeat_pulse
+from . import scheduler, wire
 
 redis_host = os.getenv("REDIS_HOST", "redis")
 redis_port = int(os.getenv("REDIS_PORT", "6379"))
@@ -11,25 +10,31 @@ r = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
 def run(interval: int = 10):
     while True:
         try:
-            for key in r.scan_iter("session:*"):
-                status = r.hget(key, "status")
-                if status != "running":
+            # Scheduled sessions only: session:* also matches the string
+            # keys (tick locks, cooldowns) kept beside each session hash
+            members = r.zrange(scheduler.DUE_KEY, 0, -1)
+            pipe = r.pipeline(transaction=False)
+            for member in members:
+                pipe.hmget(f"session:{member}", "status", "heartbeat", "next_tick", "heartbeat_missed")
+            now = time.time()
+            pipe_out = r.pipeline(transaction=False)
+            for member, (status, hb, next_tick, missed) in zip(members, pipe.execute()):
+                hb = float(hb or "0")
+                if status != "running" or not hb:
                     continue
-                parts = key.split(":")
-                uid = parts[1] if len(parts) > 1 else ""
-                session_id = parts[2] if len(parts) > 2 else ""
-                heartbeat_pulse.apply_async(args=[uid, session_id, interval], queue=user_queue(uid, session_id))
-                hb = float(r.hget(key, "heartbeat") or "0")
-                if hb:
-                    import time as t
-                    latency = t.time() - hb
-                    r.publish(f"metrics:{uid}", f'{{"type":"heartbeat","session_id":"{session_id}","latency":{latency}}}')
-                    if latency > interval * 1.5:
-                        missed = int(r.hget(key, "heartbeat_missed") or "0") + 1
-                        r.hset(key, "heartbeat_missed", missed)
-                        r.publish(f"metrics:{uid}", f'{{"type":"heartbeat_warning","session_id":"{session_id}","missed":{missed},"latency":{latency}}}')
-        except Exception:
-            pass
+                uid, _, session_id = member.partition(":")
+                latency = now - hb
+                # Ticks only refresh the heartbeat once per bar, so judge
+                # it against when the session's tick was due
+                late = scheduler.overdue(hb, next_tick, now)
+                wire.publish(pipe_out, f"metrics:{uid}", {"type": "heartbeat", "session_id": session_id, "latency": latency, "overdue": late})
+                if late > interval * 1.5:
+                    missed = int(missed or "0") + 1
+                    pipe_out.hincrby(f"session:{member}", "heartbeat_missed", 1)
+                    wire.publish(pipe_out, f"metrics:{uid}", {"type": "heartbeat_warning", "session_id": session_id, "missed": missed, "latency": latency, "overdue": late})
+            pipe_out.execute()
+        except Exception as e:
+            print(f"[Beat] Error: {e}")
         time.sleep(interval)
 
 if __name__ == "__main__":
@@ -0,0 +1,66 @@
+import os
+import time
+import redis
+from .candles import watchers_key
+from . import scheduler
+
+redis_host = os.getenv("REDIS_HOST", "redis")
+redis_port = int(os.getenv("REDIS_PORT", "6379"))
+r = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
+
+WATCH_KEY = "candles:watch"
+
+
+def _wake(stream: str, bar_from: int, last_woken: dict) -> None:
+    # stream is candles:stream:{active}:{timeframe}
+    parts = stream.split(":")
+    wkey = watchers_key(parts[2], int(parts[3]))
+    members = list(r.smembers(wkey))
+    if not members:
+        return
+    pipe = r.pipeline(transaction=False)
+    for member in members:
+        pipe.hget(f"session:{member}", "status")
+    statuses = pipe.execute()
+    pipe = r.pipeline(transaction=False)
+    for member, status in zip(members, statuses):
+        if status != "running":
+            pipe.srem(wkey, member)
+            last_woken.pop(member, None)
+            continue
+        # Pairs on the same timeframe close together; one tick per bar is enough
+        if last_woken.get(member, 0) >= bar_from:
+            continue
+        last_woken[member] = bar_from
+        uid, _, session_id = member.partition(":")
+        scheduler.wake(uid, session_id, client=pipe)
+    pipe.execute()
+
+
+def run(block_ms: int = 5000):
+    last_ids = {}
+    last_woken = {}
+    while True:
+        try:
+            streams = r.smembers(WATCH_KEY)
+            for stream in streams:
+                if stream not in last_ids:
+                    latest = r.xrevrange(stream, count=1)
+                    last_ids[stream] = latest[0][0] if latest else "0-0"
+            for stream in list(last_ids):
+                if stream not in streams:
+                    del last_ids[stream]
+            if not last_ids:
+                time.sleep(1)
+                continue
+            for stream, entries in r.xread(last_ids, block=block_ms) or []:
+                last_ids[stream] = entries[-1][0]
+                bar_from = max(int(float(fields.get("from") or 0)) for _, fields in entries)
+                _wake(stream, bar_from, last_woken)
+        except Exception as e:
+            print(f"[CandleEvents] Error: {e}")
+            time.sleep(1)
+
+
+if __name__ == "__main__":
+    run()
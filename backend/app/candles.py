@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import redis
+from typing import Dict, Any, List
+
+redis_host = os.getenv("REDIS_HOST", "redis")
+redis_port = int(os.getenv("REDIS_PORT", "6379"))
+r = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
+
+# How many candles we keep per (active, timeframe)
+MAX_CANDLES = int(os.getenv("CANDLE_CACHE_SIZE", "300"))
+# How long a top-up stays fresh before another session may refresh it
+FRESH_SECONDS = float(os.getenv("CANDLE_CACHE_FRESH", "2"))
+
+
+def normalize_active(pair: str) -> str:
+    if not pair:
+        return pair
+    s = str(pair).strip().upper()
+    otc = "OTC" in s
+    s = s.replace("OTC", "")
+    s = s.replace("/", "").replace(" ", "").replace("_", "").replace("-", "")
+    if otc:
+        return f"{s}-OTC"
+    return s
+
+
+def candles_key(active: str, timeframe: int) -> str:
+    return f"candles:{active}:{int(timeframe)}"
+
+
+def stream_key(active: str, timeframe: int) -> str:
+    # Redis stream of closed candles, fed by an agent candle subscription
+    return f"candles:stream:{active}:{int(timeframe)}"
+
+
+def watchers_key(active: str, timeframe: int) -> str:
+    # "uid:session_id" members to wake when a bar closes
+    return f"candles:watchers:{active}:{int(timeframe)}"
+
+
+def refreshed_key(active: str, timeframe: int) -> str:
+    # When the cache last took in every bar that had closed by then
+    return f"{candles_key(active, timeframe)}:refreshed"
+
+
+def _candle_time(candle: Dict[str, Any]) -> int:
+    return int(candle.get("from") or candle.get("at") or 0)
+
+
+def store_candles(active: str, timeframe: int, candles: List[Dict[str, Any]], pipe=None, refreshed_at=None) -> None:
+    # Sorted set scored by candle open time; a bar is replaced whole so the
+    # still-forming candle is updated in place. ``refreshed_at`` marks the
+    # bars opened before it as final (the write came from a fetch or a close
+    # event at that time).
+    if not candles:
+        return
+    key = candles_key(active, timeframe)
+    own = pipe is None
+    if own:
+        pipe = r.pipeline(transaction=True)
+    for candle in candles:
+        ts = _candle_time(candle)
+        if not ts:
+            continue
+        pipe.zremrangebyscore(key, ts, ts)
+        pipe.zadd(key, {json.dumps(candle, separators=(",", ":")): ts})
+    pipe.zremrangebyrank(key, 0, -(MAX_CANDLES + 1))
+    if refreshed_at is not None:
+        pipe.set(refreshed_key(active, timeframe), refreshed_at)
+    if own:
+        pipe.execute()
+
+
+def load_candles(active: str, timeframe: int, count: int) -> List[Dict[str, Any]]:
+    rows = r.zrange(candles_key(active, timeframe), -count, -1)
+    return [json.loads(row) for row in rows]
+
+
+def get_candles(client, pair: str, timeframe: int, count: int, closed_before=None) -> List[Dict[str, Any]]:
+    return get_candles_multi(client, [pair], timeframe, count, closed_before)[pair]
+
+
+def get_candles_multi(client, pairs: List[str], timeframe: int, count: int, closed_before=None) -> Dict[str, List[Dict[str, Any]]]:
+    """Return the newest ``count`` candles for each pair, keyed by pair.
+
+    The cache is shared by every session watching the same active. Only one
+    caller per bar and freshness window talks to its agent, and it asks for
+    just the bars missing since the newest cached candle. Stale pairs are
+    fetched in a single agent call and every cache read is pipelined.
+
+    With ``closed_before`` (a bar open time), a pair is only returned once
+    the cache was refreshed at or after it, so the last bar before it is
+    final rather than the partial copy cached while it was forming. Callers
+    that lost the claim wait up to FRESH_SECONDS for the claimer; pairs
+    still behind come back empty.
+    """
+    actives = {pair: normalize_active(pair) for pair in pairs}
+    now = time.time()
+    bar = int(closed_before if closed_before is not None else now // timeframe * timeframe)
+
+    pipe = r.pipeline(transaction=False)
+    for pair in pairs:
+        key = candles_key(actives[pair], timeframe)
+        pipe.set(f"{key}:fresh:{bar}", "1", nx=True, px=int(FRESH_SECONDS * 1000))
+        pipe.zrange(key, -1, -1, withscores=True)
+        pipe.zcard(key)
+    results = pipe.execute()
+
+    stale = []
+    fetch = 1
+    for i, pair in enumerate(pairs):
+        claimed, newest, size = results[3 * i:3 * i + 3]
+        if not claimed:
+            continue
+        stale.append(pair)
+        if newest and size >= count:
+            # +1 re-fetches the newest cached bar, which may still have been forming
+            missing = int((now - newest[0][1]) // timeframe) + 1
+            fetch = max(fetch, min(missing, count))
+        else:
+            fetch = count
+
+    if stale:
+        if len(stale) == 1:
+            fetched = {stale[0]: client.get_candles(stale[0], timeframe, fetch, int(now))}
+        else:
+            fetched = client.get_candles_multi(stale, timeframe, fetch, int(now))
+        pipe = r.pipeline(transaction=True)
+        for pair in stale:
+            if fetched.get(pair):
+                store_candles(actives[pair], timeframe, fetched[pair], pipe=pipe, refreshed_at=now)
+            else:
+                # Let the next caller retry instead of waiting out the window
+                pipe.delete(f"{candles_key(actives[pair], timeframe)}:fresh:{bar}")
+        pipe.execute()
+
+    behind = []
+    if closed_before is not None:
+        behind = list(pairs)
+        deadline = now + FRESH_SECONDS
+        while True:
+            marks = r.mget([refreshed_key(actives[pair], timeframe) for pair in behind])
+            behind = [pair for pair, mark in zip(behind, marks) if float(mark or 0) < closed_before]
+            if not behind or time.time() >= deadline:
+                break
+            time.sleep(0.05)
+
+    pipe = r.pipeline(transaction=False)
+    for pair in pairs:
+        pipe.zrange(candles_key(actives[pair], timeframe), -count, -1)
+    return {pair: [] if pair in behind else [json.loads(row) for row in rows] for pair, rows in zip(pairs, pipe.execute())}
@@ -0,0 +1,99 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+import firebase_admin
+from firebase_admin import auth
+
+CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# Certificates are re-requested this often; the verifier's HTTP cache
+# answers locally until Google's max-age runs out
+CERT_REFRESH = int(os.getenv("FIREBASE_CERT_REFRESH", "60"))
+# Cached tokens are dropped this long before their exp
+EXPIRY_MARGIN = 30
+
+
+class TokenCache:
+    """LRU of verified ID tokens: sha256(token) -> (uid, exp).
+
+    Only tokens that passed auth.verify_id_token are stored, and only until
+    their own exp, so a hit is exactly what a fresh verification would have
+    returned (revocation is not checked on either path).
+    """
+
+    def __init__(self, size: int = CACHE_SIZE):
+        self.size = size
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[str]:
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            uid, expires = entry
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return uid
+
+    def put(self, token: str, uid: str, exp) -> None:
+        expires = float(exp or 0) - EXPIRY_MARGIN
+        if expires <= time.time():
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (uid, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+
+cache = TokenCache()
+
+
+def cached_uid(token: str) -> Optional[str]:
+    return cache.get(token)
+
+
+def verify_id_token(token: str) -> str:
+    # Raises like auth.verify_id_token on a miss with a bad token
+    uid = cache.get(token)
+    if uid:
+        return uid
+    decoded = auth.verify_id_token(token)
+    uid = decoded.get("uid")
+    cache.put(token, uid, decoded.get("exp"))
+    return uid
+
+
+def _refresh_certs() -> None:
+    # Reaches into firebase_admin for the verifier's own cached HTTP
+    # transport, so refreshed certificates land where verify_id_token
+    # looks for them. Best effort: if the internals move, requests just
+    # fetch certificates themselves as before.
+    try:
+        verifier = auth._get_client(firebase_admin.get_app())._token_verifier
+        request = verifier.request
+        cert_url = verifier.id_token_verifier.cert_url
+    except Exception as e:
+        print(f"[Auth] Certificate prefetch unavailable: {e}")
+        return
+    while True:
+        try:
+            request(cert_url, method="GET")
+        except Exception as e:
+            print(f"[Auth] Certificate refresh failed: {e}")
+        time.sleep(CERT_REFRESH)
+
+
+def start_cert_refresh() -> None:
+    threading.Thread(target=_refresh_certs, daemon=True).start()
@@ -0,0 +1,498 @@
+import math
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Dict, Any, Optional, List, Tuple, Callable
+import numpy as np
+import pandas as pd
+
+NAN = float("nan")
+
+
+# Each indicator keeps O(1) state and exposes two operations:
+#   update(candle) -> commits a closed candle and returns its column values
+#   peek(candle)   -> returns the values the candle *would* produce, without
+#                     mutating state (used for the still-forming candle)
+# Column names match the ones pandas_ta produced so check_rules is unchanged.
+#
+# batch(tensor) computes the same columns for many pairs at once from a
+# (pairs, bars, OHLCV) array, returning (pairs, bars) arrays.
+
+class Indicator(ABC):
+    @abstractmethod
+    def update(self, candle: Dict[str, float]) -> Dict[str, float]:
+        ...
+
+    @abstractmethod
+    def peek(self, candle: Dict[str, float]) -> Dict[str, float]:
+        ...
+
+    @abstractmethod
+    def batch(self, tensor: np.ndarray) -> Dict[str, np.ndarray]:
+        ...
+
+
+# Last axis of a candle tensor
+OPEN, HIGH, LOW, CLOSE, VOLUME = range(5)
+TENSOR_FIELDS = ("open", "max", "min", "close", "volume")
+
+
+def _smooth_batch(x: np.ndarray, length: int, alpha: float) -> np.ndarray:
+    # SMA-seeded exponential smoothing along the bar axis. pandas' ewm with
+    # adjust=False starts at the first non-NaN value, which is the seed.
+    out = np.full(x.shape, NAN)
+    if x.shape[1] < length:
+        return out
+    out[:, length - 1] = x[:, :length].mean(axis=1)
+    out[:, length:] = x[:, length:]
+    return pd.DataFrame(out.T).ewm(alpha=alpha, adjust=False).mean().to_numpy().T
+
+
+def ema_batch(x: np.ndarray, length: int) -> np.ndarray:
+    return _smooth_batch(x, length, 2.0 / (length + 1))
+
+
+def rma_batch(x: np.ndarray, length: int) -> np.ndarray:
+    return _smooth_batch(x, length, 1.0 / length)
+
+
+def _rolling(x: np.ndarray, length: int, how: str) -> np.ndarray:
+    window = pd.DataFrame(x.T).rolling(length)
+    if how == "std":
+        return window.std(ddof=0).to_numpy().T
+    return getattr(window, how)().to_numpy().T
+
+
+class _Ema:
+    # SMA-seeded EMA, same warm-up as ta.ema(sma=True)
+    def __init__(self, length: int):
+        self.length = length
+        self.alpha = 2.0 / (length + 1)
+        self.count = 0
+        self.seed_sum = 0.0
+        self.value = NAN
+
+    def _next(self, x: float) -> Tuple[int, float, float]:
+        count = self.count + 1
+        if count < self.length:
+            return count, self.seed_sum + x, NAN
+        if count == self.length:
+            seed = self.seed_sum + x
+            return count, seed, seed / self.length
+        return count, self.seed_sum, self.value + self.alpha * (x - self.value)
+
+    def update(self, x: float) -> float:
+        self.count, self.seed_sum, self.value = self._next(x)
+        return self.value
+
+    def peek(self, x: float) -> float:
+        return self._next(x)[2]
+
+
+class _Rma:
+    # Wilder smoothing (alpha = 1/length), SMA-seeded
+    def __init__(self, length: int):
+        self.length = length
+        self.count = 0
+        self.seed_sum = 0.0
+        self.value = NAN
+
+    def _next(self, x: float) -> Tuple[int, float, float]:
+        count = self.count + 1
+        if count < self.length:
+            return count, self.seed_sum + x, NAN
+        if count == self.length:
+            seed = self.seed_sum + x
+            return count, seed, seed / self.length
+        return count, self.seed_sum, (self.value * (self.length - 1) + x) / self.length
+
+    def update(self, x: float) -> float:
+        self.count, self.seed_sum, self.value = self._next(x)
+        return self.value
+
+    def peek(self, x: float) -> float:
+        return self._next(x)[2]
+
+
+class _Window:
+    # Fixed-size rolling window with O(1) sum / sum of squares and
+    # monotonic deques for max / min.
+    def __init__(self, length: int):
+        self.length = length
+        self.values: deque = deque()
+        self.index = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.maxq: deque = deque()
+        self.minq: deque = deque()
+
+    def push(self, x: float) -> None:
+        self.values.append(x)
+        self.total += x
+        self.total_sq += x * x
+        while self.maxq and self.maxq[-1][1] <= x:
+            self.maxq.pop()
+        self.maxq.append((self.index, x))
+        while self.minq and self.minq[-1][1] >= x:
+            self.minq.pop()
+        self.minq.append((self.index, x))
+        self.index += 1
+        if len(self.values) > self.length:
+            old = self.values.popleft()
+            self.total -= old
+            self.total_sq -= old * old
+            oldest = self.index - self.length
+            if self.maxq[0][0] < oldest:
+                self.maxq.popleft()
+            if self.minq[0][0] < oldest:
+                self.minq.popleft()
+            if self.index % (self.length * 50) == 0:
+                # Re-sum occasionally so float drift never accumulates
+                self.total = math.fsum(self.values)
+                self.total_sq = math.fsum(v * v for v in self.values)
+
+    def _shifted(self, x: float) -> Tuple[int, float, float, int]:
+        # Window stats as if x were pushed: (size, sum, sum_sq, oldest_kept_index)
+        size = len(self.values) + 1
+        total = self.total + x
+        total_sq = self.total_sq + x * x
+        oldest = self.index + 1 - self.length
+        if size > self.length:
+            old = self.values[0]
+            total -= old
+            total_sq -= old * old
+            size = self.length
+        return size, total, total_sq, oldest
+
+    def mean_std(self, x: Optional[float] = None) -> Tuple[float, float]:
+        if x is None:
+            size, total, total_sq = len(self.values), self.total, self.total_sq
+        else:
+            size, total, total_sq, _ = self._shifted(x)
+        if size < self.length:
+            return NAN, NAN
+        mean = total / size
+        var = max(total_sq / size - mean * mean, 0.0)
+        return mean, math.sqrt(var)
+
+    def _extreme(self, q: deque, x: Optional[float], pick: Callable) -> float:
+        if x is None:
+            if len(self.values) < self.length:
+                return NAN
+            return q[0][1]
+        size, _, _, oldest = self._shifted(x)
+        if size < self.length:
+            return NAN
+        for idx, val in q:
+            if idx >= oldest:
+                return pick(val, x)
+        return x
+
+    def max(self, x: Optional[float] = None) -> float:
+        return self._extreme(self.maxq, x, max)
+
+    def min(self, x: Optional[float] = None) -> float:
+        return self._extreme(self.minq, x, min)
+
+
+class EMA(Indicator):
+    def __init__(self, length: int, column: Optional[str] = None, source: str = "close"):
+        self.column = column or f"EMA_{length}"
+        self.source = source
+        self._ema = _Ema(length)
+
+    def update(self, candle):
+        return {self.column: self._ema.update(candle[self.source])}
+
+    def peek(self, candle):
+        return {self.column: self._ema.peek(candle[self.source])}
+
+    def batch(self, tensor):
+        return {self.column: ema_batch(tensor[:, :, TENSOR_FIELDS.index(self.source)], self._ema.length)}
+
+
+class RSI(Indicator):
+    def __init__(self, length: int = 14, column: str = "RSI"):
+        self.column = column
+        self._gain = _Rma(length)
+        self._loss = _Rma(length)
+        self._prev_close: Optional[float] = None
+
+    @staticmethod
+    def _rsi(gain: float, loss: float) -> float:
+        if math.isnan(gain) or math.isnan(loss):
+            return NAN
+        if loss == 0:
+            return 100.0 if gain > 0 else 50.0
+        return 100.0 - 100.0 / (1.0 + gain / loss)
+
+    def update(self, candle):
+        close = candle["close"]
+        prev, self._prev_close = self._prev_close, close
+        if prev is None:
+            return {self.column: NAN}
+        diff = close - prev
+        gain = self._gain.update(max(diff, 0.0))
+        loss = self._loss.update(max(-diff, 0.0))
+        return {self.column: self._rsi(gain, loss)}
+
+    def peek(self, candle):
+        if self._prev_close is None:
+            return {self.column: NAN}
+        diff = candle["close"] - self._prev_close
+        return {self.column: self._rsi(self._gain.peek(max(diff, 0.0)), self._loss.peek(max(-diff, 0.0)))}
+
+    def batch(self, tensor):
+        close = tensor[:, :, CLOSE]
+        out = np.full(close.shape, NAN)
+        diff = np.diff(close, axis=1)
+        gain = rma_batch(np.maximum(diff, 0.0), self._gain.length)
+        loss = rma_batch(np.maximum(-diff, 0.0), self._loss.length)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rsi = 100.0 - 100.0 / (1.0 + gain / loss)
+        rsi = np.where(loss == 0, np.where(gain > 0, 100.0, 50.0), rsi)
+        out[:, 1:] = np.where(np.isnan(gain) | np.isnan(loss), NAN, rsi)
+        return {self.column: out}
+
+
+class BBands(Indicator):
+    def __init__(self, length: int = 20, std: float = 2.0):
+        self.scalar = std
+        self._window = _Window(length)
+        suffix = f"{length}_{float(std)}"
+        self.columns = (f"BBL_{suffix}", f"BBM_{suffix}", f"BBU_{suffix}")
+
+    def _values(self, mean, dev):
+        lower, mid, upper = self.columns
+        return {lower: mean - self.scalar * dev, mid: mean, upper: mean + self.scalar * dev}
+
+    def update(self, candle):
+        self._window.push(candle["close"])
+        return self._values(*self._window.mean_std())
+
+    def peek(self, candle):
+        return self._values(*self._window.mean_std(candle["close"]))
+
+    def batch(self, tensor):
+        close = tensor[:, :, CLOSE]
+        length = self._window.length
+        return self._values(_rolling(close, length, "mean"), _rolling(close, length, "std"))
+
+
+class Keltner(Indicator):
+    # EMA basis with an EMA of true range as band width (ta.kc defaults)
+    def __init__(self, length: int = 20, scalar: float = 1.5):
+        self.scalar = scalar
+        self._basis = _Ema(length)
+        self._range = _Ema(length)
+        self._prev_close: Optional[float] = None
+        suffix = f"{length}_{float(scalar)}"
+        self.columns = (f"KCL_{suffix}", f"KCB_{suffix}", f"KCU_{suffix}")
+
+    def _true_range(self, candle):
+        high, low = candle["max"], candle["min"]
+        if self._prev_close is None:
+            return high - low
+        return max(high - low, abs(high - self._prev_close), abs(low - self._prev_close))
+
+    def _values(self, basis, band):
+        lower, mid, upper = self.columns
+        return {lower: basis - self.scalar * band, mid: basis, upper: basis + self.scalar * band}
+
+    def update(self, candle):
+        band = self._range.update(self._true_range(candle))
+        self._prev_close = candle["close"]
+        return self._values(self._basis.update(candle["close"]), band)
+
+    def peek(self, candle):
+        return self._values(self._basis.peek(candle["close"]), self._range.peek(self._true_range(candle)))
+
+    def batch(self, tensor):
+        high, low, close = tensor[:, :, HIGH], tensor[:, :, LOW], tensor[:, :, CLOSE]
+        true_range = high - low
+        prev_close = close[:, :-1]
+        true_range[:, 1:] = np.maximum(true_range[:, 1:], np.maximum(np.abs(high[:, 1:] - prev_close), np.abs(low[:, 1:] - prev_close)))
+        length = self._basis.length
+        return self._values(ema_batch(close, length), ema_batch(true_range, length))
+
+
+class Donchian(Indicator):
+    def __init__(self, length: int = 20, upper: Optional[str] = None, lower: Optional[str] = None):
+        self.upper = upper or f"DCU_{length}"
+        self.lower = lower or f"DCL_{length}"
+        self._highs = _Window(length)
+        self._lows = _Window(length)
+
+    def update(self, candle):
+        self._highs.push(candle["max"])
+        self._lows.push(candle["min"])
+        return {self.upper: self._highs.max(), self.lower: self._lows.min()}
+
+    def peek(self, candle):
+        return {self.upper: self._highs.max(candle["max"]), self.lower: self._lows.min(candle["min"])}
+
+    def batch(self, tensor):
+        length = self._highs.length
+        return {self.upper: _rolling(tensor[:, :, HIGH], length, "max"), self.lower: _rolling(tensor[:, :, LOW], length, "min")}
+
+
+class HeikinAshi(Indicator):
+    def __init__(self):
+        self._prev: Optional[Tuple[float, float]] = None
+
+    def _values(self, candle):
+        ha_close = (candle["open"] + candle["max"] + candle["min"] + candle["close"]) / 4.0
+        if self._prev is None:
+            ha_open = (candle["open"] + candle["close"]) / 2.0
+        else:
+            ha_open = (self._prev[0] + self._prev[1]) / 2.0
+        return {
+            "HA_open": ha_open,
+            "HA_high": max(candle["max"], ha_open, ha_close),
+            "HA_low": min(candle["min"], ha_open, ha_close),
+            "HA_close": ha_close,
+        }
+
+    def update(self, candle):
+        row = self._values(candle)
+        self._prev = (row["HA_open"], row["HA_close"])
+        return row
+
+    def peek(self, candle):
+        return self._values(candle)
+
+    def batch(self, tensor):
+        o, h, l, c = (tensor[:, :, i] for i in (OPEN, HIGH, LOW, CLOSE))
+        ha_close = (o + h + l + c) / 4.0
+        # ha_open[t] = (ha_open[t-1] + ha_close[t-1]) / 2: an alpha=0.5
+        # smoothing of ha_close shifted by one bar
+        shifted = np.empty(ha_close.shape)
+        shifted[:, 0] = (o[:, 0] + c[:, 0]) / 2.0
+        shifted[:, 1:] = ha_close[:, :-1]
+        ha_open = pd.DataFrame(shifted.T).ewm(alpha=0.5, adjust=False).mean().to_numpy().T
+        return {
+            "HA_open": ha_open,
+            "HA_high": np.maximum(h, np.maximum(ha_open, ha_close)),
+            "HA_low": np.minimum(l, np.minimum(ha_open, ha_close)),
+            "HA_close": ha_close,
+        }
+
+
+def _candle_time(candle: Dict[str, Any]) -> int:
+    return int(candle.get("from") or candle.get("at") or candle.get("id") or 0)
+
+
+def _as_floats(candle: Dict[str, Any]) -> Dict[str, float]:
+    return {
+        "open": float(candle["open"]),
+        "close": float(candle["close"]),
+        "max": float(candle["max"]),
+        "min": float(candle["min"]),
+        "volume": float(candle.get("volume") or 0),
+    }
+
+
+def candle_tensor(batch: List[List[Dict[str, Any]]]) -> np.ndarray:
+    """Stack per-pair candle lists into a (pairs, bars, OHLCV) array.
+
+    Every pair is cut to the newest ``bars`` candles, where ``bars`` is the
+    shortest list in the batch, so the rows line up bar for bar.
+    """
+    bars = min(len(candles) for candles in batch)
+    tensor = np.empty((len(batch), bars, len(TENSOR_FIELDS)))
+    for i, candles in enumerate(batch):
+        if _candle_time(candles[0]) > _candle_time(candles[-1]):
+            candles = sorted(candles, key=_candle_time)
+        tensor[i] = [[float(candle.get(field) or 0) for field in TENSOR_FIELDS] for candle in candles[len(candles) - bars:]]
+    return tensor
+
+
+class IndicatorEngine:
+    """Stateful indicator rows for one (strategy, pair, timeframe).
+
+    Closed candles are ingested once; the newest candle in each batch is
+    treated as still forming and only peeked. The returned ``last`` /
+    ``prev`` rows are what the full-DataFrame and batch paths compute over
+    the same candles, in that a fresh engine matches them to ~1e-12.
+
+    A warm engine does not recompute from the window's first bar: its
+    smoothed indicators (EMA, the RMA inside RSI) keep the history from
+    earlier ticks, while a recompute re-seeds at the window start. The two
+    differ by that seed's residual, (1 - alpha) ** (bars - length) of the
+    gap; on 100 one-minute bars that is up to ~4e-5 for EMA_50 and a few
+    hundredths of an RSI point. Window indicators (BBands, Donchian) still
+    match exactly.
+    """
+
+    def __init__(self, factory: Callable[[], List[Indicator]], timeframe: int = 0):
+        self.factory = factory
+        self.timeframe = int(timeframe)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.indicators = self.factory()
+        self.last_time: Optional[int] = None
+        self.committed = 0
+        self.row: Optional[Dict[str, float]] = None
+        self.prev_row: Optional[Dict[str, float]] = None
+
+    def commit(self, candle: Dict[str, Any]) -> Dict[str, float]:
+        values = _as_floats(candle)
+        row = dict(values)
+        for ind in self.indicators:
+            row.update(ind.update(values))
+        self.prev_row, self.row = self.row, row
+        self.last_time = _candle_time(candle)
+        self.committed += 1
+        return row
+
+    def peek(self, candle: Dict[str, Any]) -> Dict[str, float]:
+        values = _as_floats(candle)
+        row = dict(values)
+        for ind in self.indicators:
+            row.update(ind.peek(values))
+        return row
+
+    def ingest(self, closed: List[Dict[str, Any]]) -> None:
+        if not closed:
+            return
+        start = 0
+        if self.last_time is not None:
+            # Walk back from the newest candle; everything after last_time is new
+            start = len(closed)
+            while start > 0 and _candle_time(closed[start - 1]) > self.last_time:
+                start -= 1
+            # A hole between our state and the batch means bars were missed; replay
+            if start == 0 and _candle_time(closed[0]) > self.last_time + max(self.timeframe, 1):
+                self.reset()
+        for candle in closed[start:]:
+            self.commit(candle)
+
+    def rows(self, candles: List[Dict[str, Any]]) -> Tuple[Optional[Dict[str, float]], Optional[Dict[str, float]]]:
+        if _candle_time(candles[0]) > _candle_time(candles[-1]):
+            candles = sorted(candles, key=_candle_time)
+        with self.lock:
+            self.ingest(candles[:-1])
+            newest = candles[-1]
+            if self.last_time is not None and _candle_time(newest) <= self.last_time:
+                return self.row, self.prev_row
+            if self.row is None:
+                return None, None
+            return self.peek(newest), self.row
+
+
+_engines: Dict[Tuple[str, str, int], IndicatorEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(strategy: str, pair: str, timeframe: int, factory: Callable[[], List[Indicator]]) -> IndicatorEngine:
+    key = (strategy, pair, int(timeframe))
+    engine = _engines.get(key)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(key)
+            if engine is None:
+                engine = IndicatorEngine(factory, timeframe)
+                _engines[key] = engine
+    return engine
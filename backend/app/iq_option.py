@@ -5,13 +5,107 @@ import redis
 import uuid
 import subprocess
 import sys
+import socket
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 from typing import Optional, Dict, Any
+from .credentials import encrypt
+from . import wire
 
 # Setup Redis
 redis_host = os.getenv("REDIS_HOST", "127.0.0.1")
 redis_port = int(os.getenv("REDIS_PORT", "6379"))
 print(f"[IQClient] Redis config: {redis_host}:{redis_port}")
 r = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
+# Agent replies may be msgpack, so the reply subscription reads raw bytes
+raw_r = redis.Redis(host=redis_host, port=redis_port, db=0)
+
+# Spawn agents through agent_host (one forking host process for many
+# accounts) instead of a fresh interpreter per user
+AGENT_HOST_MODE = os.getenv("AGENT_HOST_MODE") == "1"
+AGENT_HOST_QUEUE = "agent:host:spawn"
+
+AGENT_START_TIMEOUT = 30
+# An agent that has written its heartbeat this recently is alive
+AGENT_ALIVE_WINDOW = 15
+
+
+class RpcChannel:
+    """Per-process reply channel for agent commands.
+
+    One long-lived subscription receives every response addressed to this
+    process (agents publish to the ``reply_to`` channel in the command);
+    a reader thread resolves the waiting caller's future by ``cmd_id``.
+    Safe to share between threads; re-created after a fork.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._pid = None
+        self._pubsub = None
+        self.channel = None
+
+    def _ensure(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Forked children (Celery prefork) must not share the parent's socket
+            self._pending = {}
+            channel = f"rpc:{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+            pubsub = raw_r.pubsub()
+            pubsub.subscribe(channel)
+            # Wait for the subscription to be live before anyone publishes
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                msg = pubsub.get_message(timeout=0.5)
+                if msg and msg.get("type") == "subscribe":
+                    break
+            self._pubsub = pubsub
+            self.channel = channel
+            threading.Thread(target=self._listen, args=(pubsub,), daemon=True).start()
+            self._pid = os.getpid()
+
+    def _listen(self, pubsub) -> None:
+        while True:
+            try:
+                for msg in pubsub.listen():
+                    if msg.get("type") != "message":
+                        continue
+                    try:
+                        resp = wire.loads(msg["data"])
+                    except Exception:
+                        continue
+                    with self._lock:
+                        fut = self._pending.pop(resp.get("id"), None)
+                    if fut is not None and not fut.done():
+                        fut.set_result(resp)
+            except Exception as e:
+                # redis-py re-subscribes on reconnect; pending calls just time out
+                print(f"[IQClient] RPC listener error: {e}")
+                time.sleep(0.5)
+
+    def call(self, uid: str, payload: Dict[str, Any], timeout: float) -> Optional[Dict[str, Any]]:
+        self._ensure()
+        cmd_id = payload["id"]
+        fut: Future = Future()
+        with self._lock:
+            self._pending[cmd_id] = fut
+        payload["reply_to"] = self.channel
+        payload.setdefault("fmt", wire.RPC_FORMAT)
+        r.publish(f"agent:{uid}:cmd", json.dumps(payload))
+        try:
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            return None
+        finally:
+            with self._lock:
+                self._pending.pop(cmd_id, None)
+
+
+rpc = RpcChannel()
 
 
 class IQOptionClient:
@@ -51,20 +145,32 @@ class IQOptionClient:
                     try:
                         bal = self.get_balance()
                         log_msg = f"IQ Option connected (existing): {username} (Balance: {bal})"
-                        r.publish(f"logs:{uid}", json.dumps({
+                        wire.publish(r, f"logs:{uid}", {
                             "type": "log",
                             "message": log_msg,
                             "timestamp": time.time()
-                        }))
+                        })
                     except Exception as e:
                         print(f"[IQClient] Failed to log reuse: {e}")
 
+                    return True
+                elif time.time() - float(r.hget(f"agent:{uid}:status", "heartbeat") or 0) < AGENT_ALIVE_WINDOW:
+                    # Ping timed out but the agent loop is beating: it is busy,
+                    # not dead. Keep it rather than paying a fresh login, but
+                    # only once it has switched to the requested account.
+                    print(f"[IQClient] Agent for {uid} slow to answer ping but alive")
+                    if self._send_command("change_balance", {"account_type": account_type}) != "ok":
+                        self._last_error = {"error_code": "AGENT_BUSY", "detail": "Agent did not confirm the account type"}
+                        return False
+                    self._connected = True
                     return True
                 else:
                      print(f"[IQClient] Agent for {uid} unresponsive. Restarting...")
                      # Try to kill old process
                      old_pid = r.hget(f"agent:{uid}:status", "pid")
-                     if old_pid:
+                     # Hosted agents may live on another machine; the new agent takes
+                     # agent:{uid}:owner over and the old one exits on its next check
+                     if old_pid and not AGENT_HOST_MODE:
                          try:
                              pid_int = int(old_pid)
                              if os.name == "nt":
@@ -78,7 +184,7 @@ class IQOptionClient:
             # Start Agent
             # Cleanup previous agent if any
             old_pid = r.hget(f"agent:{uid}:status", "pid")
-            if old_pid:
+            if old_pid and not AGENT_HOST_MODE:
                 try:
                     pid_int = int(old_pid)
                     if os.name == "nt":
@@ -88,46 +194,23 @@ class IQOptionClient:
                 except:
                     pass
 
-            print(f"[IQClient] Spawning agent for {uid}")
-            env = os.environ.copy()
-            env["REDIS_HOST"] = redis_host
-            env["REDIS_PORT"] = str(redis_port)
-            env["PYTHONPATH"] = os.getcwd() # Ensure backend module is found
-
-            python_exe = sys.executable
+            # Clear leftovers so only the new agent's outcome is seen
+            r.delete(f"agent:{uid}:status", f"agent:{uid}:ready")
 
-            # Run in background with logging
-            log_file = open(f"agent_{uid}.log", "w")
-            
-            try:
-                # Determine module path based on CWD
-                # If we are in 'backend' dir, use 'app.agent'
-                # If we are in 'Axon' dir, use 'backend.app.agent'
-                module_name = "backend.app.agent"
-                if os.path.basename(os.getcwd()) == "backend":
-                    module_name = "app.agent"
-
-                subprocess.Popen([python_exe, "-u", "-m", module_name, uid, username, password, account_type],
-                                cwd=os.getcwd(),
-                                env=env,
-                                stdout=log_file,
-                                stderr=subprocess.STDOUT)
-            except Exception as e:
-                print(f"[IQClient] Failed to spawn agent: {e}")
-                self._last_error = {"error_code": "SPAWN_FAILED", "detail": str(e)}
+            if AGENT_HOST_MODE:
+                if not self._spawn_hosted(uid, username, password, account_type):
+                    return False
+            elif not self._spawn_process(uid, username, password, account_type):
                 return False
 
-            # Wait for connection
-            for _ in range(60): # Wait up to 30 seconds (IQ login can be slow with retries)
-                time.sleep(0.5)
-                status = r.hget(f"agent:{uid}:status", "status")
-                if status == "connected":
+            # Wait for the agent's ready signal (IQ login can be slow with retries)
+            ready = self._wait_ready(uid, AGENT_START_TIMEOUT)
+            if ready is not None:
+                if ready.get("status") == "connected":
                     self._connected = True
                     return True
-                if status in ["failed", "error"]:
-                    err = r.hget(f"agent:{uid}:status", "error")
-                    self._last_error = {"error_code": "LOGIN_FAILED", "detail": err}
-                    return False
+                self._last_error = {"error_code": "LOGIN_FAILED", "detail": ready.get("error")}
+                return False
 
             self._last_error = {"error_code": "TIMEOUT", "detail": "Agent startup timed out"}
             return False
@@ -150,6 +233,69 @@ class IQOptionClient:
             self._last_error = {"error_code": "NO_UID", "detail": "UID required"}
             return False
 
+    def _wait_ready(self, uid: str, timeout: int) -> Optional[Dict[str, Any]]:
+        ready_key = f"agent:{uid}:ready"
+        item = r.blpop(ready_key, timeout=timeout)
+        if not item:
+            return None
+        # Put it back briefly so other callers waiting on the same agent see it too
+        pipe = r.pipeline()
+        pipe.lpush(ready_key, item[1])
+        pipe.expire(ready_key, 10)
+        pipe.execute()
+        try:
+            return json.loads(item[1])
+        except Exception:
+            return None
+
+    def _spawn_process(self, uid: str, username: str, password: str, account_type: str) -> bool:
+        print(f"[IQClient] Spawning agent for {uid}")
+        env = os.environ.copy()
+        env["REDIS_HOST"] = redis_host
+        env["REDIS_PORT"] = str(redis_port)
+        env["PYTHONPATH"] = os.getcwd() # Ensure backend module is found
+
+        python_exe = sys.executable
+
+        # Run in background with logging
+        log_file = open(f"agent_{uid}.log", "w")
+        
+        try:
+            # Determine module path based on CWD
+            # If we are in 'backend' dir, use 'app.agent'
+            # If we are in 'Axon' dir, use 'backend.app.agent'
+            module_name = "backend.app.agent"
+            if os.path.basename(os.getcwd()) == "backend":
+                module_name = "app.agent"
+
+            subprocess.Popen([python_exe, "-u", "-m", module_name, uid, username, password, account_type],
+                            cwd=os.getcwd(),
+                            env=env,
+                            stdout=log_file,
+                            stderr=subprocess.STDOUT)
+        except Exception as e:
+            print(f"[IQClient] Failed to spawn agent: {e}")
+            self._last_error = {"error_code": "SPAWN_FAILED", "detail": str(e)}
+            return False
+        return True
+
+    def _spawn_hosted(self, uid: str, username: str, password: str, account_type: str) -> bool:
+        # Queue the login for an agent_host process, which forks the agent
+        try:
+            password_enc = encrypt(password)
+        except Exception as e:
+            self._last_error = {"error_code": "SPAWN_FAILED", "detail": str(e)}
+            return False
+        print(f"[IQClient] Requesting hosted agent for {uid}")
+        r.rpush(AGENT_HOST_QUEUE, json.dumps({
+            "uid": uid,
+            "username": username,
+            "password_enc": password_enc,
+            "account_type": account_type,
+            "expires_at": time.time() + 30,
+        }))
+        return True
+
     def disconnect(self, uid: str = None):
         target_uid = uid or self.uid
         if not target_uid:
@@ -174,36 +320,19 @@ class IQOptionClient:
         if data:
             payload.update(data)
 
-        pubsub = r.pubsub()
-        channel = f"agent:{self.uid}:resp:{cmd_id}"
-        pubsub.subscribe(channel)
-
-        r.publish(f"agent:{self.uid}:cmd", json.dumps(payload))
-
-        start = time.time()
-        while time.time() - start < timeout:
-            msg = pubsub.get_message(ignore_subscribe_messages=True, timeout=0.5)
-            if msg:
-                try:
-                    resp = json.loads(msg["data"])
-                    if resp.get("id") == cmd_id:
-                        pubsub.unsubscribe()
-                        if resp.get("status") == "error":
-                             self._last_error = {"error_code": "CMD_ERROR", "detail": resp.get("error")}
-                             return None
-                        return resp.get("result")
-                except:
-                    pass
-            time.sleep(0.01)
-        
-        pubsub.unsubscribe()
-        return None
+        resp = rpc.call(self.uid, payload, timeout)
+        if resp is None:
+            return None
+        if resp.get("status") == "error":
+            self._last_error = {"error_code": "CMD_ERROR", "detail": resp.get("error")}
+            return None
+        return resp.get("result")
 
     def get_balance(self) -> float:
         res = self._send_command("get_balance")
         return float(res) if res is not None else 0.0
 
-    def place_order(self, pair: str, direction: str, amount: float, expiry_seconds: int):
+    def place_order(self, pair: str, direction: str, amount: float, expiry_seconds: int, session_id: str = None):
         expiry_val = int(expiry_seconds)
         duration = int(expiry_val / 60) if expiry_val >= 60 else expiry_val
         if duration < 1:
@@ -216,7 +345,11 @@ class IQOptionClient:
         elif action == "sell":
             action = "put"
 
-        res = self._send_command("buy", {"amount": amount, "active": active, "action": action, "duration": duration})
+        payload = {"amount": amount, "active": active, "action": action, "duration": duration, "expiry_seconds": expiry_val}
+        if session_id:
+            # Agent publishes the outcome to trades:settlements when the option closes
+            payload["session_id"] = session_id
+        res = self._send_command("buy", payload)
         return res # Returns order_id or None
 
     def poll_position(self, order_id):
@@ -248,8 +381,24 @@ class IQOptionClient:
     def get_candles(self, pair: str, timeframe: int, count: int, timestamp: int) -> list:
         # timeframe in seconds (e.g., 60 for 1min)
         active = self._normalize_active(pair)
-        res = self._send_command("get_candles", {"active": active, "duration": timeframe, "count": count, "timestamp": timestamp})
-        return res if res else []
+        res = self._send_command("get_candles", {"active": active, "duration": timeframe, "count": count, "timestamp": timestamp, "layout": wire.COLUMNS})
+        return wire.to_rows(res)
+
+    def get_candles_multi(self, pairs, timeframe: int, count: int, timestamp: int) -> Dict[str, list]:
+        # One agent round trip for several actives; keyed by the pairs passed in
+        actives = {self._normalize_active(p): p for p in pairs}
+        res = self._send_command("get_candles_multi", {"actives": list(actives), "duration": timeframe, "count": count, "timestamp": timestamp, "layout": wire.COLUMNS}, timeout=10 + 2 * len(actives))
+        res = res or {}
+        return {pair: wire.to_rows(res.get(active)) for active, pair in actives.items()}
+
+    def subscribe_candles(self, pair: str, timeframe: int):
+        # Agent streams closed bars into candles:stream:{active}:{timeframe}
+        active = self._normalize_active(pair)
+        return self._send_command("subscribe_candles", {"active": active, "duration": timeframe})
+
+    def unsubscribe_candles(self, pair: str, timeframe: int):
+        active = self._normalize_active(pair)
+        return self._send_command("unsubscribe_candles", {"active": active, "duration": timeframe})
 
     def error_code(self):
         return self._last_error.get("error_code") if self._last_error else None
@@ -258,7 +407,8 @@ class IQOptionClient:
         return self._last_error.get("detail") if self._last_error else None
 
     def error_is_terminal(self):
-        return True
+        # A busy agent is retried on the next tick
+        return self.error_code() != "AGENT_BUSY"
     
     def last_retries(self):
         return 0
@@ -0,0 +1,158 @@
+import os
+import socket
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+import redis
+from sqlalchemy import select, update, func, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from .models import SessionLocal, Trade as DbTrade, Session as DbSession
+
+redis_host = os.getenv("REDIS_HOST", "redis")
+redis_port = int(os.getenv("REDIS_PORT", "6379"))
+r = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
+
+# Trade lifecycle events; entries are deleted once written to the database,
+# so the stream only holds what the writer hasn't applied yet
+STREAM = "trades:journal"
+GROUP = "journal-writers"
+BATCH = int(os.getenv("JOURNAL_BATCH", "500"))
+# Stable across restarts so a replacement writer owns its predecessor's
+# pending entries; other writers' stalled entries are reclaimed after
+# RETRY_IDLE seconds
+CONSUMER = os.getenv("JOURNAL_CONSUMER") or socket.gethostname()
+RETRY_IDLE = int(os.getenv("JOURNAL_RETRY_IDLE", "10"))
+# A settlement whose placement hasn't been written yet is retried this long
+ORPHAN_TTL = int(os.getenv("JOURNAL_ORPHAN_TTL", "3600"))
+
+
+def append(event: str, uid: str, session_id: str, order_id, client=None, **fields) -> None:
+    entry = {"event": event, "uid": uid, "session_id": session_id, "order_id": str(order_id), "at": time.time()}
+    entry.update(fields)
+    (client or r).xadd(STREAM, {k: str(v) for k, v in entry.items()})
+
+
+def _ensure_group() -> None:
+    try:
+        r.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _insert_new(db, rows: List[Dict]) -> List[Tuple[str, str]]:
+    # Insert-or-ignore on the unique order_id, so two writers racing on the
+    # same placement add one row; returns (order_id, session_id) of the rows
+    # actually inserted
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        stmt = sqlite.insert(DbTrade).on_conflict_do_nothing(index_elements=["order_id"])
+    elif dialect == "postgresql":
+        stmt = postgresql.insert(DbTrade).on_conflict_do_nothing(index_elements=["order_id"])
+    else:
+        stmt = insert(DbTrade)
+    return [tuple(row) for row in db.execute(stmt.returning(DbTrade.order_id, DbTrade.session_id), rows)]
+
+
+def _apply(entries: List[Tuple[str, Dict[str, str]]]) -> List[str]:
+    """Writes a batch in one transaction; returns the entry ids to retry.
+
+    Replays are harmless: a placement only inserts an unknown order (the
+    unique order_id drops a concurrent duplicate), and a settlement only
+    counts towards its session when it moves the trade off "pending". A
+    settlement that overtook its placement (another writer still holds it)
+    is left unacked and retried.
+    """
+    order_ids = list({fields["order_id"] for _, fields in entries})
+    profit: Dict[str, float] = {}
+    placed: Dict[str, int] = {}
+    retry = []
+    with SessionLocal() as db:
+        known = set(db.execute(select(DbTrade.order_id).where(DbTrade.order_id.in_(order_ids))).scalars())
+        rows = {}
+        for _, e in entries:
+            if e["event"] == "placed" and e["order_id"] not in known and e["order_id"] not in rows:
+                at = datetime.fromtimestamp(float(e["at"]), timezone.utc).replace(tzinfo=None)
+                rows[e["order_id"]] = dict(
+                    user_id=e["uid"], session_id=e["session_id"], pair=e.get("pair"), direction=e.get("direction"),
+                    amount=float(e.get("amount") or 0), expiry=int(e.get("expiry") or 0), order_id=e["order_id"],
+                    status="placed", result="pending", pnl=0.0, created_at=at,
+                )
+        if rows:
+            for _, session_id in _insert_new(db, list(rows.values())):
+                placed[session_id] = placed.get(session_id, 0) + 1
+
+        trades = {t.order_id: t for t in db.execute(select(DbTrade).where(DbTrade.order_id.in_(order_ids))).scalars()}
+        for entry_id, e in entries:
+            if e["event"] != "settled":
+                continue
+            order_id = e["order_id"]
+            trade = trades.get(order_id)
+            if trade is None:
+                if time.time() - float(e.get("at") or 0) < ORPHAN_TTL:
+                    retry.append(entry_id)
+                else:
+                    print(f"[Journal] Dropping settlement of unknown order {order_id}")
+                continue
+            if trade.result != "pending":
+                continue
+            trade.status = e.get("status")
+            trade.result = e.get("result")
+            if e.get("status") == "closed":
+                pnl = float(e.get("pnl") or 0)
+                trade.pnl = pnl
+                profit[e["session_id"]] = profit.get(e["session_id"], 0.0) + pnl
+        for session_id in set(profit) | set(placed):
+            db.execute(
+                update(DbSession).where(DbSession.id == session_id).values(
+                    profit=func.coalesce(DbSession.profit, 0.0) + profit.get(session_id, 0.0),
+                    trades=func.coalesce(DbSession.trades, 0) + placed.get(session_id, 0),
+                )
+            )
+        db.commit()
+    return retry
+
+
+def _write(entries) -> None:
+    retry = set(_apply(entries))
+    done = [entry_id for entry_id, _ in entries if entry_id not in retry]
+    if done:
+        pipe = r.pipeline(transaction=False)
+        pipe.xack(STREAM, GROUP, *done)
+        pipe.xdel(STREAM, *done)
+        pipe.execute()
+
+
+def _claim_idle(start: str):
+    # Entries left unacked by a crashed writer or held back for retry
+    start, claimed, deleted = r.xautoclaim(STREAM, GROUP, CONSUMER, min_idle_time=RETRY_IDLE * 1000, start_id=start, count=BATCH)[:3]
+    if deleted:
+        r.xack(STREAM, GROUP, *deleted)
+    return start, [(entry_id, fields) for entry_id, fields in claimed if fields]
+
+
+def run(block_ms: int = 1000):
+    _ensure_group()
+    print(f"[Journal] Writing {STREAM} to the database as {CONSUMER}")
+    claim_from = "0-0"
+    next_claim = 0.0
+    while True:
+        try:
+            entries = []
+            if time.time() >= next_claim:
+                claim_from, entries = _claim_idle(claim_from)
+                # A full scan of the pending list, then wait before the next
+                if claim_from == "0-0":
+                    next_claim = time.time() + RETRY_IDLE
+            if not entries:
+                resp = r.xreadgroup(GROUP, CONSUMER, {STREAM: ">"}, count=BATCH, block=block_ms)
+                entries = resp[0][1] if resp else []
+            if entries:
+                _write(entries)
+        except Exception as e:
+            print(f"[Journal] Error: {e}")
+            time.sleep(1)
+
+
+if __name__ == "__main__":
+    run()
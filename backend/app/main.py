@@ -4,26 +4,33 @@ import json
 import time
 import threading
 import random
+import asyncio
 from typing import Optional
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, Header, HTTPException, WebSocket, WebSocketDisconnect, Query, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import firebase_admin
-from firebase_admin import auth, credentials
+from firebase_admin import credentials
 import redis
+import redis.asyncio as aioredis
+from sqlalchemy import select, or_, and_
+from datetime import datetime
 from .schemas import SignalStartRequest, SignalStopRequest, AutoTradingConfig, SessionStartResponse
-from .tasks import start_user_session
-from .celery_app import user_queue
-from .models import SessionLocal, Base, engine, Session as DbSession, Trade as DbTrade, IQCredential as DbCred
+from .tasks import start_user_session, release_candle_streams
+from . import scheduler
+from .models import SessionLocal, Base, engine, async_engine, fetch_all, Session as DbSession, Trade as DbTrade, IQCredential as DbCred
 from .credentials import encrypt, decrypt
 from .iq_option import IQOptionClient
 from .workers import spawn_user_worker, stop_user_worker
-from .workers import spawn_beat
+from .workers import spawn_beat, spawn_services
 from .iq_gateway import router as iqgw_router
+from .stream_hub import hub
+from . import firebase_tokens
+from . import wire
 from .pairs import OTC_PAIRS
 from .strategies import get_all_strategy_names
 
@@ -35,6 +42,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 try:
@@ -49,6 +57,8 @@ except ValueError:
 redis_host = os.getenv("REDIS_HOST", "redis")
 redis_port = int(os.getenv("REDIS_PORT", "6379"))
 r = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
+# For async endpoints; the sync client would block the event loop
+ar = aioredis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
 
 class VerifyTokenResponse(BaseModel):
     uid: str
@@ -65,8 +75,15 @@ def _bearer_token(authorization: Optional[str]) -> str:
 def _verify_id_token(authorization: Optional[str]) -> str:
     token = _bearer_token(authorization)
     try:
-        decoded = auth.verify_id_token(token)
-        return decoded.get("uid")
+        return firebase_tokens.verify_id_token(token)
+    except Exception:
+        raise HTTPException(status_code=401, detail="invalid token")
+
+
+async def _verify_id_token_async(authorization: Optional[str]) -> str:
+    token = _bearer_token(authorization)
+    try:
+        return firebase_tokens.cached_uid(token) or await asyncio.to_thread(firebase_tokens.verify_id_token, token)
     except Exception:
         raise HTTPException(status_code=401, detail="invalid token")
 
@@ -103,14 +120,14 @@ def signal_start(payload: SignalStartRequest, authorization: Optional[str] = Hea
     key = _session_key(uid, session_id)
     r.hmset(key, {"mode": "signal", "status": "running", "strategy_id": payload.strategy_id, "timeframe": payload.timeframe})
     r.expire(key, 86400)
-    r.publish(f"signals:{uid}", json.dumps({"type": "session_started", "session_id": session_id}))
+    wire.publish(r, f"signals:{uid}", {"type": "session_started", "session_id": session_id})
     task_arn = spawn_user_worker(uid, session_id)
     if task_arn:
         r.hset(key, "worker_arn", task_arn)
     pairs = payload.pairs or OTC_PAIRS
     if payload.strategy_id == "Random Strategy":
         pair = random.choice(pairs or OTC_PAIRS)
-        r.publish(f"logs:{uid}", json.dumps({"type": "log", "message": f"Analyzing {pair}...", "timestamp": time.time()}))
+        wire.publish(r, f"logs:{uid}", {"type": "log", "message": f"Analyzing {pair}...", "timestamp": time.time()})
         direction = "CALL" if random.random() > 0.5 else "PUT"
         signal_msg = {
             "type": "signal",
@@ -121,11 +138,9 @@ def signal_start(payload: SignalStartRequest, authorization: Optional[str] = Hea
             "strategy": payload.strategy_id,
             "timeframe": payload.timeframe,
         }
-        r.publish(f"signals:{uid}", json.dumps(signal_msg))
-        r.publish(f"logs:{uid}", json.dumps({"type": "log", "message": f"Signal found: {pair} {direction} (1.0%)", "timestamp": time.time()}))
+        wire.publish(r, f"signals:{uid}", signal_msg)
+        wire.publish(r, f"logs:{uid}", {"type": "log", "message": f"Signal found: {pair} {direction} (1.0%)", "timestamp": time.time()})
     start_user_session(uid, session_id, {"pairs": pairs, "strategy_id": payload.strategy_id, "timeframe": payload.timeframe})
-    from .tasks import heartbeat_pulse
-    heartbeat_pulse.apply_async(args=[uid, session_id, 10], queue=user_queue(uid, session_id))
     with SessionLocal() as db:
         db.add(DbSession(id=session_id, user_id=uid, mode="signal", status="running"))
         db.commit()
@@ -139,10 +154,12 @@ def signal_stop(payload: SignalStopRequest, authorization: Optional[str] = Heade
     if not r.exists(key):
         raise HTTPException(status_code=404, detail="session not found")
     r.hset(key, "status", "halted")
+    scheduler.unschedule(uid, payload.session_id)
+    release_candle_streams.delay(uid, payload.session_id)
     worker_arn = r.hget(key, "worker_arn")
     if worker_arn:
         stop_user_worker(worker_arn)
-    r.publish(f"signals:{uid}", json.dumps({"type": "session_halted", "session_id": payload.session_id}))
+    wire.publish(r, f"signals:{uid}", {"type": "session_halted", "session_id": payload.session_id})
     with SessionLocal() as db:
         obj = db.get(DbSession, payload.session_id)
         if obj and obj.user_id == uid:
@@ -180,15 +197,13 @@ def session_start(config: AutoTradingConfig, authorization: Optional[str] = Head
         },
     )
     r.expire(key, 86400)
-    r.publish(f"metrics:{uid}", json.dumps({"type": "session_started", "session_id": session_id}))
-    r.publish(f"logs:{uid}", json.dumps({"type": "log", "message": "Session started", "timestamp": time.time()}))
+    wire.publish(r, f"metrics:{uid}", {"type": "session_started", "session_id": session_id})
+    wire.publish(r, f"logs:{uid}", {"type": "log", "message": "Session started", "timestamp": time.time()})
     task_arn = spawn_user_worker(uid, session_id)
     if task_arn:
         r.hset(key, "worker_arn", task_arn)
     pairs = config.pairs or OTC_PAIRS
     start_user_session(uid, session_id, {"pairs": pairs, "strategy_id": config.strategy_id, "timeframe": config.timeframe, "amount": config.trade_amount})
-    from .tasks import heartbeat_pulse
-    heartbeat_pulse.apply_async(args=[uid, session_id, 10], queue=user_queue(uid, session_id))
     with SessionLocal() as db:
         db.add(DbSession(id=session_id, user_id=uid, mode="auto", status="running"))
         db.commit()
@@ -202,10 +217,12 @@ def session_stop(payload: SignalStopRequest, authorization: Optional[str] = Head
     if not r.exists(key):
         raise HTTPException(status_code=404, detail="session not found")
     r.hset(key, "status", "halted")
+    scheduler.unschedule(uid, payload.session_id)
+    release_candle_streams.delay(uid, payload.session_id)
     worker_arn = r.hget(key, "worker_arn")
     if worker_arn:
         stop_user_worker(worker_arn)
-    r.publish(f"metrics:{uid}", json.dumps({"type": "session_halted", "session_id": payload.session_id}))
+    wire.publish(r, f"metrics:{uid}", {"type": "session_halted", "session_id": payload.session_id})
     with SessionLocal() as db:
         obj = db.get(DbSession, payload.session_id)
         if obj and obj.user_id == uid:
@@ -221,82 +238,134 @@ async def ws_stream(websocket: WebSocket):
         await websocket.close(code=4401)
         return
     try:
-        decoded = auth.verify_id_token(token)
-        uid = decoded.get("uid")
+        # A cache miss verifies off the event loop
+        uid = firebase_tokens.cached_uid(token) or await asyncio.to_thread(firebase_tokens.verify_id_token, token)
     except Exception:
         await websocket.close(code=4401)
         return
     await websocket.accept()
-    # print(f"[WS] Accepted connection for {uid}")
-    pubsub = r.pubsub()
-    pubsub.subscribe(f"signals:{uid}", f"metrics:{uid}", f"logs:{uid}")
-    # print(f"[WS] Subscribed to signals:{uid}, metrics:{uid}, logs:{uid}")
-
-    stop_flag = {"stop": False}
-    import asyncio
-    loop = asyncio.get_running_loop()
-
-    def reader():
-        # print(f"[WS] Reader thread started for {uid}")
-        for message in pubsub.listen():
-            if stop_flag["stop"]:
-                break
-            if message and message["type"] == "message":
-                data = message["data"]
-                try:
-                    # print(f"[WS] Received redis msg: {data}")
-                    text = str(data)
-                    asyncio.run_coroutine_threadsafe(websocket.send_text(text), loop)
-                except Exception as e:
-                    print(f"[WS] Error sending message: {e}")
-
-    thread = threading.Thread(target=reader, daemon=True)
-    thread.start()
-    try:
+    # Optional verbosity: ?level=debug|log|error, or {"level": ...} sent later.
+    # ?format=msgpack switches to binary frames (JSON text if unavailable).
+    params = websocket.query_params
+    buffer = hub.subscribe(uid, level=params.get("level", "debug"), fmt=params.get("format", "json"))
+
+    async def sender():
         while True:
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        stop_flag["stop"] = True
-        try:
-            pubsub.close()
-        except Exception:
-            pass
-        return
+            data = await buffer.get()
+            if isinstance(data, bytes):
+                await websocket.send_bytes(data)
+            else:
+                await websocket.send_text(data)
+
+    async def receiver():
+        while True:
+            text = await websocket.receive_text()
+            try:
+                request = json.loads(text)
+            except Exception:
+                continue
+            if isinstance(request, dict) and request.get("level"):
+                buffer.set_level(request["level"])
+
+    tasks = [asyncio.create_task(sender()), asyncio.create_task(receiver())]
+    try:
+        # Either side ending (disconnect, send failure) ends the connection
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Collects their exceptions (WebSocketDisconnect included) and makes
+        # sure the sender is done before the buffer leaves the hub
+        await asyncio.gather(*tasks, return_exceptions=True)
+        hub.unsubscribe(uid, buffer)
+
+
+@app.on_event("startup")
+async def start_stream_hub():
+    await hub.start()
+
+
+@app.on_event("shutdown")
+async def stop_stream_hub():
+    await hub.stop()
+
+
+@app.on_event("shutdown")
+async def close_async_clients():
+    await ar.aclose()
+    if async_engine is not None:
+        await async_engine.dispose()
 
 
 @app.on_event("startup")
 def on_startup():
     Base.metadata.create_all(bind=engine)
+    firebase_tokens.start_cert_refresh()
     threading.Thread(target=_monitor_sessions, daemon=True).start()
     if os.getenv("ENABLE_BEAT") == "1":
         spawn_beat()
+    if os.getenv("ENABLE_SERVICES") == "1":
+        spawn_services()
+    elif os.getenv("ECS_CLUSTER") and os.getenv("SERVICES_EXTERNAL") != "1":
+        # Workers alone don't tick sessions or settle trades
+        raise RuntimeError("ECS_CLUSTER is set but neither ENABLE_SERVICES=1 nor SERVICES_EXTERNAL=1: "
+                           "scheduler, settlements, journal and candle_events would not run")
+
+
+def _encode_cursor(at: datetime, row_id) -> str:
+    return f"{at.isoformat()}_{row_id}"
+
+
+def _keyset(stmt, cursor: Optional[str], at_col, id_col, id_type=str):
+    # Newest first; the cursor is the (time, id) of the last row already seen
+    stmt = stmt.order_by(at_col.desc(), id_col.desc())
+    if not cursor:
+        return stmt
+    at, _, row_id = cursor.partition("_")
+    try:
+        at, row_id = datetime.fromisoformat(at), id_type(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid cursor")
+    return stmt.where(or_(at_col < at, and_(at_col == at, id_col < row_id)))
+
+
+def _set_next_cursor(response: Response, rows, limit: int, at_attr: str) -> None:
+    # A full page may have more behind it; pass the header back as ?cursor=
+    if len(rows) == limit:
+        last = rows[-1]
+        response.headers["X-Next-Cursor"] = _encode_cursor(getattr(last, at_attr), last.id)
 
 
 @app.get("/me/sessions")
-def me_sessions(limit: int = Query(50, ge=1, le=200), authorization: Optional[str] = Header(None)):
-    uid = _verify_id_token(authorization)
-    with SessionLocal() as db:
-        rows = db.query(DbSession).filter(DbSession.user_id == uid).order_by(DbSession.started_at.desc()).limit(limit).all()
-        result = []
-        for s in rows:
-            key = _session_key(uid, s.id)
-            counters = {"reject_count": 0, "retry_count": 0, "heartbeat_missed": 0, "heartbeat": 0}
-            if r.exists(key):
-                reject_count = int(r.hget(key, "reject_count") or "0")
-                retry_count = int(r.hget(key, "retry_count") or "0")
-                heartbeat_missed = int(r.hget(key, "heartbeat_missed") or "0")
-                heartbeat = float(r.hget(key, "heartbeat") or "0")
-                counters = {"reject_count": reject_count, "retry_count": retry_count, "heartbeat_missed": heartbeat_missed, "heartbeat": heartbeat}
-            result.append({"id": s.id, "mode": s.mode, "status": s.status, "profit": s.profit, "trades": s.trades, "started_at": s.started_at.isoformat(), **counters})
-        return result
+async def me_sessions(response: Response, limit: int = Query(50, ge=1, le=200), cursor: Optional[str] = Query(None), authorization: Optional[str] = Header(None)):
+    uid = await _verify_id_token_async(authorization)
+    stmt = _keyset(select(DbSession).where(DbSession.user_id == uid), cursor, DbSession.started_at, DbSession.id)
+    rows = await fetch_all(stmt.limit(limit))
+    _set_next_cursor(response, rows, limit, "started_at")
+    # One round trip for every row's counters; a missing hash reads as zeros
+    pipe = ar.pipeline(transaction=False)
+    for s in rows:
+        pipe.hmget(_session_key(uid, s.id), "reject_count", "retry_count", "heartbeat_missed", "heartbeat")
+    values = await pipe.execute() if rows else []
+    result = []
+    for s, (reject_count, retry_count, heartbeat_missed, heartbeat) in zip(rows, values):
+        counters = {
+            "reject_count": int(reject_count or "0"),
+            "retry_count": int(retry_count or "0"),
+            "heartbeat_missed": int(heartbeat_missed or "0"),
+            "heartbeat": float(heartbeat or "0"),
+        }
+        result.append({"id": s.id, "mode": s.mode, "status": s.status, "profit": s.profit, "trades": s.trades, "started_at": s.started_at.isoformat(), **counters})
+    return result
 
 
 @app.get("/me/trades")
-def me_trades(limit: int = Query(200, ge=1, le=500), authorization: Optional[str] = Header(None)):
-    uid = _verify_id_token(authorization)
-    with SessionLocal() as db:
-        rows = db.query(DbTrade).filter(DbTrade.user_id == uid).order_by(DbTrade.created_at.desc()).limit(limit).all()
-        return [{"id": t.id, "session_id": t.session_id, "pair": t.pair, "direction": t.direction, "amount": t.amount, "result": t.result, "pnl": t.pnl, "created_at": t.created_at.isoformat()} for t in rows]
+async def me_trades(response: Response, limit: int = Query(200, ge=1, le=500), cursor: Optional[str] = Query(None), authorization: Optional[str] = Header(None)):
+    uid = await _verify_id_token_async(authorization)
+    stmt = _keyset(select(DbTrade).where(DbTrade.user_id == uid), cursor, DbTrade.created_at, DbTrade.id, int)
+    rows = await fetch_all(stmt.limit(limit))
+    _set_next_cursor(response, rows, limit, "created_at")
+    return [{"id": t.id, "session_id": t.session_id, "pair": t.pair, "direction": t.direction, "amount": t.amount, "result": t.result, "pnl": t.pnl, "created_at": t.created_at.isoformat()} for t in rows]
 
 
 @app.get("/iq/balance")
@@ -329,20 +398,19 @@ def _monitor_sessions():
     import time
     while True:
         try:
-            for key in r.scan_iter("session:*"):
-                status = r.hget(key, "status")
+            # Scheduled sessions only; session:* also matches string keys
+            for member in r.zrange(scheduler.DUE_KEY, 0, -1):
+                key = f"session:{member}"
+                status, hb, next_tick = r.hmget(key, "status", "heartbeat", "next_tick")
                 if status != "running":
                     continue
-                hb = float(r.hget(key, "heartbeat") or "0")
-                if hb and time.time() - hb > 300:
+                if scheduler.overdue(hb, next_tick) > 300:
                     r.hset(key, "status", "halted")
-                    parts = key.split(":")
-                    uid = parts[1] if len(parts) > 1 else ""
-                    session_id = parts[2] if len(parts) > 2 else ""
+                    uid, _, session_id = member.partition(":")
                     worker_arn = r.hget(key, "worker_arn")
                     if worker_arn:
                         stop_user_worker(worker_arn)
-                    r.publish(f"metrics:{uid}", json.dumps({"type": "halt", "reason": "heartbeat_timeout", "session_id": session_id}))
+                    wire.publish(r, f"metrics:{uid}", {"type": "halt", "reason": "heartbeat_timeout", "session_id": session_id})
         except Exception:
             pass
         time.sleep(5)
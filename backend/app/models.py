@@ -1,15 +1,105 @@
 import os
-from sqlalchemy import create_engine, Column, String, Integer, Float, DateTime
+import asyncio
+from sqlalchemy import create_engine, event, Column, String, Integer, Float, DateTime, Index
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import declarative_base, sessionmaker
 from datetime import datetime
 from dotenv import load_dotenv
 
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+except ImportError:
+    create_async_engine = None
+
 load_dotenv()
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///axon.db")
-engine = create_engine(DATABASE_URL, future=True)
+# Async driver for the API read paths: aiosqlite for SQLite, asyncpg for Postgres
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA temp_store=MEMORY",
+)
+
+
+def _is_sqlite(url) -> bool:
+    return url.get_backend_name() == "sqlite"
+
+
+def _engine_options(url) -> dict:
+    if _is_sqlite(url):
+        # Waits for the file lock inside SQLite (busy_timeout) instead of failing fast
+        return {"connect_args": {"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT / 1000}}
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "10")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": True,
+    }
+
+
+def _apply_pragmas(sync_engine) -> None:
+    # WAL lets readers run alongside the single writer; NORMAL sync is safe with WAL
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_conn, _record):
+        cursor = dbapi_conn.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def _async_url(url):
+    override = os.getenv("ASYNC_DATABASE_URL")
+    if override:
+        return make_url(override)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if not driver:
+        return None
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}")
+
+
+def _create_async_engine(url):
+    # Optional: without the async driver installed the API runs the same
+    # queries on the sync engine in a worker thread
+    async_url = _async_url(url)
+    if create_async_engine is None or async_url is None:
+        return None
+    try:
+        async_engine = create_async_engine(async_url, **_engine_options(async_url))
+    except ImportError:
+        return None
+    if _is_sqlite(async_url):
+        _apply_pragmas(async_engine.sync_engine)
+    return async_engine
+
+
+_url = make_url(DATABASE_URL)
+engine = create_engine(_url, future=True, **_engine_options(_url))
+if _is_sqlite(_url):
+    _apply_pragmas(engine)
 Base = declarative_base()
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False, future=True)
 
+async_engine = _create_async_engine(_url)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False) if async_engine is not None else None
+
+
+async def fetch_all(stmt) -> list:
+    """Rows of a select() statement without blocking the event loop."""
+    if AsyncSessionLocal is not None:
+        async with AsyncSessionLocal() as db:
+            return (await db.execute(stmt)).scalars().all()
+
+    def _run():
+        with SessionLocal() as db:
+            return db.execute(stmt).scalars().all()
+    return await asyncio.to_thread(_run)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -28,6 +118,8 @@ class Session(Base):
     stopped_at = Column(DateTime, nullable=True)
     profit = Column(Float, default=0.0)
     trades = Column(Integer, default=0)
+    # Serves the newest-first history pages of one user (keyset on started_at, id)
+    __table_args__ = (Index("ix_sessions_user_id_started_at", user_id, started_at.desc(), id.desc()),)
 
 
 class Trade(Base):
@@ -39,11 +131,12 @@ class Trade(Base):
     direction = Column(String)
     amount = Column(Float)
     expiry = Column(Integer)
-    order_id = Column(String, index=True)
+    order_id = Column(String, index=True, unique=True)
     status = Column(String, index=True)
     result = Column(String, index=True)
     pnl = Column(Float, default=0.0)
     created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (Index("ix_trades_user_id_created_at", user_id, created_at.desc(), id.desc()),)
 
 
 class IQCredential(Base):
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import redis
+from .celery_app import celery, user_queue
+
+redis_host = os.getenv("REDIS_HOST", "redis")
+redis_port = int(os.getenv("REDIS_PORT", "6379"))
+r = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
+
+# Sorted set of "uid:session_id" scored by when the session's next tick is due
+DUE_KEY = "sched:due"
+# A claimed session is pushed this far out until its tick reschedules it,
+# so a lost task only delays the session instead of killing it
+LEASE = int(os.getenv("SCHED_LEASE", "120"))
+BATCH = int(os.getenv("SCHED_BATCH", "200"))
+# Sessions per analyze_batch task on a shared queue
+CHUNK = int(os.getenv("SCHED_CHUNK", "4"))
+POLL = float(os.getenv("SCHED_POLL", "0.5"))
+_claim = r.register_script("""
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+for _, member in ipairs(due) do
+    redis.call('ZADD', KEYS[1], 'XX', ARGV[2], member)
+end
+return due
+""")
+
+# A score at or before "now" is a wake that arrived while the tick ran;
+# it wins over the tick's own next time. Either way the session hash gets
+# next_tick, which liveness checks compare its heartbeat against.
+_reschedule = r.register_script("""
+local current = redis.call('ZSCORE', KEYS[1], ARGV[1])
+local at = ARGV[3]
+local moved = 1
+if current and tonumber(current) <= tonumber(ARGV[2]) then
+    at = current
+    moved = 0
+else
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('HSET', KEYS[2], 'next_tick', at)
+end
+return moved
+""")
+
+
+def _member(uid: str, session_id: str) -> str:
+    return f"{uid}:{session_id}"
+
+
+def schedule(uid: str, session_id: str, at: float = None) -> None:
+    at = at or time.time()
+    pipe = r.pipeline(transaction=True)
+    pipe.zadd(DUE_KEY, {_member(uid, session_id): at})
+    pipe.hset(f"session:{uid}:{session_id}", "next_tick", at)
+    pipe.execute()
+
+
+def overdue(heartbeat, next_tick, now: float = None) -> float:
+    # Seconds the session's tick is behind: a tick refreshes the heartbeat,
+    # so a heartbeat older than the time the tick was due means it hasn't
+    # run yet. Sessions idle between bars are never overdue.
+    now = now or time.time()
+    heartbeat, next_tick = float(heartbeat or 0), float(next_tick or 0)
+    if not next_tick or heartbeat >= next_tick:
+        return 0.0
+    return max(0.0, now - next_tick)
+
+
+def wake(uid: str, session_id: str, at: float = None, client=None) -> None:
+    # Pulls a scheduled session's next tick forward; never delays it and
+    # never revives a session that has left the schedule
+    (client or r).zadd(DUE_KEY, {_member(uid, session_id): at or time.time()}, xx=True, lt=True)
+
+
+def reschedule(uid: str, session_id: str, countdown: float) -> None:
+    now = time.time()
+    _reschedule(keys=[DUE_KEY, f"session:{uid}:{session_id}"], args=[_member(uid, session_id), now, now + countdown])
+
+
+def unschedule(uid: str, session_id: str) -> None:
+    r.zrem(DUE_KEY, _member(uid, session_id))
+
+
+def _dispatch(members) -> None:
+    pipe = r.pipeline(transaction=False)
+    for member in members:
+        pipe.hmget(f"session:{member}", "status", "config")
+    batches = {}
+    for member, (status, config) in zip(members, pipe.execute()):
+        uid, _, session_id = member.partition(":")
+        if status != "running" or not config:
+            r.zrem(DUE_KEY, member)
+            # Halted outside a tick (e.g. a safety limit on settlement)
+            # (control queue: a stopped session's own worker may be gone)
+            celery.send_task("axon.release_candle_streams", args=[uid, session_id])
+            continue
+        batches.setdefault(user_queue(uid, session_id), []).append([uid, session_id, json.loads(config)])
+    for queue, sessions in batches.items():
+        for i in range(0, len(sessions), CHUNK):
+            chunk = sessions[i:i + CHUNK]
+            if len(chunk) == 1:
+                celery.send_task("axon.analyze_market", args=chunk[0], queue=queue)
+            else:
+                celery.send_task("axon.analyze_batch", args=[chunk], queue=queue)
+
+
+def run():
+    print(f"[Scheduler] Dispatching due sessions from {DUE_KEY}")
+    while True:
+        try:
+            now = time.time()
+            due = _claim(keys=[DUE_KEY], args=[now, now + LEASE, BATCH])
+            if due:
+                _dispatch(due)
+            if len(due) < BATCH:
+                time.sleep(POLL)
+        except Exception as e:
+            print(f"[Scheduler] Error: {e}")
+            time.sleep(1)
+
+
+if __name__ == "__main__":
+    run()
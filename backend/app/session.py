@@ -1,5 +1,7 @@
 import os
 import redis
+from typing import Optional, Tuple
+from . import wire
 
 redis_host = os.getenv("REDIS_HOST", "redis")
 redis_port = int(os.getenv("REDIS_PORT", "6379"))
@@ -10,48 +12,95 @@ def session_key(uid: str, session_id: str) -> str:
     return f"session:{uid}:{session_id}"
 
 
-def update_metrics(uid: str, session_id: str, delta_pnl: float, won: bool) -> None:
-    key = session_key(uid, session_id)
-    if not r.exists(key):
-        return
-    pnl = float(r.hget(key, "profit") or "0")
-    trades = int(r.hget(key, "trades") or "0")
-    consecutive_losses = int(r.hget(key, "consecutive_losses") or "0")
-    wins = int(r.hget(key, "wins") or "0")
-    pnl += delta_pnl
-    trades += 1
-    if won:
-        wins += 1
-        consecutive_losses = 0
-    else:
-        consecutive_losses += 1
-    r.hmset(key, {"profit": pnl, "trades": trades, "wins": wins, "consecutive_losses": consecutive_losses})
-    r.publish(f"metrics:{uid}", f'{{"type":"metrics","session_id":"{session_id}","pnl":{pnl},"trades":{trades},"wins":{wins},"consecutive_losses":{consecutive_losses}}}')
-    _evaluate_safety(uid, session_id)
-
-
-def _evaluate_safety(uid: str, session_id: str) -> None:
-    key = session_key(uid, session_id)
-    stop_loss = float(r.hget(key, "stop_loss") or "0")
-    take_profit = float(r.hget(key, "take_profit") or "0")
-    max_losses = int(r.hget(key, "max_consecutive_losses") or "0")
-    max_trades = int(r.hget(key, "max_trades") or "0")
-    pnl = float(r.hget(key, "profit") or "0")
-    trades = int(r.hget(key, "trades") or "0")
-    consecutive_losses = int(r.hget(key, "consecutive_losses") or "0")
-    if stop_loss and pnl <= -abs(stop_loss):
-        r.hset(key, "status", "halted")
-        r.publish(f"metrics:{uid}", f'{{"type":"halt","reason":"stop_loss","session_id":"{session_id}"}}')
-        return
-    if take_profit and pnl >= abs(take_profit):
-        r.hset(key, "status", "halted")
-        r.publish(f"metrics:{uid}", f'{{"type":"halt","reason":"take_profit","session_id":"{session_id}"}}')
-        return
-    if max_losses and consecutive_losses >= max_losses:
-        r.hset(key, "status", "halted")
-        r.publish(f"metrics:{uid}", f'{{"type":"halt","reason":"max_consecutive_losses","session_id":"{session_id}"}}')
-        return
-    if max_trades and trades >= max_trades:
-        r.hset(key, "status", "halted")
-        r.publish(f"metrics:{uid}", f'{{"type":"halt","reason":"max_trades","session_id":"{session_id}"}}')
-        return
+# Settles one trade against the session hash and evaluates the safety
+# limits in a single atomic step, so concurrent trade_result tasks can't
+# lose updates. Halts the session itself when a limit trips; the caller
+# publishes the resulting events (so they follow WIRE_FORMAT_*).
+#   KEYS[1]  session hash
+#   KEYS[2]  optional: sorted set of unsettled trades
+#   ARGV     delta_pnl, outcome (1 win / 0 loss / 2 tie), release active trade (1/0),
+#            the trade's member in KEYS[2]
+# Returns {pnl, trades, wins, consecutive_losses, halt_reason or ""}, nil
+# when the session no longer exists, or 0 when the trade was not in KEYS[2]
+# (already settled).
+UPDATE_METRICS_LUA = """
+local key = KEYS[1]
+if KEYS[2] and redis.call('ZREM', KEYS[2], ARGV[4]) == 0 then
+  return 0
+end
+if redis.call('EXISTS', key) == 0 then
+  return nil
+end
+if ARGV[3] == '1' then
+  redis.call('HINCRBY', key, 'active_trades', -1)
+end
+local pnl = tonumber(redis.call('HINCRBYFLOAT', key, 'profit', ARGV[1]))
+local trades = redis.call('HINCRBY', key, 'trades', 1)
+local wins
+local losses
+if ARGV[2] == '1' then
+  wins = redis.call('HINCRBY', key, 'wins', 1)
+  redis.call('HSET', key, 'consecutive_losses', 0)
+  losses = 0
+elseif ARGV[2] == '2' then
+  -- A refunded tie neither wins nor breaks or extends a losing streak
+  wins = tonumber(redis.call('HGET', key, 'wins') or '0') or 0
+  losses = tonumber(redis.call('HGET', key, 'consecutive_losses') or '0') or 0
+else
+  wins = tonumber(redis.call('HGET', key, 'wins') or '0') or 0
+  losses = redis.call('HINCRBY', key, 'consecutive_losses', 1)
+end
+local limits = redis.call('HMGET', key, 'stop_loss', 'take_profit', 'max_consecutive_losses', 'max_trades')
+local stop_loss = tonumber(limits[1] or '0') or 0
+local take_profit = tonumber(limits[2] or '0') or 0
+local max_losses = tonumber(limits[3] or '0') or 0
+local max_trades = tonumber(limits[4] or '0') or 0
+local reason = ''
+if stop_loss ~= 0 and pnl <= -math.abs(stop_loss) then
+  reason = 'stop_loss'
+elseif take_profit ~= 0 and pnl >= math.abs(take_profit) then
+  reason = 'take_profit'
+elseif max_losses ~= 0 and losses >= max_losses then
+  reason = 'max_consecutive_losses'
+elseif max_trades ~= 0 and trades >= max_trades then
+  reason = 'max_trades'
+end
+if reason ~= '' then
+  redis.call('HSET', key, 'status', 'halted')
+end
+return {tostring(pnl), trades, wins, losses, reason}
+"""
+
+_update_metrics = r.register_script(UPDATE_METRICS_LUA)
+
+
+# update_metrics result when ``pending`` was already settled
+DUPLICATE = "duplicate"
+
+
+def update_metrics(uid: str, session_id: str, delta_pnl: float, won: bool, release_trade: bool = False, log: Optional[dict] = None,
+                   tie: bool = False, pending: Optional[Tuple[str, str]] = None) -> Optional[str]:
+    # One scripted step plus one pipelined publish per settlement; returns
+    # the halt reason, if the trade tripped a safety limit. With pending
+    # (sorted set, member) the trade is taken off it in the same step, and
+    # nothing is applied (DUPLICATE) if it was no longer there.
+    keys = [session_key(uid, session_id)]
+    args = [delta_pnl, 2 if tie else 1 if won else 0, 1 if release_trade else 0]
+    if pending:
+        keys.append(pending[0])
+        args.append(pending[1])
+    res = _update_metrics(keys=keys, args=args)
+    if res == 0:
+        return DUPLICATE
+    pipe = r.pipeline(transaction=False)
+    if log:
+        wire.publish(pipe, f"logs:{uid}", log)
+    reason = None
+    if res:
+        pnl, trades, wins, losses, reason = res
+        reason = reason or None
+        wire.publish(pipe, f"metrics:{uid}", {"type": "metrics", "session_id": session_id, "pnl": float(pnl), "trades": trades, "wins": wins, "consecutive_losses": losses})
+        if reason:
+            wire.publish(pipe, f"metrics:{uid}", {"type": "halt", "reason": reason, "session_id": session_id})
+    pipe.execute()
+    return reason
@@ -0,0 +1,77 @@
+import os
+import socket
+import time
+import redis
+from .tasks import settle_trade, PENDING_TRADES
+
+redis_host = os.getenv("REDIS_HOST", "redis")
+redis_port = int(os.getenv("REDIS_PORT", "6379"))
+r = redis.Redis(host=redis_host, port=redis_port, db=0, decode_responses=True)
+
+STREAM = "trades:settlements"
+GROUP = "settlers"
+# Stable across restarts so a replacement consumer owns its predecessor's
+# pending entries; other consumers' stalled entries are claimed after CLAIM_IDLE
+CONSUMER = os.getenv("SETTLEMENTS_CONSUMER") or socket.gethostname()
+CLAIM_IDLE = int(os.getenv("SETTLEMENTS_CLAIM_IDLE", "30"))
+
+
+def _ensure_group() -> None:
+    try:
+        r.xgroup_create(STREAM, GROUP, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+def _handle(fields) -> None:
+    settled = settle_trade(fields.get("uid", ""), fields.get("session_id", ""), fields.get("order_id", ""), fields.get("status", "closed"), float(fields.get("pnl") or 0), fields.get("result", ""))
+    if settled:
+        print(f"[Settlements] {fields.get('uid')} {fields.get('order_id')}: {fields.get('status')} {fields.get('pnl')}")
+
+
+def _expire_overdue() -> None:
+    # Trades whose agent never reported (agent died, events lost)
+    for member in r.zrangebyscore(PENDING_TRADES, "-inf", time.time(), start=0, num=100):
+        uid, session_id, order_id = member.split(":", 2)
+        settle_trade(uid, session_id, order_id, "timeout", 0.0)
+
+
+def _claim_idle(start: str):
+    # Settlements read by a consumer that died before acking them
+    start, claimed, deleted = r.xautoclaim(STREAM, GROUP, CONSUMER, min_idle_time=CLAIM_IDLE * 1000, start_id=start, count=100)[:3]
+    if deleted:
+        r.xack(STREAM, GROUP, *deleted)
+    return start, [(entry_id, fields) for entry_id, fields in claimed if fields]
+
+
+def run(block_ms: int = 1000):
+    _ensure_group()
+    # Start with anything this consumer read but never acked
+    last_id = "0"
+    claim_from = "0-0"
+    next_claim = 0.0
+    while True:
+        try:
+            entries = []
+            if time.time() >= next_claim:
+                claim_from, entries = _claim_idle(claim_from)
+                if claim_from == "0-0":
+                    next_claim = time.time() + CLAIM_IDLE
+            if not entries:
+                resp = r.xreadgroup(GROUP, CONSUMER, {STREAM: last_id}, count=100, block=block_ms)
+                entries = resp[0][1] if resp else []
+                if last_id == "0" and not entries:
+                    last_id = ">"
+            for entry_id, fields in entries:
+                if fields:
+                    _handle(fields)
+                r.xack(STREAM, GROUP, entry_id)
+            _expire_overdue()
+        except Exception as e:
+            print(f"[Settlements] Error: {e}")
+            time.sleep(1)
+
+
+if __name__ == "__main__":
+    run()
@@ -1,21 +1,40 @@
 from typing import Dict, Any, Optional, List
+import numpy as np
 import pandas as pd
 import random
+from .indicators import Indicator, EMA, RSI, BBands, Keltner, Donchian, HeikinAshi, get_engine, TENSOR_FIELDS
 try:
     import pandas_ta as ta
 except ImportError:
     ta = None
 
 class Strategy:
+    # Whether indicators() is non-empty; set per subclass on first use
+    _incremental: Optional[bool] = None
+
     def __init__(self, name: str):
         self.name = name
 
     def calculate_indicators(self, df: pd.DataFrame) -> pd.DataFrame:
         return df
 
-    def generate_signal(self, candles: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    def indicators(self) -> List[Indicator]:
+        # Incremental equivalents of calculate_indicators; empty means
+        # the strategy only supports the DataFrame path
+        return []
+
+    def incremental(self) -> bool:
+        cls = type(self)
+        if "_incremental" not in cls.__dict__:
+            cls._incremental = bool(self.indicators())
+        return cls._incremental
+
+    def generate_signal(self, candles: List[Dict[str, Any]], pair: Optional[str] = None, timeframe: Optional[int] = None) -> Optional[Dict[str, Any]]:
         if not candles or len(candles) < 50:
             return None
+
+        if pair is not None and timeframe is not None and self.incremental():
+            return self.generate_signal_incremental(candles, pair, timeframe)
             
         df = pd.DataFrame(candles)
         # Ensure correct types and sort
@@ -43,6 +62,42 @@ class Strategy:
             print(f"Strategy Error: {e}")
             return None
 
+    def generate_signal_incremental(self, candles: List[Dict[str, Any]], pair: str, timeframe: int) -> Optional[Dict[str, Any]]:
+        # Only candles newer than the engine's state are folded in, so a
+        # tick costs O(new candles) instead of a full recompute
+        engine = get_engine(self.name, pair, timeframe, self.indicators)
+        try:
+            last, prev = engine.rows(candles)
+            if last is None or prev is None:
+                return None
+            return self.check_rules(None, last, prev)
+        except Exception as e:
+            print(f"Strategy Error: {e}")
+            engine.reset()
+            return None
+
+    def generate_signals(self, batch: np.ndarray) -> List[Optional[Dict[str, Any]]]:
+        # batch: (pairs, bars, OHLCV) from indicators.candle_tensor. Indicators
+        # are computed for every pair in one vectorised pass; the rules then
+        # run on each pair's last/prev row as in generate_signal.
+        indicators = self.indicators()
+        if not indicators or batch.shape[1] < 50:
+            return [None] * len(batch)
+        columns = {field: batch[:, :, i] for i, field in enumerate(TENSOR_FIELDS)}
+        for ind in indicators:
+            columns.update(ind.batch(batch))
+        names = list(columns)
+        lasts = np.stack([columns[name][:, -1] for name in names], axis=1).tolist()
+        prevs = np.stack([columns[name][:, -2] for name in names], axis=1).tolist()
+        signals = []
+        for last, prev in zip(lasts, prevs):
+            try:
+                signals.append(self.check_rules(None, dict(zip(names, last)), dict(zip(names, prev))))
+            except Exception as e:
+                print(f"Strategy Error: {e}")
+                signals.append(None)
+        return signals
+
     def check_rules(self, df, last, prev) -> Optional[Dict[str, Any]]:
         return None
 
@@ -57,6 +112,9 @@ class TrendContinuation(Strategy):
         df['RSI'] = ta.rsi(df['close'], length=14)
         return df
 
+    def indicators(self):
+        return [EMA(20), EMA(50), RSI(14)]
+
     def check_rules(self, df, last, prev):
         # Trend Definition
         uptrend = last['EMA_20'] > last['EMA_50']
@@ -91,6 +149,9 @@ class RsiReversal(Strategy):
         df = pd.concat([df, bb], axis=1)
         return df
 
+    def indicators(self):
+        return [RSI(14), BBands(20, 2.0)]
+
     def check_rules(self, df, last, prev):
         rsi = last['RSI']
         # pandas_ta bbands columns: BBL_20_2.0, BBM_20_2.0, BBU_20_2.0
@@ -120,6 +181,9 @@ class BreakoutRetest(Strategy):
         df['low_20'] = df['min'].rolling(window=20).min()
         return df
 
+    def indicators(self):
+        return [Donchian(20, upper='high_20', lower='low_20')]
+
     def check_rules(self, df, last, prev):
         # Breakout UP: Close > Prev High 20
         # (Using prev high to ensure it's a breakout of the *past* range)
@@ -143,6 +207,9 @@ class EmaCrossover(Strategy):
         df['EMA_9'] = ta.ema(df['close'], length=9)
         df['EMA_21'] = ta.ema(df['close'], length=21)
         return df
+
+    def indicators(self):
+        return [EMA(9), EMA(21)]
     
     def check_rules(self, df, last, prev):
         # BUY: 9 crosses above 21
@@ -168,6 +235,9 @@ class HeikinAshiTrend(Strategy):
         df['EMA_20'] = ta.ema(df['close'], length=20)
         return df
 
+    def indicators(self):
+        return [HeikinAshi(), EMA(20)]
+
     def check_rules(self, df, last, prev):
         # HA columns: HA_open, HA_high, HA_low, HA_close
         if 'HA_close' not in last:
@@ -215,6 +285,10 @@ class VolatilitySqueeze(Strategy):
         
         df = pd.concat([df, bb, kc], axis=1)
         return df
+
+    def indicators(self):
+        # IQ candles carry max/min rather than high/low
+        return [BBands(20, 2.0), Keltner(20, 1.5)]
     
     def check_rules(self, df, last, prev):
         # Check if Squeeze was ON in previous candle
@@ -250,7 +324,7 @@ class RandomStrategy(Strategy):
     def __init__(self):
         super().__init__("Random Strategy")
 
-    def generate_signal(self, candles: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    def generate_signal(self, candles: List[Dict[str, Any]], pair: Optional[str] = None, timeframe: Optional[int] = None) -> Optional[Dict[str, Any]]:
         # Bypass minimum candle check for testing
         print(f"DEBUG: RandomStrategy generate_signal called with {len(candles) if candles else 0} candles")
         if not candles:
@@ -260,6 +334,9 @@ class RandomStrategy(Strategy):
         direction = "CALL" if random.random() > 0.5 else "PUT"
         return {"direction": direction, "confidence": 1.0}
 
+    def generate_signals(self, batch):
+        return [self.generate_signal([{"close": 1.0}]) for _ in range(len(batch))]
+
     def check_rules(self, df, last, prev):
         # Not used because we override generate_signal
         return None
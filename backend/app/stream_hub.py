@@ -0,0 +1,194 @@
+import os
+import json
+import asyncio
+from collections import deque, OrderedDict
+from typing import Any, Dict, Set, Optional, Tuple, Union
+import redis.asyncio as aioredis
+from . import wire
+
+redis_host = os.getenv("REDIS_HOST", "redis")
+redis_port = int(os.getenv("REDIS_PORT", "6379"))
+
+STREAM_PATTERNS = ("signals:*", "metrics:*", "logs:*")
+QUEUE_SIZE = int(os.getenv("WS_QUEUE_SIZE", "256"))
+
+# Client verbosity: a connection at level "log" never sees debug lines,
+# at "error" only errors (signals and metrics are always delivered)
+LEVELS = {"debug": 0, "log": 1, "error": 2}
+# Metric updates where only the newest per session matters
+COALESCED_TYPES = {"metrics", "heartbeat", "heartbeat_warning", "counter"}
+
+URGENT = "urgent"
+LATEST = "latest"
+LOG = "log"
+
+
+def classify(channel: str, payload: Any) -> Tuple[str, Optional[tuple], int]:
+    # -> (lane, coalescing key, level)
+    kind = channel.split(":", 1)[0]
+    if kind == "signals":
+        return URGENT, None, LEVELS["error"]
+    msg_type = payload.get("type") if isinstance(payload, dict) else None
+    if kind == "metrics":
+        if msg_type in COALESCED_TYPES:
+            key = (msg_type, payload.get("session_id"))
+            if msg_type == "counter":
+                # Each counter message carries one field; only the same field supersedes it
+                key += tuple(sorted(k for k in payload if k not in ("type", "session_id")))
+            return LATEST, key, LEVELS["error"]
+        return URGENT, None, LEVELS["error"]
+    return LOG, None, LEVELS.get(msg_type, LEVELS["log"])
+
+
+def _frame(data: bytes, payload: Any, fmt: str) -> Union[str, bytes]:
+    if payload is not None and wire.format_of(data) != fmt:
+        return wire.dumps(payload, fmt)
+    # Already in the client's format (or undecodable): pass it through
+    return data if fmt == wire.MSGPACK else data.decode("utf-8", "replace")
+
+
+class StreamBuffer:
+    """Outgoing buffer for one websocket.
+
+    Signals and one-off metric events (halt, errors, session changes) go
+    first and are never coalesced. Periodic metrics keep only the newest
+    value per (type, session). Logs share a bounded queue that drops the
+    oldest debug line first, then the oldest log.
+    """
+
+    def __init__(self, level: str = "debug", size: int = QUEUE_SIZE, fmt: str = wire.JSON):
+        self.level = LEVELS.get(level, LEVELS["debug"])
+        # Frames are text for JSON clients, bytes for msgpack ones
+        self.fmt = wire.negotiate(fmt)
+        self.size = size
+        self.urgent: deque = deque(maxlen=size * 4)
+        self.latest: OrderedDict = OrderedDict()
+        self.logs: deque = deque()
+        self.dropped = 0
+        self._ready = asyncio.Event()
+
+    def set_level(self, level: str) -> None:
+        if level in LEVELS:
+            self.level = LEVELS[level]
+
+    def offer(self, lane: str, key: Optional[tuple], level: int, data: Union[str, bytes]) -> None:
+        if level < self.level:
+            return
+        if lane == URGENT:
+            self.urgent.append(data)
+        elif lane == LATEST:
+            self.latest.pop(key, None)
+            self.latest[key] = data
+        else:
+            if len(self.logs) >= self.size:
+                self._drop_log()
+            self.logs.append((level, data))
+        self._ready.set()
+
+    def _drop_log(self) -> None:
+        self.dropped += 1
+        for i, (level, _) in enumerate(self.logs):
+            if level == LEVELS["debug"]:
+                del self.logs[i]
+                return
+        self.logs.popleft()
+
+    def _pop(self) -> Optional[Union[str, bytes]]:
+        if self.urgent:
+            return self.urgent.popleft()
+        if self.latest:
+            return self.latest.popitem(last=False)[1]
+        if self.logs:
+            return self.logs.popleft()[1]
+        return None
+
+    async def get(self) -> Union[str, bytes]:
+        while True:
+            data = self._pop()
+            if data is not None:
+                return data
+            self._ready.clear()
+            await self._ready.wait()
+
+
+class StreamHub:
+    """Fans Redis pub/sub out to websocket clients.
+
+    One pattern subscription per API process feeds a StreamBuffer per
+    connection, grouped by uid. No threads and no Redis connection per
+    socket.
+    """
+
+    def __init__(self, queue_size: int = QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.subscribers: Dict[str, Set[StreamBuffer]] = {}
+        self._client = None
+        self._task = None
+
+    async def start(self) -> None:
+        # Raw bytes: publishers may use msgpack (see wire.CHANNEL_FORMATS)
+        self._client = aioredis.Redis(host=redis_host, port=redis_port, db=0)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._client:
+            await self._client.close()
+
+    async def _run(self) -> None:
+        while True:
+            pubsub = self._client.pubsub()
+            try:
+                await pubsub.psubscribe(*STREAM_PATTERNS)
+                async for message in pubsub.listen():
+                    if message.get("type") != "pmessage":
+                        continue
+                    channel = message["channel"].decode()
+                    buffers = self.subscribers.get(channel.split(":", 1)[1])
+                    if not buffers:
+                        continue
+                    # Decoded and classified once, encoded once per format,
+                    # however many sockets the user has open
+                    data = message["data"]
+                    try:
+                        payload = wire.loads(data)
+                    except Exception:
+                        payload = None
+                    lane, key, level = classify(channel, payload)
+                    frames = {}
+                    for buffer in buffers:
+                        frame = frames.get(buffer.fmt)
+                        if frame is None:
+                            frame = frames[buffer.fmt] = _frame(data, payload, buffer.fmt)
+                        buffer.offer(lane, key, level, frame)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[WS] Hub subscription error: {e}")
+                await asyncio.sleep(1)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    def subscribe(self, uid: str, level: str = "debug", fmt: str = wire.JSON) -> StreamBuffer:
+        buffer = StreamBuffer(level=level, size=self.queue_size, fmt=fmt)
+        self.subscribers.setdefault(uid, set()).add(buffer)
+        return buffer
+
+    def unsubscribe(self, uid: str, buffer: StreamBuffer) -> None:
+        buffers = self.subscribers.get(uid)
+        if not buffers:
+            return
+        buffers.discard(buffer)
+        if not buffers:
+            del self.subscribers[uid]
+
+
+hub = StreamHub()
@@ -2,15 +2,21 @@ from typing import Dict, Any
 import os
 import time
 import json
+import random
 import redis
 import requests
-from .celery_app import celery, user_queue
-from .session import update_metrics
+from concurrent.futures import ThreadPoolExecutor
+from .celery_app import celery
+from .session import update_metrics, DUPLICATE
 from .iq_option import IQOptionClient
-from .models import SessionLocal, Trade as DbTrade, IQCredential as DbCred
+from .models import SessionLocal, IQCredential as DbCred
 from .credentials import decrypt
 from .pairs import OTC_PAIRS
 from .strategies import get_strategy
+from . import candles as candle_store
+from . import wire
+from . import scheduler
+from . import journal
 
 redis_host = os.getenv("REDIS_HOST", "redis")
 redis_port = int(os.getenv("REDIS_PORT", "6379"))
@@ -30,16 +36,213 @@ def send_push_notification(uid: str, title: str, body: str):
     except Exception:
         pass
 
+PENDING_TRADES = "trades:pending"
+# Seconds past expiry before an unsettled trade is given up on
+SETTLE_TIMEOUT = int(os.getenv("SETTLE_TIMEOUT", "300"))
+
+# Candle-close events wake sessions when agents stream candles; the
+# scheduled tick then only runs as a slow fallback
+CANDLE_STREAMING = os.getenv("CANDLE_STREAMING", "1") == "1"
+# Ticks land this long after a bar closes, plus up to BAR_JITTER so
+# sessions on the same timeframe don't all fetch at once
+BAR_DELAY = float(os.getenv("BAR_DELAY", "0.5"))
+BAR_JITTER = float(os.getenv("BAR_JITTER", "2"))
+# Strategy evaluation for a tick's pairs runs here, shared across ticks
+_ANALYSIS_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("ANALYSIS_THREADS", "4")))
+# How long a session waits for another one's evaluation of the same bar
+SIGNAL_WAIT = float(os.getenv("SIGNAL_WAIT", "1"))
+_SIGNAL_PENDING = "?"
+
+
+def _until_next_bar(timeframe: int, now: float = None) -> float:
+    now = now or time.time()
+    close = (now // timeframe + 1) * timeframe
+    return close - now + BAR_DELAY + random.uniform(0, BAR_JITTER)
+
+
+class _Outbox:
+    # Collects a tick's log/metric publishes and hash writes and sends them
+    # in one pipelined round trip
+    def __init__(self):
+        self.pipe = r.pipeline(transaction=False)
+        self.pending = 0
+
+    def publish(self, channel: str, message: dict) -> None:
+        wire.publish(self.pipe, channel, message)
+        self.pending += 1
+
+    def log(self, uid: str, kind: str, message: str) -> None:
+        self.publish(f"logs:{uid}", {"type": kind, "message": message, "timestamp": time.time()})
+
+    def hset(self, key: str, field: str, value) -> None:
+        self.pipe.hset(key, field, value)
+        self.pending += 1
+
+    def flush(self) -> None:
+        if self.pending:
+            self.pipe.execute()
+            self.pending = 0
+
+
+def _queue_stream_registrations(pipe, uid: str, session_id: str, pairs, timeframe: int) -> None:
+    for pair in pairs:
+        active = candle_store.normalize_active(pair)
+        pipe.sadd(f"agent:{uid}:streams", f"{active}:{timeframe}")
+        pipe.sadd(candle_store.watchers_key(active, timeframe), f"{uid}:{session_id}")
+        pipe.sadd("candles:watch", candle_store.stream_key(active, timeframe))
+
+
+def _subscribe_new_streams(uid: str, client: IQOptionClient, pairs, timeframe: int, results) -> None:
+    # results are the replies to _queue_stream_registrations, in order
+    added = results[0::3]
+    for pair, new in zip(pairs, added):
+        if new and client.subscribe_candles(pair, timeframe) is None:
+            # Let the next tick retry the subscription
+            r.srem(f"agent:{uid}:streams", f"{candle_store.normalize_active(pair)}:{timeframe}")
+
+
+def _evaluate(strategy, candles, pair: str, timeframe: int):
+    try:
+        return strategy.generate_signal(candles, pair, timeframe)
+    except Exception as e:
+        print(f"[Tasks] Strategy error on {pair}: {e}")
+        return None
+
+
+def _signal_key(strategy_name: str, pair: str, timeframe: int, bar) -> str:
+    return f"sigcache:{strategy_name}:{candle_store.normalize_active(pair)}:{timeframe}:{bar}"
+
+
+def _shared_signals(strategy, strategy_name: str, pairs, timeframe: int, candles_by_pair) -> Dict[str, Any]:
+    """Signals for ``pairs``, computed once per (strategy, pair, timeframe, bar).
+
+    The first session to reach a bar claims its key and evaluates; the rest
+    read the cached result, waiting up to SIGNAL_WAIT for a claim still in
+    flight before evaluating for themselves.
+    """
+    if not pairs:
+        return {}
+    keys = {pair: _signal_key(strategy_name, pair, timeframe, candles_by_pair[pair][-1].get("from")) for pair in pairs}
+    pipe = r.pipeline(transaction=False)
+    for pair in pairs:
+        pipe.set(keys[pair], _SIGNAL_PENDING, nx=True, ex=max(int(SIGNAL_WAIT) + 1, 5))
+        pipe.get(keys[pair])
+    replies = pipe.execute()
+
+    signals = {}
+    owned, waiting = [], []
+    for i, pair in enumerate(pairs):
+        claimed, value = replies[2 * i], replies[2 * i + 1]
+        if claimed:
+            owned.append(pair)
+        elif value == _SIGNAL_PENDING:
+            waiting.append(pair)
+        else:
+            signals[pair] = json.loads(value)
+
+    futures = {pair: _ANALYSIS_POOL.submit(_evaluate, strategy, candles_by_pair[pair], pair, timeframe) for pair in owned}
+    if owned:
+        pipe = r.pipeline(transaction=False)
+        for pair, future in futures.items():
+            signals[pair] = future.result()
+            pipe.set(keys[pair], json.dumps(signals[pair]), ex=max(timeframe * 2, 60))
+        pipe.execute()
+
+    deadline = time.time() + SIGNAL_WAIT
+    while waiting and time.time() < deadline:
+        time.sleep(0.05)
+        for pair, value in zip(list(waiting), r.mget([keys[pair] for pair in waiting])):
+            if value and value != _SIGNAL_PENDING:
+                signals[pair] = json.loads(value)
+                waiting.remove(pair)
+    # The claimer is slow or gone: evaluate locally without caching
+    futures = {pair: _ANALYSIS_POOL.submit(_evaluate, strategy, candles_by_pair[pair], pair, timeframe) for pair in waiting}
+    for pair, future in futures.items():
+        signals[pair] = future.result()
+    return signals
+
+
+@celery.task(name="axon.release_candle_streams")
+def release_candle_streams(uid: str, session_id: str) -> None:
+    # A session that stopped no longer watches its candle streams; streams
+    # no other running session of the account watches are unsubscribed on
+    # the agent (watchers sets act as the per-agent reference count)
+    if not CANDLE_STREAMING:
+        return
+    member = f"{uid}:{session_id}"
+    streams = list(r.smembers(f"agent:{uid}:streams"))
+    if not streams:
+        return
+    pipe = r.pipeline(transaction=False)
+    for stream in streams:
+        active, _, timeframe = stream.rpartition(":")
+        pipe.srem(candle_store.watchers_key(active, int(timeframe)), member)
+        pipe.smembers(candle_store.watchers_key(active, int(timeframe)))
+    watchers = pipe.execute()[1::2]
+    others = sorted({m for members in watchers for m in members if m.startswith(f"{uid}:")})
+    pipe = r.pipeline(transaction=False)
+    for other in others:
+        pipe.hget(f"session:{other}", "status")
+    running = {other for other, status in zip(others, pipe.execute()) if status == "running"}
+    unused = [stream for stream, members in zip(streams, watchers) if not running & set(members)]
+    if not unused:
+        return
+    if r.hget(f"agent:{uid}:status", "status") != "connected":
+        # A restarted agent starts with no streams anyway
+        r.srem(f"agent:{uid}:streams", *unused)
+        return
+    client = IQOptionClient()
+    client.uid = uid
+    for stream in unused:
+        active, _, timeframe = stream.rpartition(":")
+        # The agent drops the stream from agent:{uid}:streams itself
+        if client.unsubscribe_candles(active, int(timeframe)) is None:
+            r.srem(f"agent:{uid}:streams", stream)
+
+
+# Tick outcomes after which the session leaves the schedule
+_FINAL_REASONS = {"stopped", "max_losses", "not_connected", "auth_error"}
+
+
 @celery.task(name="axon.analyze_market")
 def analyze_market(uid: str, session_id: str, config: Dict[str, Any]) -> Dict[str, Any]:
-    # Check session status
     key = f"session:{uid}:{session_id}"
-    status = r.hget(key, "status")
+    # One tick per session at a time (a lease may expire mid-tick)
+    lock_key = f"{key}:tick"
+    if not r.set(lock_key, "1", nx=True, ex=60):
+        scheduler.wake(uid, session_id, time.time() + 1)
+        return {"uid": uid, "session_id": session_id, "processed": False, "reason": "tick_in_progress"}
+    outbox = _Outbox()
+    try:
+        result = _analyze_market(uid, session_id, config, outbox)
+        if result.get("reason") in _FINAL_REASONS:
+            scheduler.unschedule(uid, session_id)
+            release_candle_streams(uid, session_id)
+        return result
+    finally:
+        outbox.flush()
+        r.delete(lock_key)
+
+
+@celery.task(name="axon.analyze_batch")
+def analyze_batch(sessions) -> None:
+    # [[uid, session_id, config], ...] sent together by the scheduler
+    for uid, session_id, config in sessions:
+        try:
+            analyze_market(uid, session_id, config)
+        except Exception as e:
+            print(f"[Tasks] Tick failed for {uid}:{session_id}: {e}")
+
+
+def _analyze_market(uid: str, session_id: str, config: Dict[str, Any], outbox: _Outbox) -> Dict[str, Any]:
+    # All session state in one round trip
+    key = f"session:{uid}:{session_id}"
+    status, consecutive_losses, active_trades, mode = r.hmget(key, "status", "consecutive_losses", "active_trades", "mode")
     if status != "running":
         return {"uid": uid, "session_id": session_id, "processed": False, "reason": "stopped"}
 
-    # Update heartbeat
-    r.hset(key, "heartbeat", time.time())
+    # Update heartbeat (sent with the tick's other writes)
+    outbox.hset(key, "heartbeat", time.time())
 
     # Get configuration
     strategy_name = config.get("strategy_id") or config.get("strategy")
@@ -67,6 +270,9 @@ def analyze_market(uid: str, session_id: str, config: Dict[str, Any]) -> Dict[st
             timeframe = val * 60 if val < 15 else val
     except:
         timeframe = 60
+    # "0", "0s", negatives: every bar computation below divides by it
+    if timeframe <= 0:
+        timeframe = 60
     
     # Get strategy
     strategy = get_strategy(strategy_name)
@@ -74,41 +280,42 @@ def analyze_market(uid: str, session_id: str, config: Dict[str, Any]) -> Dict[st
         # Log error or stop? For now just skip this tick
         # But reschedule to check if strategy becomes valid or config changes (unlikely)
         # Actually, if strategy is missing, maybe just use a default or log error
-        r.publish(f"metrics:{uid}", json.dumps({"type": "error", "message": f"Strategy {strategy_name} not found", "session_id": session_id}))
+        outbox.publish(f"metrics:{uid}", {"type": "error", "message": f"Strategy {strategy_name} not found", "session_id": session_id})
         # Reschedule slowly to avoid log spam
-        analyze_market.apply_async(args=[uid, session_id, config], countdown=5, queue=user_queue(uid, session_id))
+        scheduler.reschedule(uid, session_id, 5)
         return {"uid": uid, "session_id": session_id, "processed": False, "reason": "strategy_not_found"}
 
     # Check consecutive losses
     max_losses = int(config.get("max_consecutive_losses") or 3)
-    consecutive_losses = int(r.hget(key, "consecutive_losses") or 0)
+    consecutive_losses = int(consecutive_losses or 0)
     
     if consecutive_losses >= max_losses:
         # Stop session safely
-        r.hset(key, "status", "halted")
-        r.publish(f"metrics:{uid}", json.dumps({"type": "halt", "reason": "max_consecutive_losses", "session_id": session_id}))
+        outbox.hset(key, "status", "halted")
+        outbox.publish(f"metrics:{uid}", {"type": "halt", "reason": "max_consecutive_losses", "session_id": session_id})
         return {"uid": uid, "session_id": session_id, "processed": False, "reason": "max_losses"}
 
     # Check active trades - Enforce sequential trading for strict risk management
-    active_trades = int(r.hget(key, "active_trades") or 0)
+    active_trades = int(active_trades or 0)
     if active_trades > 0:
         # Skip analysis if trade is in progress
-        analyze_market.apply_async(args=[uid, session_id, config], countdown=2, queue=user_queue(uid, session_id))
+        scheduler.reschedule(uid, session_id, 2)
         return {"uid": uid, "session_id": session_id, "processed": False, "reason": "active_trade_pending"}
 
-    mode = r.hget(key, "mode") or ""
+    mode = mode or ""
     if mode == "signal" and strategy_name == "Random Strategy":
         import random as _random
         
         # Iterate over all pairs to simulate analysis logs
         target_pairs = pairs or OTC_PAIRS
-        r.publish(f"logs:{uid}", json.dumps({"type": "log", "message": f"Analyzing {len(target_pairs)} pairs with Random Strategy...", "timestamp": time.time()}))
+        outbox.log(uid, "log", f"Analyzing {len(target_pairs)} pairs with Random Strategy...")
         
         signal_found = False
         signal_data = None
         
         for pair in target_pairs:
-            r.publish(f"logs:{uid}", json.dumps({"type": "log", "message": f"Analyzing {pair}...", "timestamp": time.time()}))
+            outbox.log(uid, "log", f"Analyzing {pair}...")
+            outbox.flush()
             time.sleep(0.05) # Small delay to make UI updates visible
             
             # 10% chance to find a signal per pair, but limit to 1 per cycle to avoid spam if desired
@@ -127,28 +334,29 @@ def analyze_market(uid: str, session_id: str, config: Dict[str, Any]) -> Dict[st
                         "strategy": strategy_name,
                         "timeframe": config.get("timeframe") or timeframe_input,
                     }
-                    r.publish(f"signals:{uid}", json.dumps(signal_msg))
-                    r.publish(f"logs:{uid}", json.dumps({"type": "log", "message": f"Signal found: {pair} {direction} ({confidence}%)", "timestamp": time.time()}))
+                    outbox.publish(f"signals:{uid}", signal_msg)
+                    outbox.log(uid, "log", f"Signal found: {pair} {direction} ({confidence}%)")
+                    outbox.flush()
                     send_push_notification(uid, f"Signal: {pair}", f"{direction} @ {confidence}%")
                     signal_found = True
                     # We can break or continue. Real bot continues. Let's continue but maybe not find more signals to keep it sane?
                     # User asked for "random strategy", usually implies high activity.
         
-        analyze_market.apply_async(args=[uid, session_id, config], countdown=5, queue=user_queue(uid, session_id))
+        scheduler.reschedule(uid, session_id, 5)
         return {"uid": uid, "session_id": session_id, "processed": True, "signals": 1 if signal_found else 0}
 
     client = IQOptionClient()
     with SessionLocal() as db:
         cred = db.get(DbCred, uid)
         if not cred:
-            r.hset(key, "status", "halted")
-            r.publish(f"metrics:{uid}", json.dumps({"type": "halt", "reason": "not_connected", "session_id": session_id}))
+            outbox.hset(key, "status", "halted")
+            outbox.publish(f"metrics:{uid}", {"type": "halt", "reason": "not_connected", "session_id": session_id})
             return {"uid": uid, "session_id": session_id, "processed": False, "reason": "not_connected"}
         try:
             password = decrypt(cred.password_enc)
         except Exception:
-            r.hset(key, "status", "halted")
-            r.publish(f"metrics:{uid}", json.dumps({"type": "halt", "reason": "auth_error", "message": "Invalid credentials. Please reconnect.", "session_id": session_id}))
+            outbox.hset(key, "status", "halted")
+            outbox.publish(f"metrics:{uid}", {"type": "halt", "reason": "auth_error", "message": "Invalid credentials. Please reconnect.", "session_id": session_id})
             return {"uid": uid, "session_id": session_id, "processed": False, "reason": "auth_error"}
         account_type = getattr(cred, "account_type", "PRACTICE")
 
@@ -156,90 +364,129 @@ def analyze_market(uid: str, session_id: str, config: Dict[str, Any]) -> Dict[st
     if not ok:
         code = client.error_code()
         msg = client.error_message()
-        r.publish(f"metrics:{uid}", json.dumps({"type": "error", "message": msg or "failed to connect", "error_code": code, "session_id": session_id}))
+        outbox.publish(f"metrics:{uid}", {"type": "error", "message": msg or "failed to connect", "error_code": code, "session_id": session_id})
         if client.error_is_terminal():
-            r.hset(key, "status", "halted")
-            r.publish(f"metrics:{uid}", json.dumps({"type": "halt", "reason": "auth_error", "session_id": session_id}))
+            outbox.hset(key, "status", "halted")
+            outbox.publish(f"metrics:{uid}", {"type": "halt", "reason": "auth_error", "session_id": session_id})
             return {"uid": uid, "session_id": session_id, "processed": False, "reason": "auth_error"}
-        analyze_market.apply_async(args=[uid, session_id, config], countdown=5, queue=user_queue(uid, session_id))
+        scheduler.reschedule(uid, session_id, 5)
         return {"uid": uid, "session_id": session_id, "processed": False, "reason": "connect_failed"}
 
     processed_count = 0
 
+    # Every pair's cooldown (and stream registration) in one round trip
+    # (plus the newest bar each pair was evaluated on)
+    pipe = r.pipeline(transaction=False)
+    pipe.mget([f"{key}:cooldown:{pair}" for pair in pairs])
+    pipe.hmget(key, [f"bar:{pair}" for pair in pairs])
+    if CANDLE_STREAMING:
+        _queue_stream_registrations(pipe, uid, session_id, pairs, timeframe)
+    results = pipe.execute()
+    cooling = {pair for pair, flag in zip(pairs, results[0]) if flag}
+    evaluated = dict(zip(pairs, results[1]))
+    if CANDLE_STREAMING:
+        _subscribe_new_streams(uid, client, pairs, timeframe, results[2:])
+    current_bar = int(time.time() // timeframe * timeframe)
+    # Ticks evaluate the bar that just closed, never the one still forming
+    closed_bar = current_bar - timeframe
+
     # Log analysis start (throttle to avoid spam if needed, but UI can handle it)
-    r.publish(f"logs:{uid}", json.dumps({"type": "log", "message": f"Analyzing {len(pairs)} pairs with {strategy_name}...", "timestamp": time.time()}))
+    outbox.log(uid, "log", f"Analyzing {len(pairs)} pairs with {strategy_name}...")
     
     # Debug: Check strategy type
-    r.publish(f"logs:{uid}", json.dumps({"type": "debug", "message": f"Strategy Class: {type(strategy).__name__}", "timestamp": time.time()}))
+    outbox.log(uid, "debug", f"Strategy Class: {type(strategy).__name__}")
 
+    due = []
     for pair in pairs:
+        # Nothing new until the next bar closes
+        if int(float(evaluated.get(pair) or 0)) >= closed_bar:
+            continue
+
         # Log analysis of specific pair
-        msg = f"Analyzing {pair}..."
-        r.publish(f"logs:{uid}", json.dumps({"type": "log", "message": msg, "timestamp": time.time()}))
+        outbox.log(uid, "log", f"Analyzing {pair}...")
 
         # Check cooldown
-        cooldown_key = f"{key}:cooldown:{pair}"
-        if r.exists(cooldown_key):
+        if pair in cooling:
             continue
+        due.append(pair)
+    if not due:
+        scheduler.reschedule(uid, session_id, _until_next_bar(timeframe))
+        return {"uid": uid, "session_id": session_id, "processed": True, "signals": 0}
 
-        # Get candles
-        # Need enough candles for indicators (e.g. 100)
-        candles = client.get_candles(pair, timeframe, 100, int(time.time()))
-        
+    # Get candles for every pair at once
+    # Need enough candles for indicators (e.g. 100); shared cache only
+    # asks the agent for bars it has not seen yet
+    candles_by_pair = candle_store.get_candles_multi(client, due, timeframe, 100, closed_before=current_bar)
+    ready = []
+    behind = False
+    for pair in due:
+        # Drop the forming candle so ``last`` is the closed bar, as in backtests
+        candles = [c for c in candles_by_pair.get(pair) or [] if int(c.get("from") or 0) < current_bar]
         if not candles:
-            r.publish(f"logs:{uid}", json.dumps({"type": "debug", "message": f"No candles for {pair}", "timestamp": time.time()}))
+            # Not refreshed since the bar closed (or no data): retry shortly
+            # without recording the bar
+            outbox.log(uid, "debug", f"No candles for {pair}")
+            behind = True
             continue
-            
-        r.publish(f"logs:{uid}", json.dumps({"type": "debug", "message": f"Got {len(candles)} candles for {pair}", "timestamp": time.time()}))
+        candles_by_pair[pair] = candles
+        outbox.log(uid, "debug", f"Got {len(candles)} candles for {pair}")
+        outbox.hset(key, f"bar:{pair}", candles[-1].get("from"))
+        ready.append(pair)
 
-        # Generate signal
-        signal_data = strategy.generate_signal(candles)
-        
+    # Generate signals (shared with other sessions on the same bar)
+    signals = _shared_signals(strategy, strategy_name, ready, timeframe, candles_by_pair)
+    found = []
+    for index, pair in enumerate(ready):
+        signal_data = signals.get(pair)
         if signal_data:
-            r.publish(f"logs:{uid}", json.dumps({"type": "debug", "message": f"Signal found for {pair}: {signal_data}", "timestamp": time.time()}))
-            direction = signal_data.get("direction")
-            confidence = signal_data.get("confidence", 0.0)
-            
-            # Publish signal
-            signal_msg = {
-                "type": "signal", 
-                "session_id": session_id, 
-                "pair": pair, 
-                "direction": direction, 
-                "confidence": confidence,
-                "strategy": strategy_name,
-                "timeframe": config.get("timeframe") or timeframe_input,
-            }
-            r.publish(f"signals:{uid}", json.dumps(signal_msg))
-            r.publish(f"logs:{uid}", json.dumps({"type": "log", "message": f"Signal found: {pair} {direction} ({confidence}%)", "timestamp": time.time()}))
-            send_push_notification(uid, f"Signal: {pair}", f"{direction} @ {confidence}%")
-            
-            # Auto-trade if configured
-            if amount > 0:
-                # Use timeframe as expiry
-                r.publish(f"logs:{uid}", json.dumps({"type": "debug", "message": f"Scheduling trade with expiry: {timeframe}s", "timestamp": time.time()}))
-                
-                # Optimistically increment active_trades
-                r.hincrby(key, "active_trades", 1)
-                
-                place_trade.delay(uid, session_id, pair, direction, amount, timeframe)
-                
-                # Set cooldown (e.g. 3 minutes or until trade finishes)
-                # User said "Enforce cooldown per pair". 
-                # Let's set it to 300s (5 mins) to be safe, or configurable
-                cooldown_sec = int(config.get("cooldown") or 300)
-                r.setex(cooldown_key, cooldown_sec, "1")
-                
-                processed_count += 1
-                
-                # Enforce ONE trade per cycle to prevent race conditions
-                break
-                
-    # Reschedule
-    # Interval should be roughly a candle tick or less. 
-    # If timeframe is 60s, checking every 5-10s is fine.
-    interval = 5
-    analyze_market.apply_async(args=[uid, session_id, config], countdown=interval, queue=user_queue(uid, session_id))
+            found.append((-float(signal_data.get("confidence") or 0.0), index, pair, signal_data))
+    # Best first: highest confidence, then configured pair order
+    found.sort(key=lambda item: item[:2])
+
+    for _, _, pair, signal_data in found:
+        outbox.log(uid, "debug", f"Signal found for {pair}: {signal_data}")
+        direction = signal_data.get("direction")
+        confidence = signal_data.get("confidence", 0.0)
+
+        # Publish signal
+        signal_msg = {
+            "type": "signal",
+            "session_id": session_id,
+            "pair": pair,
+            "direction": direction,
+            "confidence": confidence,
+            "strategy": strategy_name,
+            "timeframe": config.get("timeframe") or timeframe_input,
+        }
+        outbox.publish(f"signals:{uid}", signal_msg)
+        outbox.log(uid, "log", f"Signal found: {pair} {direction} ({confidence}%)")
+        # Signals go out now, not at the end of the tick
+        outbox.flush()
+        send_push_notification(uid, f"Signal: {pair}", f"{direction} @ {confidence}%")
+
+        # Auto-trade if configured
+        if amount > 0:
+            # Use timeframe as expiry
+            outbox.log(uid, "debug", f"Scheduling trade with expiry: {timeframe}s")
+
+            # Optimistically increment active_trades
+            r.hincrby(key, "active_trades", 1)
+
+            place_trade.delay(uid, session_id, pair, direction, amount, timeframe)
+
+            # Set cooldown (e.g. 3 minutes or until trade finishes)
+            # User said "Enforce cooldown per pair".
+            # Let's set it to 300s (5 mins) to be safe, or configurable
+            cooldown_sec = int(config.get("cooldown") or 300)
+            r.setex(f"{key}:cooldown:{pair}", cooldown_sec, "1")
+
+            processed_count += 1
+
+            # Enforce ONE trade per cycle to prevent race conditions
+            break
+
+    # Next tick right after the current bar closes
+    scheduler.reschedule(uid, session_id, 2 if behind else _until_next_bar(timeframe))
     
     return {"uid": uid, "session_id": session_id, "processed": True, "signals": processed_count}
 
@@ -249,32 +496,27 @@ def start_user_session(uid: str, session_id: str, config: Dict[str, Any]) -> Non
     key = f"session:{uid}:{session_id}"
     r.hset(key, "consecutive_losses", 0)
     r.hset(key, "active_trades", 0)
+    # Kept so candle-close events can start ticks for this session
+    r.hset(key, "config", json.dumps(config))
     
-    analyze_market.apply_async(args=[uid, session_id, config], queue=user_queue(uid, session_id))
+    scheduler.schedule(uid, session_id)
 
 
 @celery.task(name="axon.trade_result")
-def trade_result(uid: str, session_id: str, pnl: float, won: bool) -> None:
-    # Decrement active trades
-    key = f"session:{uid}:{session_id}"
-    r.hincrby(key, "active_trades", -1)
-    
-    r.publish(f"logs:{uid}", json.dumps({"type": "log", "message": f"Trade finished: {'WIN' if won else 'LOSS'} PnL: {pnl}", "timestamp": time.time()}))
-    update_metrics(uid, session_id, pnl, won)
+def trade_result(uid: str, session_id: str, pnl: float, won: bool, tie: bool = False) -> None:
+    # Releases the active trade, logs, updates metrics and checks safety
+    # limits in one atomic round trip
+    update_metrics(uid, session_id, pnl, won, release_trade=True, log=_result_log(pnl, won, tie), tie=tie)
 
 
-@celery.task(name="axon.heartbeat_pulse")
-def heartbeat_pulse(uid: str, session_id: str, interval: int = 10) -> None:
-    key = f"session:{uid}:{session_id}"
-    status = r.hget(key, "status")
-    if status == "running":
-        r.hset(key, "heartbeat", time.time())
-        heartbeat_pulse.apply_async(args=[uid, session_id, interval], countdown=interval, queue=user_queue(uid, session_id))
+def _result_log(pnl: float, won: bool, tie: bool) -> Dict[str, Any]:
+    label = "TIE" if tie else "WIN" if won else "LOSS"
+    return {"type": "log", "message": f"Trade finished: {label} PnL: {pnl}", "timestamp": time.time()}
 
 
 @celery.task(name="axon.place_trade")
 def place_trade(uid: str, session_id: str, pair: str, direction: str, amount: float, expiry_seconds: int) -> None:
-    r.publish(f"logs:{uid}", json.dumps({"type": "log", "message": f"Placing trade: {pair} {direction} ${amount} (expiry: {expiry_seconds}s)", "timestamp": time.time()}))
+    wire.publish(r, f"logs:{uid}", {"type": "log", "message": f"Placing trade: {pair} {direction} ${amount} (expiry: {expiry_seconds}s)", "timestamp": time.time()})
     client = IQOptionClient()
     with SessionLocal() as db:
         cred = db.get(DbCred, uid)
@@ -286,7 +528,7 @@ def place_trade(uid: str, session_id: str, pair: str, direction: str, amount: fl
         except Exception:
             r.hincrby(f"session:{uid}:{session_id}", "active_trades", -1)
             r.hset(f"session:{uid}:{session_id}", "status", "halted")
-            r.publish(f"metrics:{uid}", json.dumps({"type": "halt", "reason": "auth_error", "message": "Invalid credentials. Please reconnect.", "session_id": session_id}))
+            wire.publish(r, f"metrics:{uid}", {"type": "halt", "reason": "auth_error", "message": "Invalid credentials. Please reconnect.", "session_id": session_id})
             return
         account_type = getattr(cred, "account_type", "PRACTICE")
         ok = client.connect(cred.username, password, account_type, uid=uid)
@@ -296,18 +538,18 @@ def place_trade(uid: str, session_id: str, pair: str, direction: str, amount: fl
             msg = client.error_message()
             if client.error_is_terminal():
                 r.hset(f"session:{uid}:{session_id}", "status", "halted")
-                r.publish(f"metrics:{uid}", json.dumps({"type": "halt", "reason": "auth_error", "session_id": session_id}))
+                wire.publish(r, f"metrics:{uid}", {"type": "halt", "reason": "auth_error", "session_id": session_id})
             else:
                 r.hincrby(f"session:{uid}:{session_id}", "reject_count", 1)
                 cnt = int(r.hget(f"session:{uid}:{session_id}", "reject_count") or "0")
-                r.publish(f"metrics:{uid}", json.dumps({"type": "counter", "session_id": session_id, "reject_count": cnt}))
-                r.publish(f"metrics:{uid}", json.dumps({"type": "error", "error_code": code, "message": msg, "session_id": session_id}))
+                wire.publish(r, f"metrics:{uid}", {"type": "counter", "session_id": session_id, "reject_count": cnt})
+                wire.publish(r, f"metrics:{uid}", {"type": "error", "error_code": code, "message": msg, "session_id": session_id})
             return
-    order_id = client.place_order(pair, direction, amount, expiry_seconds)
+    order_id = client.place_order(pair, direction, amount, expiry_seconds, session_id=session_id)
     if not order_id:
         r.hincrby(f"session:{uid}:{session_id}", "active_trades", -1)
-        r.publish(f"logs:{uid}", json.dumps({"type": "error", "message": f"Trade placement failed for {pair}", "timestamp": time.time()}))
-        r.publish(f"metrics:{uid}", json.dumps({"type": "error", "message": "Trade placement failed", "session_id": session_id}))
+        wire.publish(r, f"logs:{uid}", {"type": "error", "message": f"Trade placement failed for {pair}", "timestamp": time.time()})
+        wire.publish(r, f"metrics:{uid}", {"type": "error", "message": "Trade placement failed", "session_id": session_id})
         r.hincrby(f"session:{uid}:{session_id}", "reject_count", 1)
         return
 
@@ -315,27 +557,63 @@ def place_trade(uid: str, session_id: str, pair: str, direction: str, amount: fl
     if retries:
         r.hincrby(f"session:{uid}:{session_id}", "retry_count", retries)
         cnt = int(r.hget(f"session:{uid}:{session_id}", "retry_count") or "0")
-        r.publish(f"metrics:{uid}", json.dumps({"type": "counter", "session_id": session_id, "retry_count": cnt}))
-    with SessionLocal() as db:
-        db.add(DbTrade(user_id=uid, session_id=session_id, pair=pair, direction=direction, amount=amount, expiry=expiry_seconds, order_id=order_id, status="placed", result="pending", pnl=0.0))
-        db.commit()
-    result = client.poll_position(order_id)
-    if client.error_code():
-        code = client.error_code()
-        msg = client.error_message()
-        r.hincrby(f"session:{uid}:{session_id}", "reject_count", 1)
-        cnt = int(r.hget(f"session:{uid}:{session_id}", "reject_count") or "0")
-        r.publish(f"metrics:{uid}", json.dumps({"type": "counter", "session_id": session_id, "reject_count": cnt}))
-        r.publish(f"metrics:{uid}", json.dumps({"type": "error", "error_code": code, "message": msg, "session_id": session_id}))
-    won = result.get("result") == "win"
-    pnl = result.get("pnl", 0.0)
+        wire.publish(r, f"metrics:{uid}", {"type": "counter", "session_id": session_id, "retry_count": cnt})
+    # The trade row is written by the journal writer; settlement arrives
+    # from the agent on trades:settlements, and the deadline lets the
+    # settlement consumer release the session if it never does
+    pipe = r.pipeline(transaction=False)
+    journal.append("placed", uid, session_id, order_id, client=pipe, pair=pair, direction=direction, amount=amount, expiry=expiry_seconds)
+    pipe.zadd(PENDING_TRADES, {pending_member(uid, session_id, order_id): time.time() + expiry_seconds + SETTLE_TIMEOUT})
+    pipe.hset(f"session:{uid}:{session_id}", "heartbeat", time.time())
+    pipe.execute()
 
-    with SessionLocal() as db:
-        trade = db.query(DbTrade).filter(DbTrade.order_id == order_id).first()
-        if trade:
-            trade.status = result.get("status")
-            trade.result = result.get("result")
-            trade.pnl = pnl
-            db.commit()
-    r.hset(f"session:{uid}:{session_id}", "heartbeat", time.time())
-    trade_result.delay(uid, session_id, pnl, won)
+
+# Drops a trade that settled without a result and frees the session's slot
+_release_pending = r.register_script("""
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('HINCRBY', KEYS[2], 'active_trades', -1)
+end
+return 1
+""")
+
+
+def pending_member(uid: str, session_id: str, order_id) -> str:
+    return f"{uid}:{session_id}:{order_id}"
+
+
+# IQ Option reports a refunded option as "equal"; "loose" is its spelling
+_RESULTS = {"win": "win", "equal": "tie", "tie": "tie", "loose": "lose", "lose": "lose", "loss": "lose"}
+
+
+def _trade_outcome(result: str, pnl: float) -> str:
+    # win / lose / tie from the reported result, else from the pnl sign
+    outcome = _RESULTS.get((result or "").lower())
+    if outcome:
+        return outcome
+    return "win" if pnl > 0 else "tie" if pnl == 0 else "lose"
+
+
+def settle_trade(uid: str, session_id: str, order_id: str, status: str, pnl: float, result: str = "") -> bool:
+    # Applies one settlement; False if the trade was already settled. The
+    # pending entry is only removed together with the session update, so a
+    # failure in between leaves the trade to be settled again. Journal
+    # replays ignore a second settlement of the same order.
+    key = f"session:{uid}:{session_id}"
+    member = pending_member(uid, session_id, order_id)
+    if status != "closed":
+        journal.append("settled", uid, session_id, order_id, status=status, result="unknown")
+        if not _release_pending(keys=[PENDING_TRADES, key], args=[member]):
+            return False
+        wire.publish(r, f"logs:{uid}", {"type": "error", "message": f"Trade {order_id} result unavailable ({status})", "timestamp": time.time()})
+        return True
+    outcome = _trade_outcome(result, pnl)
+    journal.append("settled", uid, session_id, order_id, status=status, result=outcome, pnl=pnl)
+    log = _result_log(pnl, outcome == "win", outcome == "tie")
+    if update_metrics(uid, session_id, pnl, outcome == "win", release_trade=True, log=log, tie=outcome == "tie",
+                      pending=(PENDING_TRADES, member)) == DUPLICATE:
+        return False
+    r.hset(key, "heartbeat", time.time())
+    return True
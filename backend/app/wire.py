@@ -0,0 +1,73 @@
+import os
+import json
+from typing import Any, Dict, List, Union
+
+try:
+    import msgpack
+except ImportError:  # JSON everywhere when msgpack isn't installed
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# Candle lists can travel as parallel arrays instead of one dict per bar
+ROWS = "rows"
+COLUMNS = "columns"
+
+
+def negotiate(requested: str) -> str:
+    # Falls back to JSON for unknown formats or a missing msgpack
+    if requested == MSGPACK and msgpack is not None:
+        return MSGPACK
+    return JSON
+
+
+# Format agents reply in when a client doesn't ask for one
+RPC_FORMAT = negotiate(os.getenv("AGENT_RPC_FORMAT", MSGPACK))
+# Per pub/sub channel family, e.g. WIRE_FORMAT_LOGS=msgpack; the websocket
+# hub reads either format and re-encodes for each client
+CHANNEL_FORMATS = {kind: negotiate(os.getenv(f"WIRE_FORMAT_{kind.upper()}", JSON)) for kind in ("signals", "metrics", "logs")}
+
+
+def dumps(obj: Any, fmt: str = JSON) -> Union[str, bytes]:
+    if fmt == MSGPACK and msgpack is not None:
+        return msgpack.packb(obj, use_bin_type=True)
+    return json.dumps(obj, separators=(",", ":"))
+
+
+def publish(client, channel: str, obj: Any) -> None:
+    # client may be a Redis connection or a pipeline
+    client.publish(channel, dumps(obj, CHANNEL_FORMATS.get(channel.split(":", 1)[0], JSON)))
+
+
+def format_of(data: Union[str, bytes]) -> str:
+    # JSON documents here are always objects or arrays; anything else
+    # starting a bytes payload is a msgpack header
+    if isinstance(data, str) or data[:1] in (b"{", b"["):
+        return JSON
+    return MSGPACK
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if format_of(data) == MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack payload received but msgpack is not installed")
+        return msgpack.unpackb(data, raw=False)
+    return json.loads(data)
+
+
+def to_columns(candles: List[Dict[str, Any]]) -> Dict[str, list]:
+    if not candles:
+        return {}
+    fields = list(candles[0])
+    return {field: [candle.get(field) for candle in candles] for field in fields}
+
+
+def to_rows(candles: Union[List[Dict[str, Any]], Dict[str, list], None]) -> List[Dict[str, Any]]:
+    # Accepts either layout, so old agents replying with rows still work
+    if not candles:
+        return []
+    if isinstance(candles, list):
+        return candles
+    fields = list(candles)
+    return [dict(zip(fields, values)) for values in zip(*(candles[field] for field in fields))]
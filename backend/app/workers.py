@@ -1,5 +1,5 @@
 import os
-from typing import Optional
+from typing import Dict, List, Optional
 import json
 
 def spawn_user_worker(uid: str, session_id: str) -> Optional[str]:
@@ -55,16 +55,12 @@ def stop_user_worker(task_arn: str) -> bool:
     except Exception:
         return False
 
-def spawn_beat() -> Optional[str]:
-    cluster = os.getenv("ECS_CLUSTER")
-    task_def = os.getenv("BEAT_TASK_DEF")
-    if not cluster or not task_def:
-        return None
+def _run_task(task_def: str, container: str, environment: Dict[str, str], command: List[str]) -> Optional[str]:
     try:
         import boto3
         ecs = boto3.client("ecs", region_name=os.getenv("AWS_REGION", "us-east-1"))
         resp = ecs.run_task(
-            cluster=cluster,
+            cluster=os.getenv("ECS_CLUSTER"),
             launchType="FARGATE",
             taskDefinition=task_def,
             count=1,
@@ -78,14 +74,9 @@ def spawn_beat() -> Optional[str]:
             overrides={
                 "containerOverrides": [
                     {
-                        "name": os.getenv("BEAT_CONTAINER_NAME", "beat"),
-                        "environment": [
-                            {"name": "BROKER_URL", "value": os.getenv("BROKER_URL", "")},
-                            {"name": "RESULT_BACKEND", "value": os.getenv("RESULT_BACKEND", "")},
-                            {"name": "REDIS_HOST", "value": os.getenv("REDIS_HOST", "")},
-                            {"name": "REDIS_PORT", "value": os.getenv("REDIS_PORT", "")},
-                        ],
-                        "command": ["python", "-m", "backend.app.beat"],
+                        "name": container,
+                        "environment": [{"name": k, "value": v} for k, v in environment.items()],
+                        "command": command,
                     }
                 ]
             },
@@ -97,3 +88,34 @@ def spawn_beat() -> Optional[str]:
         return None
     return None
 
+def spawn_beat() -> Optional[str]:
+    cluster = os.getenv("ECS_CLUSTER")
+    task_def = os.getenv("BEAT_TASK_DEF")
+    if not cluster or not task_def:
+        return None
+    environment = {name: os.getenv(name, "") for name in ("BROKER_URL", "RESULT_BACKEND", "REDIS_HOST", "REDIS_PORT")}
+    return _run_task(task_def, os.getenv("BEAT_CONTAINER_NAME", "beat"), environment, ["python", "-m", "backend.app.beat"])
+
+# Long-running processes every deployment needs (docker-compose runs one
+# container each); on ECS each gets its own task definition, e.g.
+# SCHEDULER_TASK_DEF, SETTLEMENTS_TASK_DEF
+SERVICES = ("scheduler", "settlements", "journal", "candle_events")
+
+def spawn_services() -> Dict[str, str]:
+    # Raises instead of returning quietly: without these, sessions are never
+    # ticked and trades are never settled or written
+    cluster = os.getenv("ECS_CLUSTER")
+    if not cluster:
+        raise RuntimeError("ECS_CLUSTER is not set")
+    missing = [f"{name.upper()}_TASK_DEF" for name in SERVICES if not os.getenv(f"{name.upper()}_TASK_DEF")]
+    if missing:
+        raise RuntimeError(f"Missing ECS task definitions: {', '.join(missing)}")
+    environment = {name: os.getenv(name, "") for name in ("BROKER_URL", "RESULT_BACKEND", "REDIS_HOST", "REDIS_PORT", "DATABASE_URL", "SECRET_KEY")}
+    arns = {}
+    for name in SERVICES:
+        prefix = name.upper()
+        arn = _run_task(os.getenv(f"{prefix}_TASK_DEF"), os.getenv(f"{prefix}_CONTAINER_NAME", name), environment, ["python", "-m", f"app.{name}"])
+        if not arn:
+            raise RuntimeError(f"Could not start the {name} task on {cluster}")
+        arns[name] = arn
+    return arns
@@ -0,0 +1,341 @@
+"""Strategy and tick benchmarks with a stored baseline.
+
+    cd backend
+    python -m benchmarks.run                      # compare with baseline.json
+    python -m benchmarks.run --update             # record a new baseline
+    python -m benchmarks.run --candles data.csv   # also time a recorded set
+
+Every STRATEGIES entry is timed on the incremental path (one new bar per
+call), on the DataFrame path when pandas_ta is installed, and on the
+vectorised batch path. ``analyze_market`` runs end to end against a fake
+agent on fakeredis, or on REDIS_HOST with --allow-redis-writes (the case
+deletes the bench session's keys between calls, so point it at a scratch
+instance).
+
+Each case reports p50/p99 latency, peak traced memory per call and the
+blocks still allocated after it. The run fails when a p50 or peak exceeds
+the baseline by more than the tolerance.
+
+Latencies are compared relative to a fixed reference loop timed in the
+same run: the baseline stores the reference time it was recorded with, and
+its p50s are scaled by how much faster or slower this machine runs that
+loop. That absorbs CPU speed and load differences, not architecture ones;
+re-record with --update when the gate drifts on unchanged code.
+
+With fakeredis instead of a real Redis, the analyze_market case mostly
+times fakeredis itself, so it is reported as "... (fakeredis)" and not
+gated.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+from typing import Callable, Dict, Any, List, Optional
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+TIMEFRAME = 60
+CALIBRATION = "_calibration"
+# Cases with this suffix are reported but never fail the run
+UNGATED = " (fakeredis)"
+PAIRS = [f"BENCH{i}-OTC" for i in range(8)]
+# App logging is discarded while cases run; a StringIO would grow inside
+# the measured region and show up as peak memory
+DEVNULL = open(os.devnull, "w")
+
+
+def synthetic_candles(count: int, seed: int, start: int = 1_700_000_000) -> List[Dict[str, Any]]:
+    rnd = random.Random(seed)
+    price = 1.0 + seed / 10
+    candles = []
+    for i in range(count):
+        open_ = price
+        close = open_ + rnd.gauss(0, 0.0004)
+        candles.append({
+            "id": i,
+            "from": start + i * TIMEFRAME,
+            "to": start + (i + 1) * TIMEFRAME,
+            "open": open_,
+            "close": close,
+            "max": max(open_, close) + abs(rnd.gauss(0, 0.0002)),
+            "min": min(open_, close) - abs(rnd.gauss(0, 0.0002)),
+            "volume": rnd.randint(1, 100),
+        })
+        price = close
+    return candles
+
+
+def measure(fn: Callable[[int], Any], iterations: int, setup: Optional[Callable[[int], Any]] = None) -> Dict[str, float]:
+    # Timing and allocation passes are separate; tracemalloc slows calls down
+    for i in range(min(5, iterations)):
+        if setup:
+            setup(i)
+        fn(i)
+    times = []
+    for i in range(iterations):
+        if setup:
+            setup(i)
+        start = time.perf_counter_ns()
+        fn(i)
+        times.append(time.perf_counter_ns() - start)
+    times.sort()
+
+    samples = min(iterations, 20)
+    peak = 0
+    blocks = 0
+    tracemalloc.start()
+    for i in range(samples):
+        if setup:
+            setup(i)
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        fn(i)
+        _, high = tracemalloc.get_traced_memory()
+        peak = max(peak, high - base)
+        after = tracemalloc.take_snapshot()
+        blocks += sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    tracemalloc.stop()
+    return {
+        "p50_us": round(times[len(times) // 2] / 1000, 1),
+        "p99_us": round(times[min(len(times) - 1, int(len(times) * 0.99))] / 1000, 1),
+        "peak_kib": round(peak / 1024, 1),
+        "blocks_per_call": round(blocks / samples, 1),
+    }
+
+
+def _reference(_):
+    # Pure-Python float and list work, like the incremental engines
+    acc = 0.0
+    values = []
+    for i in range(5000):
+        acc = acc * 0.9 + i * 0.1
+        values.append(acc)
+    return sum(values)
+
+
+def calibrate(rounds: int = 5) -> float:
+    # Best of several p50s: the least disturbed estimate of this machine's speed
+    return min(measure(_reference, 50)["p50_us"] for _ in range(rounds))
+
+
+def strategy_cases(iterations: int, recorded: Optional[List[Dict[str, Any]]]) -> Dict[str, Callable[[], Dict[str, float]]]:
+    from app.strategies import STRATEGIES, ta
+    from app.indicators import candle_tensor
+
+    sets = {"synthetic": synthetic_candles(1000 + iterations + 10, seed=1)}
+    if recorded:
+        sets["recorded"] = recorded
+    batch = candle_tensor([synthetic_candles(100, seed=s) for s in range(len(PAIRS))])
+    cases = {}
+    for name, strategy in STRATEGIES.items():
+        for set_name, series in sets.items():
+            for count in (100, 300, 1000):
+                if len(series) < count + iterations:
+                    continue
+
+                def incremental(i, strategy=strategy, series=series, count=count, key=f"{set_name}-{count}"):
+                    # The window slides one bar per call, like a live tick
+                    return strategy.generate_signal(series[i:i + count], key, TIMEFRAME)
+
+                cases[f"{name}/incremental/{set_name}/{count}"] = (incremental, None)
+                if ta is not None:
+                    cases[f"{name}/dataframe/{set_name}/{count}"] = (lambda i, strategy=strategy, series=series, count=count: strategy.generate_signal(series[i:i + count]), None)
+        cases[f"{name}/batch/{len(PAIRS)}x100"] = (lambda i, strategy=strategy: strategy.generate_signals(batch), None)
+    return {case: (lambda fn=fn, setup=setup: measure(fn, iterations, setup)) for case, (fn, setup) in cases.items()}
+
+
+class FakeAgentClient:
+    """Stands in for IQOptionClient; serves synthetic candles instantly
+    (or after ``latency`` seconds per round trip)."""
+
+    latency = 0.0
+
+    def __init__(self):
+        self.uid = None
+
+    def connect(self, username, password, account_type="PRACTICE", uid=None):
+        self.uid = uid
+        return True
+
+    def _candles(self, pair, timeframe, count, timestamp):
+        end = int(timestamp) // timeframe * timeframe
+        candles = synthetic_candles(count, seed=PAIRS.index(pair) if pair in PAIRS else 0, start=end - (count - 1) * timeframe)
+        return candles
+
+    def get_candles(self, pair, timeframe, count, timestamp):
+        time.sleep(self.latency)
+        return self._candles(pair, timeframe, count, timestamp)
+
+    def get_candles_multi(self, pairs, timeframe, count, timestamp):
+        time.sleep(self.latency)
+        return {pair: self._candles(pair, timeframe, count, timestamp) for pair in pairs}
+
+    def subscribe_candles(self, pair, timeframe):
+        return f"candles:stream:{pair}:{timeframe}"
+
+    def error_code(self):
+        return None
+
+    def error_message(self):
+        return None
+
+    def error_is_terminal(self):
+        return False
+
+
+def _redis_client(allow_writes: bool):
+    # The tick case deletes its keys between calls, so a real Redis is only
+    # used when the caller says it may be written to
+    if allow_writes:
+        import redis
+        client = redis.Redis(host=os.environ["REDIS_HOST"], port=int(os.getenv("REDIS_PORT", "6379")), decode_responses=True)
+        try:
+            client.ping()
+            return client, False
+        except Exception:
+            pass
+    try:
+        import fakeredis
+    except ImportError:
+        return None, False
+    return fakeredis.FakeRedis(decode_responses=True), True
+
+
+def tick_cases(iterations: int, strategy_name: str, allow_writes: bool = False) -> Dict[str, Callable[[], Dict[str, float]]]:
+    client, fake = _redis_client(allow_writes)
+    if client is None:
+        print("[Bench] No Redis (install fakeredis, or pass --allow-redis-writes with REDIS_HOST); skipping analyze_market")
+        return {}
+    from cryptography.fernet import Fernet
+    os.environ.setdefault("SECRET_KEY", Fernet.generate_key().decode())
+    from app import tasks, candles, scheduler, models
+    from app.credentials import encrypt
+
+    if fake:
+        tasks.r = candles.r = scheduler.r = client
+        scheduler._claim = client.register_script(scheduler._claim.script)
+        scheduler._reschedule = client.register_script(scheduler._reschedule.script)
+    tasks.IQOptionClient = FakeAgentClient
+
+    models.Base.metadata.create_all(bind=models.engine)
+    uid, session_id = "bench", "bench-session"
+    with models.SessionLocal() as db:
+        db.merge(models.IQCredential(user_id=uid, username="bench@example.com", password_enc=encrypt("bench")))
+        db.commit()
+    config = {"pairs": PAIRS, "strategy_id": strategy_name, "timeframe": TIMEFRAME, "amount": 0}
+
+    def reset(i):
+        # Every call is a full tick: new bar, cold signal cache, cold candles
+        for pattern in ("*BENCH*", f"session:{uid}:*", f"*{uid}:{session_id}*", f"agent:{uid}:*"):
+            keys = list(client.scan_iter(pattern))
+            if keys:
+                client.delete(*keys)
+        # The tick registers its streams with the candle event listener
+        client.srem("candles:watch", *[candles.stream_key(candles.normalize_active(pair), TIMEFRAME) for pair in PAIRS])
+        client.hset(f"session:{uid}:{session_id}", mapping={"status": "running", "mode": "auto", "consecutive_losses": 0, "active_trades": 0})
+
+    def tick(i):
+        with contextlib.redirect_stdout(DEVNULL):
+            return tasks.analyze_market(uid, session_id, config)
+
+    name = f"analyze_market/{len(PAIRS)} pairs/{strategy_name}" + (UNGATED if fake else "")
+    cases = {name: lambda: measure(tick, iterations, reset)}
+
+    def cleanup():
+        reset(0)
+        client.delete(f"session:{uid}:{session_id}")
+        client.zrem(scheduler.DUE_KEY, f"{uid}:{session_id}")
+    cases["_cleanup"] = cleanup
+    return cases
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float,
+            memory_tolerance: float, reference_us: Optional[float] = None) -> List[str]:
+    failures = []
+    recorded = baseline.get(CALIBRATION, {}).get("reference_us")
+    # >1 when this machine runs the reference loop slower than the baseline's
+    scale = reference_us / recorded if reference_us and recorded else 1.0
+    for case, stats in results.items():
+        base = baseline.get(case)
+        if not base or case.startswith("_") or case.endswith(UNGATED):
+            continue
+        limit = round(base["p50_us"] * scale, 1)
+        if stats["p50_us"] > limit * (1 + tolerance):
+            failures.append(f"{case}: p50 {stats['p50_us']}us > baseline {limit}us (x{scale:.2f} calibrated, +{tolerance:.0%})")
+        if stats["peak_kib"] > base["peak_kib"] * (1 + memory_tolerance):
+            failures.append(f"{case}: peak {stats['peak_kib']}KiB > baseline {base['peak_kib']}KiB (+{memory_tolerance:.0%})")
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark strategies and the analyze_market tick")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--candles", help="recorded candle file (CSV/JSON, see app.backtest)")
+    parser.add_argument("--filter", help="only run cases containing this text")
+    parser.add_argument("--tick-strategy", default="Trend Continuation")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--update", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--allow-redis-writes", action="store_true",
+                        help="run analyze_market against REDIS_HOST (deletes the bench session's keys); otherwise fakeredis")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed p50 slowdown (0.5 = +50%)")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    # The app modules read these at import time
+    os.environ.setdefault("REDIS_HOST", "127.0.0.1")
+    os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}")
+
+    recorded = None
+    if args.candles:
+        from app.backtest import load_candles, COLUMNS
+        recorded = [dict(zip(COLUMNS, row)) for row in load_candles(args.candles).tolist()]
+
+    cases = strategy_cases(args.iterations, recorded)
+    cases.update(tick_cases(max(20, args.iterations // 5), args.tick_strategy, args.allow_redis_writes))
+    cleanup = cases.pop("_cleanup", None)
+
+    reference_us = calibrate()
+    print(f"[Bench] Reference loop p50 {reference_us}us")
+    results = {}
+    print(f"{'case':<58} {'p50 us':>10} {'p99 us':>10} {'peak KiB':>9} {'blocks':>8}")
+    try:
+        for case, run in cases.items():
+            if args.filter and args.filter not in case:
+                continue
+            with contextlib.redirect_stdout(DEVNULL):
+                stats = run()
+            results[case] = stats
+            print(f"{case:<58} {stats['p50_us']:>10} {stats['p99_us']:>10} {stats['peak_kib']:>9} {stats['blocks_per_call']:>8}")
+    finally:
+        if cleanup:
+            cleanup()
+
+    if args.update:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        baseline[CALIBRATION] = {"reference_us": reference_us}
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"[Bench] Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("[Bench] No baseline yet; run with --update to record one")
+        return 0
+    with open(args.baseline) as f:
+        failures = compare(results, json.load(f), args.tolerance, args.memory_tolerance, reference_us)
+    for failure in failures:
+        print(f"[Bench] REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,26 @@
+import os
+import sys
+import tempfile
+import pytest
+import fakeredis
+from cryptography.fernet import Fernet
+
+# The app modules read these at import time
+os.environ.setdefault("REDIS_HOST", "127.0.0.1")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'test.db')}"
+os.environ.setdefault("SECRET_KEY", Fernet.generate_key().decode())
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import models  # noqa: E402
+
+
+@pytest.fixture
+def db():
+    models.Base.metadata.create_all(bind=models.engine)
+    yield models.SessionLocal
+    models.Base.metadata.drop_all(bind=models.engine)
+
+
+@pytest.fixture
+def fake_redis():
+    return fakeredis.FakeRedis(decode_responses=True)
@@ -0,0 +1,102 @@
+import threading
+import time
+import pytest
+from app import candles
+
+TF = 60
+
+
+class FakeAgent:
+    def __init__(self, empty=()):
+        self.calls = []
+        self.empty = set(empty)
+
+    def _bars(self, pair, count, timestamp):
+        if pair in self.empty:
+            return []
+        end = timestamp // TF * TF
+        return [{"from": end - i * TF, "close": 1.0 + i} for i in reversed(range(count))]
+
+    def get_candles(self, pair, timeframe, count, timestamp):
+        self.calls.append(([pair], count))
+        return self._bars(pair, count, timestamp)
+
+    def get_candles_multi(self, pairs, timeframe, count, timestamp):
+        self.calls.append((list(pairs), count))
+        return {pair: self._bars(pair, count, timestamp) for pair in pairs}
+
+
+@pytest.fixture
+def cache(fake_redis, monkeypatch):
+    monkeypatch.setattr(candles, "r", fake_redis)
+    return fake_redis
+
+
+def test_stale_pairs_share_one_agent_call(cache):
+    agent = FakeAgent()
+    got = candles.get_candles_multi(agent, ["EURUSD-OTC", "GBP/USD OTC"], TF, 10)
+    assert agent.calls == [(["EURUSD-OTC", "GBP/USD OTC"], 10)]
+    assert [len(rows) for rows in got.values()] == [10, 10]
+    # Both spellings land in the same normalised cache key
+    assert cache.zcard(candles.candles_key("GBPUSD-OTC", TF)) == 10
+
+
+def test_a_second_caller_in_the_window_reads_the_cache(cache):
+    agent = FakeAgent()
+    first = candles.get_candles(agent, "EURUSD-OTC", TF, 10)
+    assert candles.get_candles(agent, "EURUSD-OTC", TF, 10) == first
+    assert len(agent.calls) == 1
+
+
+def test_refresh_only_asks_for_the_missing_bars(cache, monkeypatch):
+    agent = FakeAgent()
+    now = 1_700_000_000 // TF * TF + 5
+    monkeypatch.setattr(candles.time, "time", lambda: now)
+    candles.get_candles(agent, "EURUSD-OTC", TF, 10)
+    monkeypatch.setattr(candles.time, "time", lambda: now + 3 * TF)
+    rows = candles.get_candles(agent, "EURUSD-OTC", TF, 10)
+    # Three new bars plus the one that was still forming
+    assert agent.calls[-1] == (["EURUSD-OTC"], 4)
+    assert [row["from"] for row in rows] == [now // TF * TF + (i - 6) * TF for i in range(10)]
+
+
+def test_failed_fetch_releases_the_claim(cache):
+    agent = FakeAgent(empty={"EURUSD-OTC"})
+    assert candles.get_candles(agent, "EURUSD-OTC", TF, 10) == []
+    agent.empty.clear()
+    assert len(candles.get_candles(agent, "EURUSD-OTC", TF, 10)) == 10
+    assert len(agent.calls) == 2
+
+
+def test_bar_closed_before_the_last_refresh_is_not_served(cache, monkeypatch):
+    # The cache was topped up while the bar was still forming and its
+    # claim is still held: a caller for the next bar gets nothing rather
+    # than the partial bar
+    monkeypatch.setattr(candles, "FRESH_SECONDS", 0.2)
+    bar = int(time.time()) // TF * TF
+    candles.store_candles("EURUSD-OTC", TF, [{"from": bar - TF, "close": 1.0}], refreshed_at=bar - 1)
+    cache.set(f"{candles.candles_key('EURUSD-OTC', TF)}:fresh:{bar}", "1")
+    agent = FakeAgent()
+    assert candles.get_candles(agent, "EURUSD-OTC", TF, 10, closed_before=bar) == []
+    assert agent.calls == []
+
+
+def test_waiting_caller_gets_the_claimers_refresh(cache, monkeypatch):
+    monkeypatch.setattr(candles, "FRESH_SECONDS", 2)
+    bar = int(time.time()) // TF * TF
+    cache.set(f"{candles.candles_key('EURUSD-OTC', TF)}:fresh:{bar}", "1")
+
+    def claimer():
+        time.sleep(0.2)
+        candles.store_candles("EURUSD-OTC", TF, [{"from": bar - TF, "close": 2.0}], refreshed_at=time.time())
+    thread = threading.Thread(target=claimer)
+    thread.start()
+    rows = candles.get_candles(FakeAgent(), "EURUSD-OTC", TF, 10, closed_before=bar)
+    thread.join()
+    assert rows == [{"from": bar - TF, "close": 2.0}]
+
+
+def test_claimer_serves_the_bar_it_fetched(cache):
+    bar = int(time.time()) // TF * TF
+    rows = candles.get_candles(FakeAgent(), "EURUSD-OTC", TF, 10, closed_before=bar)
+    assert len(rows) == 10 and float(cache.get(candles.refreshed_key("EURUSD-OTC", TF))) >= bar
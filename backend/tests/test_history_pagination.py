@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+import pytest
+import fakeredis
+from fastapi.testclient import TestClient
+from app import main
+from app.models import Trade, Session
+
+T0 = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def client(db, server, monkeypatch):
+    monkeypatch.setattr(main.firebase_tokens, "cached_uid", lambda token: "u")
+    monkeypatch.setattr(main, "ar", fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    return TestClient(main.app)
+
+
+def _pages(client, path, limit):
+    pages, cursor = [], None
+    while True:
+        params = {"limit": limit}
+        if cursor:
+            params["cursor"] = cursor
+        resp = client.get(path, params=params, headers={"Authorization": "Bearer t"})
+        assert resp.status_code == 200
+        pages.append(resp.json())
+        cursor = resp.headers.get("X-Next-Cursor")
+        if not cursor:
+            return pages
+
+
+def test_trades_keyset_pages(client, db):
+    with db() as s:
+        # Three trades per timestamp, so pages split inside a tie
+        for i in range(25):
+            s.add(Trade(user_id="u", pair=f"P{i}", amount=1, created_at=T0 + timedelta(seconds=i // 3)))
+        s.add(Trade(user_id="other", pair="X", amount=1, created_at=T0 + timedelta(hours=1)))
+        s.commit()
+    pages = _pages(client, "/me/trades", 10)
+    assert [len(p) for p in pages] == [10, 10, 5]
+    ids = [t["id"] for page in pages for t in page]
+    expected = sorted(range(1, 26), key=lambda i: (-((i - 1) // 3), -i))
+    assert ids == expected
+
+
+def test_full_last_page_ends_with_empty_page(client, db):
+    with db() as s:
+        for i in range(20):
+            s.add(Trade(user_id="u", pair="P", amount=1, created_at=T0 + timedelta(seconds=i)))
+        s.commit()
+    pages = _pages(client, "/me/trades", 10)
+    assert [len(p) for p in pages] == [10, 10, 0]
+
+
+def test_sessions_keyset_pages_with_counters(client, db, server):
+    with db() as s:
+        for i in range(7):
+            s.add(Session(id=f"s{i}", user_id="u", mode="auto", status="running", started_at=T0 + timedelta(seconds=i // 2)))
+        s.commit()
+    fakeredis.FakeRedis(server=server).hset("session:u:s6", mapping={"reject_count": 2, "retry_count": 1, "heartbeat": 12.5})
+    pages = _pages(client, "/me/sessions", 3)
+    assert [len(p) for p in pages] == [3, 3, 1]
+    rows = [row for page in pages for row in page]
+    assert [row["id"] for row in rows] == ["s6", "s5", "s4", "s3", "s2", "s1", "s0"]
+    assert (rows[0]["reject_count"], rows[0]["retry_count"], rows[0]["heartbeat"]) == (2, 1, 12.5)
+    # No session hash reads as zero counters
+    assert (rows[1]["reject_count"], rows[1]["heartbeat_missed"], rows[1]["heartbeat"]) == (0, 0, 0.0)
+
+
+def test_invalid_cursor_is_rejected(client, db):
+    resp = client.get("/me/trades", params={"cursor": "yesterday_x"}, headers={"Authorization": "Bearer t"})
+    assert resp.status_code == 400
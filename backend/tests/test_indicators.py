@@ -0,0 +1,84 @@
+import random
+import numpy as np
+import pytest
+from app.indicators import IndicatorEngine, candle_tensor, TENSOR_FIELDS
+from app.strategies import STRATEGIES, Strategy
+
+BARS = 100
+INCREMENTAL = [name for name, strategy in STRATEGIES.items() if strategy.incremental()]
+
+
+def _candles(count, seed):
+    rnd = random.Random(seed)
+    price = 1.0 + seed / 10
+    candles = []
+    for i in range(count):
+        close = price + rnd.gauss(0, 0.0004)
+        candles.append({"from": 1_700_000_000 + i * 60, "open": price, "close": close, "volume": rnd.randint(1, 100),
+                        "max": max(price, close) + abs(rnd.gauss(0, 0.0002)), "min": min(price, close) - abs(rnd.gauss(0, 0.0002))})
+        price = close
+    return candles
+
+
+def _batch_last(strategy, window):
+    batch = candle_tensor([window])
+    columns = {field: batch[:, :, i] for i, field in enumerate(TENSOR_FIELDS)}
+    for ind in strategy.indicators():
+        columns.update(ind.batch(batch))
+    return {name: float(values[0, -1]) for name, values in columns.items() if not np.isnan(values[0, -1])}
+
+
+def _bound(name, window):
+    # A recompute seeds its smoothing at the window start; a warm engine
+    # carries the bars before it. The gap decays by (1 - alpha) per bar.
+    if name.startswith("EMA_"):
+        length = int(name.split("_")[1])
+        closes = [c["close"] for c in window]
+        return (1 - 2 / (length + 1)) ** (len(window) - length) * (max(closes) - min(closes))
+    if name == "RSI":
+        return 0.1
+    if name.startswith("KC"):
+        # Keltner's basis is an EMA_20 of the close
+        closes = [c["close"] for c in window]
+        return 2 * (1 - 2 / 21) ** (len(window) - 20) * (max(closes) - min(closes))
+    return 1e-9
+
+
+@pytest.mark.parametrize("name", INCREMENTAL)
+def test_fresh_engine_matches_the_batch_path(name):
+    strategy = STRATEGIES[name]
+    window = _candles(BARS, seed=3)
+    last, _ = IndicatorEngine(strategy.indicators).rows(window)
+    expected = _batch_last(strategy, window)
+    assert {k: last[k] for k in expected} == pytest.approx(expected, rel=0, abs=1e-9)
+
+
+@pytest.mark.parametrize("name", INCREMENTAL)
+@pytest.mark.parametrize("seed", range(5))
+def test_warm_engine_stays_within_the_seed_residual(name, seed):
+    strategy = STRATEGIES[name]
+    candles = _candles(BARS + 400, seed)
+    engine = IndicatorEngine(strategy.indicators)
+    # One tick per bar over a sliding window, as live sessions see it
+    for end in range(BARS, len(candles) + 1):
+        window = candles[end - BARS:end]
+        last, _ = engine.rows(window)
+    expected = _batch_last(strategy, window)
+    for column, value in expected.items():
+        assert abs(last[column] - value) <= _bound(column, window), column
+
+
+def test_incremental_flag_is_cached_per_class():
+    calls = []
+
+    class Probe(Strategy):
+        def indicators(self):
+            calls.append(1)
+            return []
+
+    probe = Probe("probe")
+    assert not probe.incremental() and not probe.incremental()
+    assert probe.generate_signal(_candles(60, 0), "EURUSD", 60) is None
+    assert len(calls) == 1
+    assert STRATEGIES["Trend Continuation"].incremental()
+    assert not STRATEGIES["Random Strategy"].incremental()
@@ -0,0 +1,98 @@
+import time
+import pytest
+from app import journal
+from app.models import Trade, Session
+
+
+@pytest.fixture
+def stream(db, fake_redis, monkeypatch):
+    monkeypatch.setattr(journal, "r", fake_redis)
+    journal._ensure_group()
+    with db() as s:
+        s.add(Session(id="s1", user_id="u", mode="auto", status="running"))
+        s.commit()
+
+    def read(consumer=journal.CONSUMER):
+        resp = fake_redis.xreadgroup(journal.GROUP, consumer, {journal.STREAM: ">"}, count=100)
+        return resp[0][1] if resp else []
+    return fake_redis, read
+
+
+def _state(db):
+    with db() as s:
+        trades = {t.order_id: (t.status, t.result, t.pnl) for t in s.query(Trade).all()}
+        session = s.get(Session, "s1")
+        return trades, (session.profit, session.trades)
+
+
+def test_placed_and_settled_in_one_batch(stream, db):
+    client, read = stream
+    journal.append("placed", "u", "s1", 1, pair="EURUSD-OTC", direction="CALL", amount=5, expiry=60)
+    journal.append("placed", "u", "s1", 2, pair="GBPUSD-OTC", direction="PUT", amount=5, expiry=60)
+    journal.append("settled", "u", "s1", 1, status="closed", result="win", pnl=4.25)
+    journal.append("settled", "u", "s1", 2, status="timeout", result="unknown")
+    journal._write(read())
+    assert _state(db) == ({"1": ("closed", "win", 4.25), "2": ("timeout", "unknown", 0.0)}, (4.25, 2))
+    # Written entries are acked and removed from the stream
+    assert client.xlen(journal.STREAM) == 0
+    assert client.xpending(journal.STREAM, journal.GROUP)["pending"] == 0
+
+
+def test_replaying_a_batch_changes_nothing(stream, db):
+    client, read = stream
+    journal.append("placed", "u", "s1", 1, pair="EURUSD-OTC", direction="CALL", amount=5, expiry=60)
+    journal.append("settled", "u", "s1", 1, status="closed", result="lose", pnl=-5)
+    entries = read()
+    journal._apply(entries)
+    first = _state(db)
+    # A writer that committed but died before acking replays the same batch
+    journal._apply(entries)
+    assert _state(db) == first == ({"1": ("closed", "lose", -5.0)}, (-5.0, 1))
+
+
+def test_settlement_ahead_of_its_placement_is_retried(stream, db, monkeypatch):
+    client, read = stream
+    monkeypatch.setattr(journal, "RETRY_IDLE", 0)
+    journal.append("settled", "u", "s1", 1, status="closed", result="win", pnl=4.25)
+    journal._write(read())
+    assert _state(db) == ({}, (0.0, 0))
+    # Held back unacked rather than dropped
+    assert client.xpending(journal.STREAM, journal.GROUP)["pending"] == 1
+
+    journal.append("placed", "u", "s1", 1, pair="EURUSD-OTC", direction="CALL", amount=5, expiry=60)
+    journal._write(read())
+    _, claimed = journal._claim_idle("0-0")
+    journal._write(claimed)
+    assert _state(db) == ({"1": ("closed", "win", 4.25)}, (4.25, 1))
+    assert client.xlen(journal.STREAM) == 0
+
+
+def test_entries_of_a_dead_writer_are_reclaimed(stream, db, monkeypatch):
+    client, read = stream
+    monkeypatch.setattr(journal, "RETRY_IDLE", 0)
+    journal.append("placed", "u", "s1", 1, pair="EURUSD-OTC", direction="CALL", amount=5, expiry=60)
+    read(consumer="crashed-writer")
+    _, claimed = journal._claim_idle("0-0")
+    journal._write(claimed)
+    assert _state(db) == ({"1": ("placed", "pending", 0.0)}, (0.0, 1))
+    assert client.xpending(journal.STREAM, journal.GROUP)["pending"] == 0
+
+
+def test_orphaned_settlement_is_dropped_after_its_ttl(stream, db, monkeypatch):
+    client, read = stream
+    journal.append("settled", "u", "s1", 9, status="closed", result="win", pnl=1)
+    monkeypatch.setattr(journal, "ORPHAN_TTL", 0)
+    time.sleep(0.01)
+    journal._write(read())
+    assert client.xlen(journal.STREAM) == 0
+    assert _state(db) == ({}, (0.0, 0))
+
+
+def test_concurrent_placement_is_inserted_once(stream, db):
+    row = dict(user_id="u", session_id="s1", order_id="1", status="placed", result="pending", pnl=0.0)
+    with db() as s:
+        assert journal._insert_new(s, [row]) == [("1", "s1")]
+        # A second writer that read the table before the first committed
+        assert journal._insert_new(s, [row, dict(row, order_id="2")]) == [("2", "s1")]
+        s.commit()
+    assert sorted(_state(db)[0]) == ["1", "2"]
@@ -0,0 +1,55 @@
+import json
+import threading
+import fakeredis
+import pytest
+from app import iq_option, wire
+
+
+@pytest.fixture
+def channel(monkeypatch):
+    server = fakeredis.FakeServer()
+    client = fakeredis.FakeRedis(server=server, decode_responses=True)
+    monkeypatch.setattr(iq_option, "r", client)
+    monkeypatch.setattr(iq_option, "raw_r", fakeredis.FakeRedis(server=server))
+    return iq_option.RpcChannel(), client
+
+
+def _agent(client, replies):
+    # Answers every command on agent:u:cmd through its reply_to channel
+    pubsub = client.pubsub()
+    pubsub.subscribe("agent:u:cmd")
+    pubsub.get_message(timeout=1)
+
+    def serve():
+        for _ in range(replies):
+            msg = None
+            while not msg:
+                msg = pubsub.get_message(timeout=1)
+            cmd = json.loads(msg["data"])
+            client.publish(cmd["reply_to"], wire.dumps({"id": cmd["id"], "status": "ok", "result": cmd["cmd"]}, cmd["fmt"]))
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_concurrent_calls_get_their_own_replies(channel):
+    rpc, client = channel
+    agent = _agent(client, 4)
+    results = {}
+
+    def call(name):
+        results[name] = rpc.call("u", {"id": f"id-{name}", "cmd": name}, timeout=5)
+    callers = [threading.Thread(target=call, args=(name,)) for name in ("ping", "balance", "buy", "check_win")]
+    for caller in callers:
+        caller.start()
+    for caller in callers:
+        caller.join()
+    agent.join(timeout=5)
+    assert {name: resp["result"] for name, resp in results.items()} == {n: n for n in ("ping", "balance", "buy", "check_win")}
+    assert rpc._pending == {}
+
+
+def test_unanswered_call_times_out(channel):
+    rpc, _ = channel
+    assert rpc.call("u", {"id": "lost", "cmd": "ping"}, timeout=0.2) is None
+    assert rpc._pending == {}
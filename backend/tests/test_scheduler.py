@@ -0,0 +1,77 @@
+import json
+import pytest
+from app import scheduler
+
+
+@pytest.fixture
+def sched(fake_redis, monkeypatch):
+    monkeypatch.setattr(scheduler, "r", fake_redis)
+    monkeypatch.setattr(scheduler, "_claim", fake_redis.register_script(scheduler._claim.script))
+    monkeypatch.setattr(scheduler, "_reschedule", fake_redis.register_script(scheduler._reschedule.script))
+    sent = []
+    monkeypatch.setattr(scheduler.celery, "send_task", lambda name, args=None, queue=None: sent.append((name, args, queue)))
+    return fake_redis, sent
+
+
+def _score(client, member="u:s"):
+    return client.zscore(scheduler.DUE_KEY, member)
+
+
+def test_claim_leases_only_due_sessions(sched):
+    client, _ = sched
+    client.zadd(scheduler.DUE_KEY, {"u:a": 10, "u:b": 20, "u:c": 30})
+    assert scheduler._claim(keys=[scheduler.DUE_KEY], args=[20, 500, 10]) == ["u:a", "u:b"]
+    # A lost tick only delays its session by the lease
+    assert [_score(client, m) for m in ("u:a", "u:b", "u:c")] == [500, 500, 30]
+    assert scheduler._claim(keys=[scheduler.DUE_KEY], args=[20, 500, 10]) == []
+
+
+def test_reschedule_keeps_a_wake_that_arrived_during_the_tick(sched, monkeypatch):
+    client, _ = sched
+    client.hset("session:u:s", "status", "running")
+    monkeypatch.setattr(scheduler.time, "time", lambda: 100.0)
+    client.zadd(scheduler.DUE_KEY, {"u:s": 100 + scheduler.LEASE})
+    scheduler.reschedule("u", "s", 60)
+    assert (_score(client), client.hget("session:u:s", "next_tick")) == (160, "160.0")
+
+    client.zadd(scheduler.DUE_KEY, {"u:s": 120 + scheduler.LEASE})
+    scheduler.wake("u", "s", at=95)
+    scheduler.reschedule("u", "s", 60)
+    assert (_score(client), client.hget("session:u:s", "next_tick")) == (95, "95")
+
+
+def test_wake_never_delays_or_revives(sched):
+    client, _ = sched
+    scheduler.wake("u", "gone", at=50)
+    assert _score(client, "u:gone") is None
+    client.zadd(scheduler.DUE_KEY, {"u:s": 50})
+    scheduler.wake("u", "s", at=80)
+    assert _score(client) == 50
+
+
+def test_dispatch_batches_running_sessions_and_drops_the_rest(sched, monkeypatch):
+    client, sent = sched
+    monkeypatch.setattr(scheduler, "CHUNK", 2)
+    config = json.dumps({"pairs": ["EURUSD-OTC"]})
+    members = [f"u:s{i}" for i in range(3)]
+    for member in members:
+        client.hset(f"session:{member}", mapping={"status": "running", "config": config})
+    client.hset("session:u:halted", mapping={"status": "halted", "config": config})
+    client.zadd(scheduler.DUE_KEY, {m: 1 for m in members + ["u:halted"]})
+    scheduler._dispatch(members + ["u:halted"])
+    assert _score(client, "u:halted") is None
+    assert sent == [
+        ("axon.release_candle_streams", ["u", "halted"], None),
+        ("axon.analyze_batch", [[["u", "s0", {"pairs": ["EURUSD-OTC"]}], ["u", "s1", {"pairs": ["EURUSD-OTC"]}]]], "control"),
+        ("axon.analyze_market", ["u", "s2", {"pairs": ["EURUSD-OTC"]}], "control"),
+    ]
+
+
+@pytest.mark.parametrize("heartbeat, next_tick, now, overdue", [
+    (90, 100, 130, 30),
+    (101, 100, 500, 0),
+    (0, None, 500, 0),
+    (90, 100, 95, 0),
+])
+def test_overdue_is_measured_from_the_due_tick(heartbeat, next_tick, now, overdue):
+    assert scheduler.overdue(heartbeat, next_tick, now) == overdue
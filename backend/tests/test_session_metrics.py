@@ -0,0 +1,87 @@
+import pytest
+from app import session, wire
+
+
+@pytest.fixture
+def metrics(fake_redis, monkeypatch):
+    monkeypatch.setattr(session, "r", fake_redis)
+    monkeypatch.setattr(session, "_update_metrics", fake_redis.register_script(session.UPDATE_METRICS_LUA))
+    pubsub = fake_redis.pubsub()
+    pubsub.psubscribe("metrics:*", "logs:*")
+    while pubsub.get_message(timeout=0.01):
+        pass
+
+    def published():
+        messages = []
+        while True:
+            msg = pubsub.get_message(timeout=0.01)
+            if not msg:
+                return messages
+            messages.append((msg["channel"], wire.loads(msg["data"])))
+    return fake_redis, published
+
+
+def _session(client, **fields):
+    client.hset("session:u:s", mapping={"status": "running", "active_trades": 1, **fields})
+    return lambda name: client.hget("session:u:s", name)
+
+
+def test_win_resets_the_losing_streak(metrics):
+    client, published = metrics
+    field = _session(client, consecutive_losses=2, wins=1)
+    assert session.update_metrics("u", "s", 0.85, True, release_trade=True) is None
+    assert (field("wins"), field("consecutive_losses"), field("trades"), field("active_trades")) == ("2", "0", "1", "0")
+    assert float(field("profit")) == pytest.approx(0.85)
+    assert published() == [("metrics:u", {"type": "metrics", "session_id": "s", "pnl": 0.85, "trades": 1, "wins": 2, "consecutive_losses": 0})]
+
+
+def test_loss_extends_the_streak_and_tie_leaves_it(metrics):
+    client, published = metrics
+    field = _session(client, consecutive_losses=1)
+    session.update_metrics("u", "s", -1.0, False)
+    assert field("consecutive_losses") == "2"
+    session.update_metrics("u", "s", 0.0, False, tie=True)
+    assert (field("consecutive_losses"), field("trades"), field("wins")) == ("2", "2", None)
+    # Without release_trade the active trade stays counted
+    assert field("active_trades") == "1"
+
+
+@pytest.mark.parametrize("limits, pnl, won, reason", [
+    ({"stop_loss": 2}, -2.0, False, "stop_loss"),
+    ({"take_profit": 1.5}, 1.7, True, "take_profit"),
+    ({"max_consecutive_losses": 3, "consecutive_losses": 2}, -1.0, False, "max_consecutive_losses"),
+    ({"max_trades": 1}, 0.85, True, "max_trades"),
+])
+def test_safety_limits_halt_the_session(metrics, limits, pnl, won, reason):
+    client, published = metrics
+    field = _session(client, **limits)
+    assert session.update_metrics("u", "s", pnl, won, release_trade=True) == reason
+    assert field("status") == "halted"
+    assert published()[-1] == ("metrics:u", {"type": "halt", "reason": reason, "session_id": "s"})
+
+
+def test_limits_not_reached_keep_running(metrics):
+    client, published = metrics
+    field = _session(client, stop_loss=5, take_profit=5, max_consecutive_losses=3, max_trades=10)
+    assert session.update_metrics("u", "s", -1.0, False) is None
+    assert field("status") == "running"
+    assert [msg["type"] for _, msg in published()] == ["metrics"]
+
+
+def test_missing_session_only_publishes_the_log(metrics):
+    client, published = metrics
+    log = {"type": "log", "message": "Trade finished: WIN PnL: 1"}
+    assert session.update_metrics("u", "gone", 1.0, True, log=log) is None
+    assert not client.exists("session:u:gone")
+    assert published() == [("logs:u", log)]
+
+
+def test_pending_trade_is_applied_once(metrics):
+    client, published = metrics
+    field = _session(client)
+    client.zadd("trades:pending", {"u:s:1": 1})
+    assert session.update_metrics("u", "s", 0.85, True, release_trade=True, pending=("trades:pending", "u:s:1")) is None
+    published()
+    assert session.update_metrics("u", "s", 0.85, True, release_trade=True, pending=("trades:pending", "u:s:1")) == session.DUPLICATE
+    assert (field("trades"), field("active_trades"), client.zcard("trades:pending")) == ("1", "0", 0)
+    assert published() == []
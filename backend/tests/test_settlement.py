@@ -0,0 +1,36 @@
+import pytest
+from app import journal, session, tasks
+
+
+@pytest.fixture
+def settle(fake_redis, monkeypatch):
+    for module in (tasks, session, journal):
+        monkeypatch.setattr(module, "r", fake_redis)
+    monkeypatch.setattr(session, "_update_metrics", fake_redis.register_script(session.UPDATE_METRICS_LUA))
+    monkeypatch.setattr(tasks, "_release_pending", fake_redis.register_script(tasks._release_pending.script))
+    fake_redis.hset("session:u:s", mapping={"status": "running", "active_trades": 1})
+    fake_redis.zadd(tasks.PENDING_TRADES, {tasks.pending_member("u", "s", "7"): 1})
+    return fake_redis
+
+
+def test_a_trade_settles_once(settle):
+    assert tasks.settle_trade("u", "s", "7", "closed", 0.85, "win")
+    assert not tasks.settle_trade("u", "s", "7", "closed", 0.85, "win")
+    assert not tasks.settle_trade("u", "s", "7", "timeout", 0.0)
+    assert settle.hmget("session:u:s", "trades", "wins", "active_trades") == ["1", "1", "0"]
+
+
+def test_trade_stays_pending_when_the_metrics_update_fails(settle, monkeypatch):
+    def broken(**kwargs):
+        raise ConnectionError("redis went away")
+    monkeypatch.setattr(session, "_update_metrics", broken)
+    with pytest.raises(ConnectionError):
+        tasks.settle_trade("u", "s", "7", "closed", -1.0, "loss")
+    assert settle.zcard(tasks.PENDING_TRADES) == 1
+    assert settle.hget("session:u:s", "active_trades") == "1"
+
+
+def test_a_timeout_only_frees_the_slot(settle):
+    assert tasks.settle_trade("u", "s", "7", "timeout", 0.0)
+    assert settle.hmget("session:u:s", "trades", "active_trades") == [None, "0"]
+    assert settle.zcard(tasks.PENDING_TRADES) == 0
@@ -0,0 +1,63 @@
+import json
+import threading
+import time
+import pytest
+from app import tasks
+
+TF = 60
+CANDLES = {"EURUSD-OTC": [{"from": 600, "close": 1.0}], "GBPUSD-OTC": [{"from": 600, "close": 2.0}]}
+
+
+class CountingStrategy:
+    def __init__(self, delay=0.0):
+        self.calls = []
+        self.delay = delay
+
+    def generate_signal(self, candles, pair=None, timeframe=None):
+        self.calls.append(pair)
+        time.sleep(self.delay)
+        return {"direction": "CALL", "confidence": candles[-1]["close"]}
+
+
+@pytest.fixture
+def signals(fake_redis, monkeypatch):
+    monkeypatch.setattr(tasks, "r", fake_redis)
+    monkeypatch.setattr(tasks, "SIGNAL_WAIT", 0.5)
+    return fake_redis
+
+
+def test_sessions_on_the_same_bar_evaluate_once(signals):
+    strategy = CountingStrategy()
+    first = tasks._shared_signals(strategy, "Probe", list(CANDLES), TF, CANDLES)
+    second = tasks._shared_signals(strategy, "Probe", list(CANDLES), TF, CANDLES)
+    assert first == second == {"EURUSD-OTC": {"direction": "CALL", "confidence": 1.0}, "GBPUSD-OTC": {"direction": "CALL", "confidence": 2.0}}
+    assert sorted(strategy.calls) == ["EURUSD-OTC", "GBPUSD-OTC"]
+    assert json.loads(signals.get(tasks._signal_key("Probe", "EURUSD-OTC", TF, 600))) == first["EURUSD-OTC"]
+
+
+def test_waiting_session_reads_the_claimers_result(signals):
+    slow, waiting = CountingStrategy(delay=0.2), CountingStrategy()
+    pairs = ["EURUSD-OTC"]
+    owner = threading.Thread(target=tasks._shared_signals, args=(slow, "Probe", pairs, TF, CANDLES))
+    owner.start()
+    time.sleep(0.05)
+    got = tasks._shared_signals(waiting, "Probe", pairs, TF, CANDLES)
+    owner.join()
+    assert got == {"EURUSD-OTC": {"direction": "CALL", "confidence": 1.0}}
+    assert (slow.calls, waiting.calls) == (["EURUSD-OTC"], [])
+
+
+def test_stuck_claim_is_evaluated_locally_without_caching(signals):
+    key = tasks._signal_key("Probe", "EURUSD-OTC", TF, 600)
+    signals.set(key, tasks._SIGNAL_PENDING)
+    strategy = CountingStrategy()
+    assert tasks._shared_signals(strategy, "Probe", ["EURUSD-OTC"], TF, CANDLES)["EURUSD-OTC"]["confidence"] == 1.0
+    assert strategy.calls == ["EURUSD-OTC"]
+    assert signals.get(key) == tasks._SIGNAL_PENDING
+
+
+def test_a_new_bar_is_a_new_key(signals):
+    strategy = CountingStrategy()
+    tasks._shared_signals(strategy, "Probe", ["EURUSD-OTC"], TF, CANDLES)
+    tasks._shared_signals(strategy, "Probe", ["EURUSD-OTC"], TF, {"EURUSD-OTC": [{"from": 660, "close": 1.5}]})
+    assert strategy.calls == ["EURUSD-OTC", "EURUSD-OTC"]
@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+from app import wire
+from app.stream_hub import StreamBuffer, classify, LATEST, LEVELS
+
+CANDLES = [{"from": 60, "close": 1.5, "volume": 3}, {"from": 120, "close": 1.25, "volume": 4}]
+
+
+def test_unknown_or_unavailable_formats_fall_back_to_json(monkeypatch):
+    assert wire.negotiate("xml") == wire.JSON
+    monkeypatch.setattr(wire, "msgpack", None)
+    assert wire.negotiate(wire.MSGPACK) == wire.JSON
+    assert wire.dumps({"a": 1}, wire.MSGPACK) == '{"a":1}'
+
+
+@pytest.mark.parametrize("fmt", [wire.JSON, wire.MSGPACK])
+def test_payloads_round_trip_and_are_recognised(fmt):
+    pytest.importorskip("msgpack")
+    data = wire.dumps({"type": "signal", "candles": wire.to_columns(CANDLES)}, fmt)
+    assert wire.format_of(data if isinstance(data, bytes) else data.encode()) == fmt
+    assert wire.to_rows(wire.loads(data)["candles"]) == CANDLES
+
+
+def test_rows_are_accepted_as_is():
+    assert wire.to_rows(CANDLES) is CANDLES
+    assert wire.to_rows(None) == [] and wire.to_columns([]) == {}
+
+
+def _drain(buffer):
+    async def take():
+        return [await buffer.get() for _ in range(count)]
+    count = len(buffer.urgent) + len(buffer.latest) + len(buffer.logs)
+    return asyncio.run(take())
+
+
+def test_signals_overtake_metrics_and_logs():
+    buffer = StreamBuffer()
+    buffer.offer(*classify("logs:u", {"type": "log"}), "log")
+    buffer.offer(*classify("metrics:u", {"type": "metrics", "session_id": "s"}), "metrics")
+    buffer.offer(*classify("signals:u", {"type": "signal"}), "signal")
+    assert _drain(buffer) == ["signal", "metrics", "log"]
+
+
+def test_periodic_metrics_keep_only_the_newest_per_session_and_field():
+    buffer = StreamBuffer()
+    for i in range(3):
+        buffer.offer(*classify("metrics:u", {"type": "metrics", "session_id": "s"}), f"m{i}")
+    buffer.offer(*classify("metrics:u", {"type": "counter", "session_id": "s", "reject_count": 1}), "rejects")
+    buffer.offer(*classify("metrics:u", {"type": "counter", "session_id": "s", "retry_count": 1}), "retries")
+    buffer.offer(*classify("metrics:u", {"type": "halt", "session_id": "s"}), "halt")
+    assert classify("metrics:u", {"type": "metrics", "session_id": "s"})[0] == LATEST
+    assert _drain(buffer) == ["halt", "m2", "rejects", "retries"]
+
+
+def test_full_log_queue_drops_debug_lines_first():
+    buffer = StreamBuffer(size=2)
+    buffer.offer(*classify("logs:u", {"type": "debug"}), "debug")
+    buffer.offer(*classify("logs:u", {"type": "log"}), "log")
+    buffer.offer(*classify("logs:u", {"type": "error"}), "error")
+    assert _drain(buffer) == ["log", "error"] and buffer.dropped == 1
+
+
+def test_level_filters_logs_but_not_signals():
+    buffer = StreamBuffer(level="error")
+    buffer.offer(*classify("logs:u", {"type": "log"}), "log")
+    buffer.offer(*classify("signals:u", {"type": "signal"}), "signal")
+    assert _drain(buffer) == ["signal"]
+    assert LEVELS["error"] > LEVELS["log"]